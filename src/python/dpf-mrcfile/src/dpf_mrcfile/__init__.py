@@ -1,16 +1,232 @@
 import math
+import os
 import struct
+import sys
 import time
+from collections.abc import Iterator
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Any
 
 import numpy as np
 
+from .compression import compression_for, open_file, read_into
+from .running_stats import RunningStats
+
 
 def read_single_entity(type_: str, file_handle, n_to_read: int, endian: str) -> Any:
     return struct.unpack(f"{endian}{type_}", file_handle.read(n_to_read))[0]
 
 
+HEADER_SIZE = 1024
+
+NATIVE_MACHINE_STAMP = (68, 65, 0, 0) if sys.byteorder == "little" else (17, 17, 0, 0)
+"machine stamp of the native byte order headers and data are written in"
+
+_HEADER_FIELDS = [
+    ("nx", "i4"),
+    ("ny", "i4"),
+    ("nz", "i4"),
+    ("imod", "i4"),
+    ("nxstart", "i4"),
+    ("nystart", "i4"),
+    ("nzstart", "i4"),
+    ("mx", "i4"),
+    ("my", "i4"),
+    ("mz", "i4"),
+    ("xlen", "f4"),
+    ("ylen", "f4"),
+    ("zlen", "f4"),
+    ("alpha", "f4"),
+    ("beta", "f4"),
+    ("gamma", "f4"),
+    ("mapc", "i4"),
+    ("mapr", "i4"),
+    ("maps", "i4"),
+    ("amin", "f4"),
+    ("amax", "f4"),
+    ("amean", "f4"),
+    ("ispg", "i4"),
+    ("NSYMBT", "i4"),
+    ("extra_space", "V100"),
+    ("originx", "f4"),
+    ("originy", "f4"),
+    ("originz", "f4"),
+    ("mapstring", "V4"),
+    ("machine_stamp", "i1", (4,)),
+    ("rms_dev", "f4"),
+    ("num_labels", "i4"),
+    ("text_header", "V80", (10,)),
+]
+"layout of the 1024 byte MRC2014 header, see MRC for the meaning of every field"
+
+HEADER_NUMBER_FIELDS = [x[0] for x in _HEADER_FIELDS if x[1] in ("i4", "f4")]
+
+
+def header_dtype(endian: str = "<") -> np.dtype:
+    """Structured dtype of the MRC header with byte order endian."""
+    return np.dtype(
+        [(name, f"{endian}{type_}" if type_ in ("i4", "f4") else type_, *shape) for name, type_, *shape in _HEADER_FIELDS]
+    )
+
+
+# fields shared by the FEI1 and FEI2 extended header records (one record per
+# section, little endian, packed); FEI2 records carry more fields after these
+_FEI_EXTENDED_HEADER_FIELDS = [
+    ("metadata_size", "<i4"),
+    ("metadata_version", "<i4"),
+    ("bitmask_1", "<u4"),
+    ("timestamp", "<f8"),
+    ("microscope_type", "S16"),
+    ("d_number", "S16"),
+    ("application", "S16"),
+    ("application_version", "S16"),
+    ("ht", "<f8"),
+    ("dose", "<f8"),
+    ("alpha_tilt", "<f8"),
+    ("beta_tilt", "<f8"),
+    ("x_stage", "<f8"),
+    ("y_stage", "<f8"),
+    ("z_stage", "<f8"),
+    ("tilt_axis_angle", "<f8"),
+    ("dual_axis_rotation", "<f8"),
+    ("pixel_size_x", "<f8"),
+    ("pixel_size_y", "<f8"),
+    ("unused_range", "V48"),
+    ("defocus", "<f8"),
+    ("stem_defocus", "<f8"),
+    ("applied_defocus", "<f8"),
+    ("instrument_mode", "<i4"),
+    ("projection_mode", "<i4"),
+    ("objective_lens_mode", "S16"),
+    ("high_magnification_mode", "S16"),
+    ("probe_mode", "<i4"),
+    ("eftem_on", "?"),
+    ("magnification", "<f8"),
+    ("bitmask_2", "<u4"),
+    ("camera_length", "<f8"),
+    ("spot_index", "<i4"),
+    ("illuminated_area", "<f8"),
+    ("intensity", "<f8"),
+    ("convergence_angle", "<f8"),
+    ("illumination_mode", "S16"),
+    ("wide_convergence_angle_range", "?"),
+    ("slit_inserted", "?"),
+    ("slit_width", "<f8"),
+    ("acceleration_voltage_offset", "<f8"),
+    ("drift_tube_voltage", "<f8"),
+    ("energy_shift", "<f8"),
+    ("shift_offset_x", "<f8"),
+    ("shift_offset_y", "<f8"),
+    ("shift_x", "<f8"),
+    ("shift_y", "<f8"),
+    ("integration_time", "<f8"),
+    ("binning_width", "<i4"),
+    ("binning_height", "<i4"),
+    ("camera_name", "S16"),
+    ("readout_area_left", "<i4"),
+    ("readout_area_top", "<i4"),
+    ("readout_area_right", "<i4"),
+    ("readout_area_bottom", "<i4"),
+    ("direct_detector_electron_counting", "?"),
+    ("direct_detector_align_frames", "?"),
+]
+
+FEI_EXTENDED_HEADER_TYPES = ("FEI1", "FEI2")
+
+
+def fei_extended_header_dtype(record_size: int) -> np.dtype:
+    """Structured dtype of one FEI1/FEI2 extended header record of record_size bytes.
+
+    Only the fields both versions share are named, the rest of the record is
+    padding.
+    """
+    base = np.dtype(_FEI_EXTENDED_HEADER_FIELDS)
+    if record_size < base.itemsize:
+        msg = f"FEI extended header records of {record_size} bytes are too small"
+        raise RuntimeError(msg)
+    return np.dtype(
+        {
+            "names": base.names,
+            "formats": [base.fields[x][0] for x in base.names],
+            "offsets": [base.fields[x][1] for x in base.names],
+            "itemsize": record_size,
+        }
+    )
+
+
+MODE_DTYPES: dict[int, Any] = {
+    0: "i1",
+    1: "i2",
+    2: "f4",
+    3: [("real", "i2"), ("imag", "i2")],
+    4: "c8",
+    6: "u2",
+    12: "f2",
+}
+"numpy dtype (without byte order) of the data of every supported mode"
+
+
+def dtype_for_mode(imod: int, endian: str = "<") -> np.dtype:
+    """numpy dtype of the data block of an MRC file with mode imod and byte order endian.
+
+    Mode 3 (complex 16-bit integers) has no numpy equivalent, it is a
+    structured dtype with int16 real and imag fields.
+    """
+    if imod not in MODE_DTYPES:
+        msg = f"Unsupported MRC mode {imod}"
+        raise RuntimeError(msg)
+    dtype = MODE_DTYPES[imod]
+    if isinstance(dtype, list):
+        return np.dtype([(name, f"{endian}{field}") for name, field in dtype])
+    return np.dtype(f"{endian}{dtype}")
+
+
+def mode_for_dtype(dtype: Any) -> int:
+    """MRC mode that stores dtype as is, 2 (32-bit real) for dtypes no mode matches."""
+    dtype = np.dtype(dtype).newbyteorder("=")
+    for imod in MODE_DTYPES:
+        if dtype_for_mode(imod, "=") == dtype:
+            return imod
+    return 2
+
+
+WRITE_CHUNK_BYTES = 64 * 1024 * 1024
+"approximate size of the blocks data is converted and written in"
+
+
+def write_data_block(f, data: np.ndarray, dtype: np.dtype) -> None:
+    """Write a (nx, ny, nz) array to f in file (Fortran) order as dtype.
+
+    The array is written in blocks of whole z sections, each converted on its
+    own, so no copy of the full array and no per-voxel python objects are
+    made. F-ordered data of the right dtype is written without any copy.
+    """
+    nx, ny, nz = data.shape
+    z_step = max(1, WRITE_CHUNK_BYTES // max(1, nx * ny * dtype.itemsize))
+    for z in range(0, nz, z_step):
+        # (nz, ny, nx) in C order is (nx, ny, nz) in Fortran order
+        block = data[:, :, z : z + z_step].transpose(2, 1, 0)
+        f.write(np.ascontiguousarray(block, dtype=dtype).data)
+
+
+@contextmanager
+def _replacing_file(filename: str | Path) -> Iterator[Path]:
+    """Yield a temporary path next to filename that replaces it once the block succeeds.
+
+    The file being replaced may be the one the data or the extended header
+    is memory mapped from, so it must not be truncated while it is written.
+    """
+    filename = Path(filename)
+    # keeps the extension, compression is chosen by it
+    tmp_filename = filename.with_name(f".tmp-{os.getpid()}-{filename.name}")
+    try:
+        yield tmp_filename
+        tmp_filename.replace(filename)
+    finally:
+        tmp_filename.unlink(missing_ok=True)
+
+
 class MRC:
     nx: int
     "number of columns in 3d data array"
@@ -27,6 +243,7 @@ class MRC:
     3 transform : complex 16-bit integers
     4 transform : complex 32-bit reals
     6 16-bit unsigned integer
+    12 16-bit float (IEEE754)
     """
 
     nxstart: int
@@ -139,6 +356,13 @@ class MRC:
     text_header: list[str]
     "10x80 character text labels"
 
+    endian: str
+    "byte order of the file that was read, '<' or '>'"
+
+    extended_header_source: Any
+    """where the NSYMBT extended header bytes can be read from: the bytes
+    themselves, the name of an uncompressed file to map them from, or None"""
+
     all_images: np.ndarray
     "Holds all image data in np array"
 
@@ -183,6 +407,7 @@ class MRC:
         3 transform : complex 16-bit integers
         4 transform : complex 32-bit reals
         6 16-bit unsigned integer
+        12 16-bit float (IEEE754)
         """
         # Mode,
         self.imod = 0
@@ -323,6 +548,13 @@ class MRC:
         # 10x80 character text labels
         self.text_header = []
 
+        # byte order of the file that was read
+        self.endian = "<"
+
+        # bytes or uncompressed file name the extended header is read from
+        self.extended_header_source = None
+        self._extended_header = None
+
         self.all_images = np.array([])
         self.volume_data = np.array([])
 
@@ -330,33 +562,92 @@ class MRC:
         # This is temporary. I'm not sure how i should set this
         self.A_per_pixel = 0
 
+    @property
+    def exttyp(self) -> str:
+        "type of the extended header (MRC2014 EXTTYP, e.g. 'FEI1'), stored in extra_space"
+        if not isinstance(self.extra_space, bytes | bytearray) or len(self.extra_space) < 12:
+            return ""
+        return self.extra_space[8:12].decode("ascii", errors="replace")
+
+    def extended_header_bytes(self) -> np.ndarray:
+        """The NSYMBT extended header bytes as a uint8 array.
+
+        For uncompressed files the bytes are memory mapped, so nothing is read
+        until they are used; zeros when the header has no source.
+        """
+        if isinstance(self.extended_header_source, bytes):
+            return np.frombuffer(self.extended_header_source, dtype=np.uint8)
+        if self.extended_header_source is not None and self.NSYMBT:
+            return np.memmap(
+                self.extended_header_source, dtype=np.uint8, mode="r", offset=HEADER_SIZE, shape=(self.NSYMBT,)
+            )
+        return np.zeros(self.NSYMBT, dtype=np.uint8)
+
+    @property
+    def extended_header(self) -> np.ndarray:
+        """The extended header, parsed on first access.
+
+        FEI1/FEI2 headers (see exttyp) are a structured array with one record
+        of per-frame metadata per section (see fei_extended_header_dtype);
+        other types are the raw bytes.
+        """
+        if self._extended_header is None:
+            raw = self.extended_header_bytes()
+            if self.exttyp in FEI_EXTENDED_HEADER_TYPES and len(raw) >= 4:
+                record_size = int(raw[:4].view("<i4")[0])
+                dtype = fei_extended_header_dtype(record_size)
+                raw = raw[: len(raw) // record_size * record_size].view(dtype)
+            self._extended_header = raw
+        return self._extended_header
+
     def header_from_data(self):
         """Attempt to build a header from given data.
 
         It is impossible to calculate all of the specifics from just the
         image data, however, we can at least build something that is
         default/will load in chimera with this function.
+
+        The statistics are computed in a single chunked pass (see
+        RunningStats.update_chunked), so memory mapped maps and image lists
+        are never copied as a whole.
         """
         assert len(self.volume_data) != 0 or len(self.all_images) != 0
-        base_data = None
+        stats = RunningStats()
         if len(self.volume_data):
-            base_data = self.volume_data
+            stats.update_chunked(self.volume_data)
+            shape = self.volume_data.shape
+            dtype = self.volume_data.dtype
         else:
-            base_data = np.dstack(self.all_images)
-
-        self.nx = base_data.shape[0]
-        self.ny = base_data.shape[1]
-        self.nz = base_data.shape[2]
+            # the statistics of np.dstack(self.all_images), without stacking them
+            nz = 0
+            dtype = None
+            for image in self.all_images:
+                image_3d = np.atleast_3d(image)
+                stats.update_chunked(image_3d)
+                nz += image_3d.shape[2]
+                dtype = image_3d.dtype if dtype is None else np.result_type(dtype, image_3d.dtype)
+            shape = (*np.shape(self.all_images[0])[:2], nz)
+
+        self.header_from_stats(shape, mode_for_dtype(dtype), stats)
+
+    def header_from_stats(self, shape: tuple[int, ...], imod: int, stats: RunningStats):
+        """Build a header for (nx, ny, nz) data of mode imod whose statistics are in stats.
+
+        Used by header_from_data and by writers that never hold all the data.
+        """
+        self.nx = shape[0]
+        self.ny = shape[1]
+        self.nz = shape[2]
 
-        self.imod = 2  # TODO should this be an option?
+        self.imod = imod
 
         self.nxstart = 0
         self.nystart = 0
         self.nzstart = 0
 
-        self.mx = base_data.shape[0]
-        self.my = base_data.shape[1]
-        self.mz = base_data.shape[2]
+        self.mx = shape[0]
+        self.my = shape[1]
+        self.mz = shape[2]
 
         self.xlen = self.A_per_pixel * self.nx
         self.ylen = self.A_per_pixel * self.ny
@@ -370,13 +661,15 @@ class MRC:
         self.mapr = 2
         self.maps = 3
 
-        self.amin = np.amin(base_data)
-        self.amax = np.amax(base_data)
-        self.amean = np.mean(base_data)
+        self.amin = stats.min if stats.n else 0
+        self.amax = stats.max if stats.n else 0
+        self.amean = stats.mean
 
         self.ispg = 1
 
         self.NSYMBT = 0
+        self.extended_header_source = None
+        self._extended_header = None
 
         empty_space_list = 25 * [0]
         self.extra_space = struct.pack("25i", *empty_space_list)
@@ -386,9 +679,9 @@ class MRC:
         self.originz = 0
 
         self.mapstring = "MAP "
-        self.machine_stamp = (68, 65, 0, 0)
+        self.machine_stamp = NATIVE_MACHINE_STAMP
 
-        self.rms_dev = math.sqrt(np.sum(np.square(base_data - self.amean)) / base_data.size)
+        self.rms_dev = stats.rms_dev
 
         self.num_labels = 1
 
@@ -420,108 +713,118 @@ class MRC:
         )
         return s
 
-    def _import_file(self, filename: str | Path) -> None:
+    def parse_header(self, header: bytes) -> None:
+        """Set the header fields from the 1024 header bytes of an MRC file.
+
+        The byte order is detected from nx, and all fields are decoded with a
+        single unpack of header_dtype(endian) (see _HEADER_FIELDS).
+        """
+        if len(header) < HEADER_SIZE:
+            msg = f"MRC header is {len(header)} bytes, expected {HEADER_SIZE}"
+            raise RuntimeError(msg)
+        endian = "<"
+        if not (0 < struct.unpack(f"{endian}i", header[:4])[0] < 65536):
+            endian = ">"
+        fields = np.frombuffer(header, dtype=header_dtype(endian), count=1)[0]
+
+        for name in HEADER_NUMBER_FIELDS:
+            setattr(self, name, fields[name].item())
+        self.extra_space = fields["extra_space"].tobytes()
+        self.mapstring = fields["mapstring"].tobytes().decode("utf-8")
+        self.machine_stamp = tuple(fields["machine_stamp"].tolist())
+        self.text_header = [x.tobytes() for x in fields["text_header"]]
+        self.endian = endian
+        self.extended_header_source = None
+        self._extended_header = None
+
+        if (
+            self.nx
+            and self.ny
+            and self.nz
+            and math.isclose(self.xlen / self.nx, self.ylen / self.ny, rel_tol=0.01, abs_tol=0)
+            and math.isclose(self.ylen / self.ny, self.zlen / self.nz, rel_tol=0.01, abs_tol=0)
+        ):
+            self.A_per_pixel = self.xlen / self.nx
+
+    def _skip_extended_header(self, f, filename: str | Path) -> None:
+        """Move f, positioned after the header, to the data and remember where the extended header is.
+
+        Uncompressed files are seeked past it (it is mapped lazily later),
+        compressed streams have to be read through, so its bytes are kept.
+        """
+        if compression_for(filename) is None:
+            self.extended_header_source = Path(filename)
+            f.seek(HEADER_SIZE + self.NSYMBT)
+        else:
+            extended_header = bytearray(self.NSYMBT)
+            read_into(f, extended_header)
+            self.extended_header_source = bytes(extended_header)
+
+    def _import_file(self, filename: str | Path, mmap: bool = False) -> None:
         """import a mrc/mrcs file and store the contents in this class.
 
         The data for a mrc and mrcs file are exactly the same, but the image
         stacks are just each Z-direction. so we import files exactly the same,
         but we store the actual data with a different naming scheme.
 
+        With mmap the data block is mapped copy-on-write instead of read, so
+        only the pages that are touched get loaded and changes stay in memory.
+        Compressed files (see compression.COMPRESSION_SUFFIXES) are decoded
+        block by block straight into the data array, they can not be mapped.
+
+        The data keeps the dtype of its mode and the byte order of the file,
+        see dtype_for_mode.
+
         NOTE:
             Since the data is just read in one at a time, other functions will
         bear the responsibility of figuring that shit out.
         """
-        endian = "<"
-        with open(filename, "rb") as f:
-            in_x = f.read(4)
-            self.nx = struct.unpack(f"{endian}i", in_x)[0]
-            if not (0 < self.nx < 65536):
-                endian = ">"
-                self.nx = struct.unpack(f"{endian}i", in_x)[0]
-            self.ny = read_single_entity("i", f, 4, endian)
-            self.nz = read_single_entity("i", f, 4, endian)
-
-            # def read_single_entity(type_: str, file_handle, n_to_read: int, endian: str) -> Any:
-
-            self.imod = read_single_entity("i", f, 4, endian)
-
-            self.nxstart = read_single_entity("i", f, 4, endian)
-            self.nystart = read_single_entity("i", f, 4, endian)
-            self.nzstart = read_single_entity("i", f, 4, endian)
-
-            self.mx = read_single_entity("i", f, 4, endian)
-            self.my = read_single_entity("i", f, 4, endian)
-            self.mz = read_single_entity("i", f, 4, endian)
-
-            self.xlen = read_single_entity("f", f, 4, endian)
-            self.ylen = read_single_entity("f", f, 4, endian)
-            self.zlen = read_single_entity("f", f, 4, endian)
-
-            self.alpha = read_single_entity("f", f, 4, endian)
-            self.beta = read_single_entity("f", f, 4, endian)
-            self.gamma = read_single_entity("f", f, 4, endian)
-
-            self.mapc = read_single_entity("i", f, 4, endian)
-            self.mapr = read_single_entity("i", f, 4, endian)
-            self.maps = read_single_entity("i", f, 4, endian)
-
-            self.amin = read_single_entity("f", f, 4, endian)
-            self.amax = read_single_entity("f", f, 4, endian)
-            self.amean = read_single_entity("f", f, 4, endian)
-
-            self.ispg = read_single_entity("i", f, 4, endian)
-
-            self.NSYMBT = read_single_entity("i", f, 4, endian)
-
-            self.extra_space = f.read(100)
-
-            self.originx = read_single_entity("f", f, 4, endian)
-            self.originy = read_single_entity("f", f, 4, endian)
-            self.originz = read_single_entity("f", f, 4, endian)
-
-            mapstring = struct.unpack("4c", f.read(4))
-            self.mapstring = "".join([x.decode("utf-8") for x in mapstring])
-
-            self.machine_stamp = struct.unpack("4b", f.read(4))
-
-            self.rms_dev = read_single_entity("f", f, 4, endian)
-
-            self.num_labels = read_single_entity("i", f, 4, endian)
-
-            self.text_header = [struct.unpack("80s", f.read(80))[0] for _ in range(10)]
-
-            if math.isclose(self.xlen / self.nx, self.ylen / self.ny, rel_tol=0.01, abs_tol=0) and math.isclose(
-                self.ylen / self.ny, self.zlen / self.nz, rel_tol=0.01, abs_tol=0
-            ):
-                self.A_per_pixel = self.xlen / self.nx
-
-            self.alldata = np.frombuffer(f.read(4 * self.nx * self.ny * self.nz), dtype="<f4")
-
-    def read_mrc(self, filename: str | Path):
+        if mmap and compression_for(filename) is not None:
+            msg = f"Compressed MRC files can not be memory mapped {filename=}"
+            raise RuntimeError(msg)
+        with open_file(filename, "rb") as f:
+            header = bytearray(HEADER_SIZE)
+            read_into(f, header)
+            self.parse_header(bytes(header))
+            # the data starts after the extended header
+            self._skip_extended_header(f, filename)
+            dtype = dtype_for_mode(self.imod, self.endian)
+            n_voxels = self.nx * self.ny * self.nz
+            if mmap:
+                self.alldata = np.memmap(f, dtype=dtype, mode="c", offset=f.tell(), shape=(n_voxels,))
+            else:
+                self.alldata = np.empty(n_voxels, dtype=dtype)
+                read_into(f, self.alldata)
+
+    def read_mrc(self, filename: str | Path, mmap: bool = False):
         """Read an mrc file and store the contents.
 
         Inputs:
             filename: The mrc filename to read in.
+            mmap: memory map the data instead of reading it, volume_data is
+                then a lazily loaded view of the file.
 
         NOTE:
             We don't read this in as fortran.. perhaps we should?
         Not entirely sure that would be useful at this point.
         """
         try:
-            self._import_file(filename)
+            self._import_file(filename, mmap=mmap)
         except Exception:
             print(f"failure to read {filename}")
             raise
         self.volume_data = np.reshape(self.alldata, (self.nx, self.ny, self.nz), order="F")
         self.alldata = 0
 
-    def read_mrcs(self, filename: str | Path) -> None:
+    def read_mrcs(self, filename: str | Path, mmap: bool = False) -> None:
         """Read an mrcs file and store the contents.
 
         Inputs:
             filename: The mrcs filename to read in.
+            mmap: memory map the data instead of reading it, the images are
+                then lazily loaded views of the file.
         """
-        self._import_file(filename)
+        self._import_file(filename, mmap=mmap)
         self.alldata = np.reshape(self.alldata, (self.nx, self.ny, self.nz), order="F")
         self.all_images = np.dsplit(self.alldata, self.nz)
         self.alldata = 0
@@ -550,9 +853,13 @@ class MRC:
         Inputs:
             f: file already opened in binary
 
+        The header (and the data after it) is written in native byte order,
+        so the machine stamp of a file read in the other order is replaced.
+
         TODO:
             Recalculate things like min, max, and mean on rewrite
         """
+        self.machine_stamp = NATIVE_MACHINE_STAMP
         f.write(struct.pack("i", self.nx))
         f.write(struct.pack("i", self.ny))
         f.write(struct.pack("i", self.nz))
@@ -606,27 +913,46 @@ class MRC:
         for x in self.text_header:
             f.write(struct.pack("80s", x))
 
-    def write_mrc_file(self, filename):
+    def write_mrc_file(self, filename, mode: int | None = None, compresslevel: int | None = None, threads: int = -1):
         """Write this class to an mrc file.
 
+        The file is written next to filename and renamed over it when done, so
+        filename can be the (memory mapped) file this class was read from.
+
         Inputs:
-            filename: filename to write to
+            filename: filename to write to, compressed by extension
+                (.gz, .bz2, .zst)
+            mode: MRC mode to write the data as, by default the mode matching
+                the dtype of volume_data (see mode_for_dtype)
+            compresslevel, threads: see compression.open_file
         """
-        with open(filename, "wb") as f:
+        self.imod = mode_for_dtype(self.volume_data.dtype) if mode is None else mode
+        dtype = dtype_for_mode(self.imod, "=")
+        with _replacing_file(filename) as tmp_filename, open_file(tmp_filename, "wb", compresslevel, threads) as f:
             self.export_header(f)
-            volume_data_to_write = self.volume_data.flatten("F")
-            f.write(struct.pack(f"={volume_data_to_write.size}f", *volume_data_to_write))
+            f.write(self.extended_header_bytes().tobytes())
+            write_data_block(f, self.volume_data, dtype)
 
-    def write_mrcs_file(self, filename):
+    def write_mrcs_file(self, filename, mode: int | None = None, compresslevel: int | None = None, threads: int = -1):
         """Write this class to an mrcs file.
 
+        The file is written next to filename and renamed over it when done, so
+        filename can be the (memory mapped) file this class was read from.
+
         Inputs:
-            filename: filename to write to
+            filename: filename to write to, compressed by extension
+                (.gz, .bz2, .zst)
+            mode: MRC mode to write the images as, by default the mode matching
+                the dtype of the images (see mode_for_dtype)
+            compresslevel, threads: see compression.open_file
         """
-        with open(filename, "wb") as f:
+        self.imod = mode_for_dtype(self.all_images[0].dtype) if mode is None else mode
+        dtype = dtype_for_mode(self.imod, "=")
+        with _replacing_file(filename) as tmp_filename, open_file(tmp_filename, "wb", compresslevel, threads) as f:
             self.export_header(f)
-            image_data_to_write = np.dstack(self.all_images).flatten("F")
-            f.write(struct.pack(f"={image_data_to_write.size}f", *image_data_to_write))
+            f.write(self.extended_header_bytes().tobytes())
+            for image in self.all_images:
+                write_data_block(f, np.atleast_3d(image), dtype)
 
     def get_origin(self):
         return np.array([self.originx, self.originy, self.originz])
@@ -635,7 +961,170 @@ class MRC:
         self.originx, self.originy, self.originz = new_origin
 
 
-def read_mrc(filename: str) -> MRC:
+class MRCSStack:
+    """Lazily loaded, random access image stack of an mrcs file.
+
+    The data block is memory mapped (copy-on-write), so only the images that
+    are accessed are read. Images are (nx, ny), where the sections of
+    MRC.all_images are (nx, ny, 1); integer and slice indexing return views of
+    the map, fancy indexing (e.g. a random subset) copies just the selected
+    images.
+
+    Use as a context manager (or call close) to drop the map:
+
+        with MRCSStack("particles.mrcs") as stack:
+            for batch in stack.iter_batches(256):
+                ...
+    """
+
+    header: MRC
+    "header of the file, its data attributes are left empty"
+
+    images: np.ndarray
+    "(nz, nx, ny) view of the mapped data"
+
+    def __init__(self, filename: str | Path):
+        self.header = MRC()
+        self.header._import_file(filename, mmap=True)
+        data = self.header.alldata
+        self.header.alldata = 0
+        # (nx, ny, nz) in Fortran order is (nz, ny, nx) in C order
+        self.images = data.reshape(self.header.nz, self.header.ny, self.header.nx).transpose(0, 2, 1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Drop the memory map, the stack is empty afterwards.
+
+        The file is unmapped once no view of the images taken from the stack is left.
+        """
+        self.images = np.empty((0, *self.images.shape[1:]), dtype=self.images.dtype)
+
+    def __len__(self) -> int:
+        return self.images.shape[0]
+
+    def __getitem__(self, index: Any) -> np.ndarray:
+        return self.images[index]
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        return iter(self.images)
+
+    @property
+    def shape(self) -> tuple[int, int, int]:
+        return self.images.shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.images.dtype
+
+    def iter_batches(self, batch_size: int) -> Iterator[np.ndarray]:
+        """Yield (n, nx, ny) views of consecutive images, n is batch_size except for the last batch."""
+        if batch_size < 1:
+            msg = "batch_size must be at least 1"
+            raise RuntimeError(msg)
+        for start in range(0, len(self), batch_size):
+            yield self.images[start : start + batch_size]
+
+
+class MRCSWriter:
+    """Incrementally write an mrcs file, images are appended straight to disk.
+
+    Use as a context manager; the header (nz and the density statistics, kept
+    with RunningStats) is written when the writer is closed, so stacks larger
+    than memory can be written. When the block raises, the header is left
+    zeroed, so a partly written stack is never read as a complete one.
+
+        with MRCSWriter("particles.mrcs", A_per_pixel=1.1) as writer:
+            for batch in batches:
+                writer.extend(batch)
+    """
+
+    def __init__(self, filename: str | Path, A_per_pixel: float = 0, mode: int | None = None):
+        """Inputs:
+        filename: mrcs file to write
+        A_per_pixel: pixel size stored in the header
+        mode: MRC mode to write the images as, by default the mode matching
+            the dtype of the first image (see mode_for_dtype)
+        """
+        if compression_for(filename) is not None:
+            msg = f"MRCSWriter rewrites the header on close and can not write compressed files {filename=}"
+            raise RuntimeError(msg)
+        self.filename = filename
+        self.A_per_pixel = A_per_pixel
+        self.imod = mode
+        self.nx = 0
+        self.ny = 0
+        self.nz = 0
+        self.stats = RunningStats()
+        self._dtype: np.dtype | None = None
+        self._f = Path(filename).open("wb")  # noqa: SIM115
+        # placeholder, rewritten on close
+        self._f.write(bytes(1024))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if exc_type is not None:
+            self._f.close()
+            return
+        self.close()
+
+    def append(self, image: np.ndarray) -> None:
+        """Append one (nx, ny) image."""
+        image = np.asarray(image)
+        if image.ndim == 3:
+            image = image[:, :, 0]
+        self.extend(image[np.newaxis])
+
+    def extend(self, images: Any) -> None:
+        """Append a (n, nx, ny) array of images (e.g. a batch of an MRCSStack) or an iterable of images."""
+        if not isinstance(images, np.ndarray):
+            for image in images:
+                self.append(image)
+            return
+        if images.ndim != 3:
+            msg = f"Expected a (n, nx, ny) array of images, got shape {images.shape}"
+            raise RuntimeError(msg)
+        if self._dtype is None:
+            self.nx, self.ny = images.shape[1:]
+            if self.imod is None:
+                self.imod = mode_for_dtype(images.dtype)
+            self._dtype = dtype_for_mode(self.imod, "=")
+        if images.shape[1:] != (self.nx, self.ny):
+            msg = f"Image shape {images.shape[1:]} differs from the stack {(self.nx, self.ny)}"
+            raise RuntimeError(msg)
+        write_data_block(self._f, images.transpose(1, 2, 0), self._dtype)
+        self.stats.update_chunked(images.transpose(1, 2, 0))
+        self.nz += images.shape[0]
+
+    def close(self) -> None:
+        if self._f.closed:
+            return
+        header = MRC()
+        header.A_per_pixel = self.A_per_pixel
+        header.header_from_stats((self.nx, self.ny, self.nz), 2 if self.imod is None else self.imod, self.stats)
+        self._f.seek(0)
+        header.export_header(self._f)
+        self._f.close()
+
+
+def read_header(filename: str | Path) -> MRC:
+    """Read only the header of an mrc/mrcs file, the data attributes are left empty."""
+    mrc = MRC()
+    with open_file(filename, "rb") as f:
+        header = bytearray(HEADER_SIZE)
+        read_into(f, header)
+        mrc.parse_header(bytes(header))
+        mrc._skip_extended_header(f, filename)
+    return mrc
+
+
+def read_mrc(filename: str | Path, mmap: bool = False) -> MRC:
     mrc = MRC()
-    mrc.read_mrc(filename)
+    mrc.read_mrc(filename, mmap=mmap)
     return mrc
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+
+from . import MRC, MRCSStack, MRCSWriter
+
+BIN_CHUNK_BYTES = 64 * 1024 * 1024
+"approximate size of the float64 blocks of z sections bin_volume averages at a time"
+
+STACK_BATCH_SIZE = 256
+"number of images bin_stack and fourier_crop_stack process at a time"
+
+
+def _check_factor(factor: int) -> None:
+    if int(factor) != factor or factor < 1:
+        msg = f"Binning factor must be a positive integer, got {factor}"
+        raise RuntimeError(msg)
+
+
+def bin_volume(volume: np.ndarray, factor: int, chunk_bytes: int = BIN_CHUNK_BYTES) -> np.ndarray:
+    """(nx, ny, nz) volume averaged over factor**3 voxel blocks into a float32 (nx // factor, ...) volume.
+
+    Voxels beyond the last whole block of an axis are dropped. The average is
+    a reshape to (nx // factor, factor, ...) and a mean over the factor axes,
+    done a block of z sections at a time so memory mapped maps are streamed.
+    """
+    _check_factor(factor)
+    nx, ny, nz = (x // factor for x in volume.shape)
+    binned = np.empty((nx, ny, nz), dtype=np.float32, order="F")
+    z_step = max(1, chunk_bytes // max(1, nx * ny * factor**3 * 8))
+    for z in range(0, nz, z_step):
+        z_stop = min(nz, z + z_step)
+        block = np.asarray(volume[: nx * factor, : ny * factor, z * factor : z_stop * factor], dtype=np.float64)
+        binned[:, :, z:z_stop] = block.reshape(nx, factor, ny, factor, z_stop - z, factor).mean(axis=(1, 3, 5))
+    return binned
+
+
+def bin_images(images: np.ndarray, factor: int) -> np.ndarray:
+    """(n, nx, ny) images averaged over factor**2 pixel blocks into float32 (n, nx // factor, ny // factor) images."""
+    _check_factor(factor)
+    n = images.shape[0]
+    nx, ny = (x // factor for x in images.shape[1:])
+    block = np.asarray(images[:, : nx * factor, : ny * factor], dtype=np.float64)
+    return block.reshape(n, nx, factor, ny, factor).mean(axis=(2, 4)).astype(np.float32)
+
+
+def _fourier_crop(data: np.ndarray, new_shape: tuple[int, ...], axes: tuple[int, ...]) -> np.ndarray:
+    """data resampled to new_shape along axes by keeping only its lowest spatial frequencies."""
+    old_shape = tuple(data.shape[x] for x in axes)
+    if any(new > old or new < 1 for new, old in zip(new_shape, old_shape, strict=True)):
+        msg = f"Can not fourier crop {old_shape} to {new_shape}, every new size must be in [1, old size]"
+        raise RuntimeError(msg)
+    spectrum = np.fft.rfftn(data, axes=axes)
+    # the full axes keep their non-negative and negative low frequencies, the halved last axis only the first ones
+    for axis, old, new in zip(axes[:-1], old_shape[:-1], new_shape[:-1], strict=True):
+        keep = np.r_[0 : (new + 1) // 2, old - new // 2 : old]
+        spectrum = np.take(spectrum, keep, axis=axis)
+    spectrum = np.take(spectrum, np.arange(new_shape[-1] // 2 + 1), axis=axes[-1])
+    cropped = np.fft.irfftn(spectrum, s=new_shape, axes=axes)
+    # numpy's unnormalized forward transform scales with the number of voxels, keep the density values
+    cropped *= np.prod(new_shape) / np.prod(old_shape)
+    return cropped.astype(np.float32)
+
+
+def _box_shape(box_size: int | tuple[int, ...], ndim: int) -> tuple[int, ...]:
+    return (box_size,) * ndim if isinstance(box_size, int) else tuple(box_size)
+
+
+def fourier_crop_volume(volume: np.ndarray, box_size: int | tuple[int, int, int]) -> np.ndarray:
+    """(nx, ny, nz) volume fourier cropped to a float32 box_size (int for a cube) volume."""
+    return np.asfortranarray(_fourier_crop(volume, _box_shape(box_size, 3), (0, 1, 2)))
+
+
+def fourier_crop_images(images: np.ndarray, box_size: int | tuple[int, int]) -> np.ndarray:
+    """(n, nx, ny) images fourier cropped to float32 (n, *box_size) images."""
+    return _fourier_crop(images, _box_shape(box_size, 2), (1, 2))
+
+
+def _set_sampling(map_in: MRC, lengths: tuple[float, float, float]) -> None:
+    """Header of map_in for its new data, with the physical box lengths (xlen, ylen, zlen)."""
+    origin = map_in.get_origin()
+    map_in.header_from_data()
+    map_in.xlen, map_in.ylen, map_in.zlen = lengths
+    map_in.A_per_pixel = map_in.xlen / map_in.nx
+    map_in.set_origin(origin)
+
+
+def _map_images(map_in: MRC) -> np.ndarray:
+    """(n, nx, ny) array of the all_images of map_in, which are (nx, ny) or (nx, ny, 1)."""
+    return np.stack([np.asarray(x).reshape(np.shape(x)[:2]) for x in map_in.all_images])
+
+
+def bin_map(map_in: MRC, factor: int) -> MRC:
+    """Bin the volume (or the images) of map_in by the integer factor, see bin_volume.
+
+    A_per_pixel grows by factor, the box lengths follow the new sizes and the
+    origin of a volume moves to the center of its first binned voxel.
+
+    modifies the input MRC
+    """
+    _check_factor(factor)
+    old_a_per_pix = map_in.A_per_pixel
+    if len(map_in.volume_data):
+        map_in.volume_data = bin_volume(map_in.volume_data, factor)
+        map_in.set_origin(map_in.get_origin() + (factor - 1) / 2 * old_a_per_pix)
+        shape = map_in.volume_data.shape
+    else:
+        images = bin_images(_map_images(map_in), factor)
+        map_in.all_images = list(images)
+        shape = (*images.shape[1:], len(images))
+    a_per_pix = old_a_per_pix * factor
+    _set_sampling(map_in, tuple(a_per_pix * x for x in shape))
+    return map_in
+
+
+def fourier_crop_map(map_in: MRC, box_size: int | tuple[int, ...]) -> MRC:
+    """Fourier crop the volume (or the images) of map_in to box_size, see fourier_crop_volume.
+
+    The physical box lengths and the origin are kept, A_per_pixel grows by
+    the ratio of the old to the new box size (of x, for non cubic boxes).
+
+    modifies the input MRC
+    """
+    old_a_per_pix = map_in.A_per_pixel
+    if len(map_in.volume_data):
+        lengths = tuple(old_a_per_pix * x for x in map_in.volume_data.shape)
+        map_in.volume_data = fourier_crop_volume(map_in.volume_data, box_size)
+    else:
+        old_images = _map_images(map_in)
+        images = fourier_crop_images(old_images, box_size)
+        map_in.all_images = list(images)
+        # the images are resampled, their count is not
+        xlen, ylen = (old_a_per_pix * x for x in old_images.shape[1:])
+        lengths = (xlen, ylen, xlen / images.shape[1] * len(images))
+    _set_sampling(map_in, lengths)
+    return map_in
+
+
+def _stack_a_per_pixel(stack: MRCSStack) -> float:
+    return stack.header.xlen / stack.header.nx if stack.header.nx else 0
+
+
+def bin_stack(
+    stack: str | Path | MRCSStack, out_filename: str | Path, factor: int, batch_size: int = STACK_BATCH_SIZE
+) -> None:
+    """Bin every image of an mrcs stack by factor into out_filename, batch_size images at a time."""
+    if not isinstance(stack, MRCSStack):
+        stack = MRCSStack(stack)
+    with MRCSWriter(out_filename, A_per_pixel=_stack_a_per_pixel(stack) * factor, mode=2) as writer:
+        for batch in stack.iter_batches(batch_size):
+            writer.extend(bin_images(batch, factor))
+
+
+def fourier_crop_stack(
+    stack: str | Path | MRCSStack,
+    out_filename: str | Path,
+    box_size: int | tuple[int, int],
+    batch_size: int = STACK_BATCH_SIZE,
+) -> None:
+    """Fourier crop every image of an mrcs stack to box_size into out_filename, batch_size images at a time."""
+    if not isinstance(stack, MRCSStack):
+        stack = MRCSStack(stack)
+    new_nx = _box_shape(box_size, 2)[0]
+    with MRCSWriter(out_filename, A_per_pixel=_stack_a_per_pixel(stack) * stack.shape[1] / new_nx, mode=2) as writer:
+        for batch in stack.iter_batches(batch_size):
+            writer.extend(fourier_crop_images(batch, box_size))
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import sqlite3
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+from . import read_header
+from .compression import COMPRESSION_SUFFIXES
+
+MRC_PATTERNS = tuple(
+    f"{pattern}{compression}" for pattern in ("*.mrc", "*.mrcs", "*.map") for compression in ("", *COMPRESSION_SUFFIXES)
+)
+"file name patterns of raw and compressed maps and stacks"
+
+READ_ERRORS = (OSError, RuntimeError, ValueError)
+"errors of unreadable files, which build_catalog reports instead of raising"
+
+CATALOG_COLUMNS = {
+    "path": "TEXT PRIMARY KEY",
+    "size_bytes": "INTEGER",
+    "mtime": "REAL",
+    "nx": "INTEGER",
+    "ny": "INTEGER",
+    "nz": "INTEGER",
+    "imod": "INTEGER",
+    "A_per_pixel": "REAL",
+    "xlen": "REAL",
+    "ylen": "REAL",
+    "zlen": "REAL",
+    "originx": "REAL",
+    "originy": "REAL",
+    "originz": "REAL",
+    "NSYMBT": "INTEGER",
+}
+"columns of the headers table of a catalog database"
+
+
+def find_mrc_files(directory: str | Path, patterns: Iterable[str] = MRC_PATTERNS) -> list[Path]:
+    """All files below directory matching any of patterns, sorted."""
+    directory = Path(directory)
+    return sorted({x for pattern in patterns for x in directory.rglob(pattern) if x.is_file()})
+
+
+def catalog_entry(filename: str | Path) -> dict[str, Any]:
+    """Catalog row of one file, only its header is read."""
+    filename = Path(filename)
+    header = read_header(filename)
+    stat = filename.stat()
+    entry = {"path": str(filename.resolve()), "size_bytes": stat.st_size, "mtime": stat.st_mtime}
+    for column in CATALOG_COLUMNS:
+        if column not in entry:
+            entry[column] = getattr(header, column)
+    return entry
+
+
+def build_catalog(
+    filenames: Iterable[str | Path], database: str | Path, n_workers: int = 8
+) -> list[tuple[Path, Exception]]:
+    """Index the headers of filenames into the headers table of the sqlite file database.
+
+    Headers are read by n_workers threads (the work is small reads, so it is
+    bound by file system latency). Existing rows of a path are replaced, so a
+    catalog can be refreshed by scanning again.
+
+    Returns the (filename, error) of every file that could not be read (READ_ERRORS).
+    """
+
+    def _entry(filename: str | Path) -> tuple[Path, dict[str, Any] | Exception]:
+        try:
+            return Path(filename), catalog_entry(filename)
+        except READ_ERRORS as e:
+            return Path(filename), e
+
+    failures = []
+    db = sqlite3.connect(str(database))
+    try:
+        columns = ", ".join(f"{name} {type_}" for name, type_ in CATALOG_COLUMNS.items())
+        db.execute(f"CREATE TABLE IF NOT EXISTS headers ({columns})")
+        insert = (
+            f"INSERT OR REPLACE INTO headers ({', '.join(CATALOG_COLUMNS)}) "
+            f"VALUES ({', '.join('?' * len(CATALOG_COLUMNS))})"
+        )
+        with ThreadPoolExecutor(n_workers) as pool:
+            for filename, entry in pool.map(_entry, filenames):
+                if isinstance(entry, Exception):
+                    failures.append((filename, entry))
+                else:
+                    db.execute(insert, [entry[x] for x in CATALOG_COLUMNS])
+        db.commit()
+    finally:
+        db.close()
+    return failures
+
+
+def read_catalog(database: str | Path) -> list[dict[str, Any]]:
+    """All rows of a catalog built by build_catalog."""
+    db = sqlite3.connect(str(database))
+    try:
+        db.row_factory = sqlite3.Row
+        return [dict(x) for x in db.execute("SELECT * FROM headers ORDER BY path")]
+    finally:
+        db.close()
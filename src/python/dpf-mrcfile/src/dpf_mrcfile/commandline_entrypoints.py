@@ -0,0 +1,336 @@
+from __future__ import annotations
+
+import argparse
+import glob
+import json
+import logging
+import resource
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any
+
+from . import MRC, read_mrc
+from .bin_map import bin_map, fourier_crop_map
+from .compression import compression_for
+from .converters import (
+    convert_map_to_mrc,
+    convert_mrc_to_map,
+    read_hdf5,
+    read_situs,
+    read_zarr,
+    write_hdf5,
+    write_situs,
+    write_zarr,
+)
+from .homogenize_and_combine_volumes import homogenize_and_combine_volumes
+from .pad_map import pad_map
+from .trim_map_to_density import trim_map_to_density
+
+CONVERT_SUFFIXES = {"mrc": ".mrc", "map": ".map", "situs": ".situs", "hdf5": ".h5", "zarr": ".zarr"}
+"file extension written by dpf-mrc convert for every --to format"
+
+FILE_ERRORS = (OSError, RuntimeError, ValueError)
+"errors of a single file that are reported instead of stopping a batch"
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args(cmdline_args: list[str]):
+    parser = argparse.ArgumentParser(
+        prog="dpf-mrc", description="Run map operations over many mrc files in parallel."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    inputs_parser = argparse.ArgumentParser(add_help=False)
+    inputs_parser.add_argument(
+        "inputs",
+        nargs="*",
+        help="input files or glob patterns (quote them to let dpf-mrc expand them, e.g. 'maps/**/*.mrc')",
+    )
+    inputs_parser.add_argument(
+        "--file-list",
+        default="",
+        help="file with one input file or glob pattern per line, added to the inputs. [default: none]",
+    )
+    inputs_parser.add_argument(
+        "--report",
+        default="",
+        help="json lines file with the status, wall time and peak memory of every output. [default: none]",
+    )
+    inputs_parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="report the peak python and numpy allocations of every output with tracemalloc, "
+        "which slows down allocation heavy operations. [default: False]",
+    )
+
+    outputs_parser = argparse.ArgumentParser(add_help=False, parents=[inputs_parser])
+    outputs_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of processes the inputs are distributed over. [default: 1]",
+    )
+    outputs_parser.add_argument(
+        "--output-dir",
+        default="",
+        help="directory the outputs are written to. [default: next to every input]",
+    )
+    outputs_parser.add_argument(
+        "--suffix",
+        default=None,
+        help="appended to the name of every input to name its output. [default: _<command>]",
+    )
+
+    pad_parser = subparsers.add_parser("pad", parents=[outputs_parser], help="pad maps around their density")
+    pad_parser.add_argument(
+        "--padding", type=float, required=True, help="minimum distance in angstrom between density and box edge"
+    )
+
+    trim_parser = subparsers.add_parser("trim", parents=[outputs_parser], help="trim maps to their density")
+    trim_parser.add_argument(
+        "--lower-limit", type=float, required=True, help="density of the voxels the map is trimmed to"
+    )
+    trim_parser.add_argument("--padding", type=int, default=0, help="voxels kept around the density. [default: 0]")
+    trim_parser.add_argument("--force-cube", action="store_true", help="trim to a cubic box. [default: False]")
+
+    bin_parser = subparsers.add_parser("bin", parents=[outputs_parser], help="downsample maps")
+    bin_group = bin_parser.add_mutually_exclusive_group(required=True)
+    bin_group.add_argument("--factor", type=int, help="average blocks of factor voxels along every axis")
+    bin_group.add_argument("--fourier-crop", type=int, help="fourier crop to a box of this many voxels")
+
+    convert_parser = subparsers.add_parser(
+        "convert",
+        parents=[outputs_parser],
+        help="convert maps between mrc, map, situs, hdf5 and zarr (input format by extension)",
+    )
+    convert_parser.add_argument("--to", choices=tuple(CONVERT_SUFFIXES), required=True, help="output format")
+
+    combine_parser = subparsers.add_parser(
+        "combine", parents=[inputs_parser], help="homogenize the histograms of maps and combine them into one"
+    )
+    combine_parser.add_argument("-o", "--output", required=True, help="combined map file")
+    combine_parser.add_argument(
+        "--n-bins",
+        type=int,
+        default=None,
+        help="match histograms approximately through this many bins. [default: exact matching]",
+    )
+    return parser.parse_args(cmdline_args)
+
+
+def expand_inputs(patterns: list[str], file_list: str = "") -> list[Path]:
+    """Files matched by patterns and by the lines of file_list, in order and without duplicates.
+
+    Patterns without glob characters are taken as file names, missing files are
+    reported when they are processed.
+    """
+    if file_list:
+        with Path(file_list).open() as f:
+            patterns = [*patterns, *(x.strip() for x in f if x.strip())]
+    filenames: dict[Path, None] = {}
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = _glob(pattern)
+            if not matches:
+                msg = f"No files match {pattern}"
+                raise RuntimeError(msg)
+            filenames.update((x, None) for x in matches)
+        else:
+            filenames[Path(pattern)] = None
+    if not filenames:
+        msg = "No input files given"
+        raise RuntimeError(msg)
+    return list(filenames)
+
+
+def _glob(pattern: str) -> list[Path]:
+    """Sorted files matching pattern, which can be absolute and use ** for any number of directories."""
+    parts = Path(pattern).parts
+    first_magic = next(i for i, x in enumerate(parts) if glob.has_magic(x))
+    return sorted(Path(*parts[:first_magic]).glob(str(Path(*parts[first_magic:]))))
+
+
+def output_filename(filename: Path, output_dir: str, suffix: str, extension: str | None = None) -> Path:
+    """filename with suffix appended to its stem, in output_dir if given.
+
+    map.mrc.gz with suffix _pad is map_pad.mrc.gz, extension (e.g. ".situs")
+    replaces both the extension and the compression.
+    """
+    compression = filename.suffix if compression_for(filename) is not None else ""
+    uncompressed = Path(filename.name[: len(filename.name) - len(compression)])
+    if extension is None:
+        extension = uncompressed.suffix + compression
+    return (Path(output_dir) if output_dir else filename.parent) / f"{uncompressed.stem}{suffix}{extension}"
+
+
+def read_any(filename: Path) -> MRC:
+    """MRC of an mrc/map file or of anything dpf-mrc convert writes, by extension."""
+    suffix = filename.suffix.lower()
+    if suffix == ".situs":
+        with filename.open() as f:
+            return read_situs(f)
+    if suffix in (".h5", ".hdf5"):
+        return read_hdf5(filename)
+    if suffix == ".zarr":
+        return read_zarr(filename)
+    return read_mrc(filename)
+
+
+def _pad(filename: Path, output: Path, args: argparse.Namespace) -> None:
+    pad_map(read_mrc(filename), args.padding).write_mrc_file(output)
+
+
+def _trim(filename: Path, output: Path, args: argparse.Namespace) -> None:
+    trim_map_to_density(read_mrc(filename), args.lower_limit, args.padding, args.force_cube).write_mrc_file(output)
+
+
+def _bin(filename: Path, output: Path, args: argparse.Namespace) -> None:
+    map_in = read_mrc(filename)
+    if args.factor is not None:
+        bin_map(map_in, args.factor)
+    else:
+        fourier_crop_map(map_in, args.fourier_crop)
+    map_in.write_mrc_file(output)
+
+
+def _convert(filename: Path, output: Path, args: argparse.Namespace) -> None:
+    map_in = read_any(filename)
+    if args.to == "mrc":
+        convert_map_to_mrc(map_in).write_mrc_file(output)
+    elif args.to == "map":
+        convert_mrc_to_map(map_in).write_mrc_file(output)
+    elif args.to == "situs":
+        with output.open("w") as f:
+            write_situs(map_in, f)
+    elif args.to == "hdf5":
+        write_hdf5(map_in, output)
+    else:
+        write_zarr(map_in, output)
+
+
+COMMANDS: dict[str, Callable[[Path, Path, argparse.Namespace], None]] = {
+    "pad": _pad,
+    "trim": _trim,
+    "bin": _bin,
+    "convert": _convert,
+}
+"per file operation of every parallel subcommand"
+
+
+def _process_max_rss_mb() -> float:
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macos, kilobytes elsewhere
+    return max_rss / 1024**2 if sys.platform == "darwin" else max_rss / 1024
+
+
+def run_and_report(
+    operation: Callable[..., None], inputs: list[Path], output: Path, *operation_args: Any, trace_memory: bool = False
+) -> dict[str, Any]:
+    """Run operation(*inputs, output, *operation_args) and return its report.
+
+    The report has the wall time and process_max_rss_mb, the peak resident
+    size of the process since it started: in a worker that ran several files
+    it is the largest of them so far, not the one of this file. With
+    trace_memory, peak_alloc_mb is the peak of the python and numpy
+    allocations (tracemalloc) of this operation alone. FILE_ERRORS are
+    reported instead of raised, so one bad file does not stop a batch.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    error = ""
+    try:
+        operation(*inputs, output, *operation_args)
+    except FILE_ERRORS as e:
+        error = f"{type(e).__name__}: {e}"
+    seconds = time.perf_counter() - start
+    peak_alloc_mb = None
+    if trace_memory:
+        peak_alloc_mb = tracemalloc.get_traced_memory()[1] / 1024**2
+        tracemalloc.stop()
+    return {
+        "inputs": [str(x) for x in inputs],
+        "output": str(output),
+        "status": "error" if error else "ok",
+        "error": error,
+        "seconds": seconds,
+        "peak_alloc_mb": peak_alloc_mb,
+        "process_max_rss_mb": _process_max_rss_mb(),
+    }
+
+
+def _run_file(job: tuple[str, Path, Path, argparse.Namespace]) -> dict[str, Any]:
+    command, filename, output, args = job
+    return run_and_report(COMMANDS[command], [filename], output, args, trace_memory=args.trace_memory)
+
+
+def _combine(*filenames_and_output: Any) -> None:
+    *filenames, output, n_bins = filenames_and_output
+    homogenize_and_combine_volumes(filenames, n_bins).write_mrc_file(output)
+
+
+def _check_not_inputs(inputs: list[Path], outputs: list[Path]) -> None:
+    """Refuse to start when an output would overwrite an input, before anything is written."""
+    resolved_inputs = {x.resolve() for x in inputs}
+    overwritten = [str(x) for x in outputs if x.resolve() in resolved_inputs]
+    if overwritten:
+        msg = f"Outputs would overwrite their inputs, use --output-dir or --suffix: {overwritten}"
+        raise RuntimeError(msg)
+
+
+def run_command(args: argparse.Namespace) -> Iterator[dict[str, Any]]:
+    """Reports of a parsed dpf-mrc command line, in input order, as the outputs are written."""
+    inputs = expand_inputs(args.inputs, args.file_list)
+    if args.command == "combine":
+        _check_not_inputs(inputs, [Path(args.output)])
+        yield run_and_report(_combine, inputs, Path(args.output), args.n_bins, trace_memory=args.trace_memory)
+        return
+    if args.jobs < 1:
+        msg = "--jobs must be at least 1"
+        raise RuntimeError(msg)
+    suffix = f"_{args.command}" if args.suffix is None else args.suffix
+    extension = CONVERT_SUFFIXES[args.to] if args.command == "convert" else None
+    if args.output_dir:
+        Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+    jobs = [(args.command, x, output_filename(x, args.output_dir, suffix, extension), args) for x in inputs]
+    _check_not_inputs(inputs, [x[2] for x in jobs])
+    if args.jobs == 1:
+        yield from map(_run_file, jobs)
+        return
+    with ProcessPoolExecutor(args.jobs) as pool:
+        yield from pool.map(_run_file, jobs)
+
+
+def cmdline_main(cmdline_args: list[str]) -> list[dict[str, Any]]:
+    args = parse_args(cmdline_args)
+    reports = []
+    t1 = time.time()
+    report_file = Path(args.report).open("w") if args.report else None  # noqa: SIM115
+    try:
+        for report in run_command(args):
+            reports.append(report)
+            if report_file is not None:
+                report_file.write(json.dumps(report) + "\n")
+                report_file.flush()
+            if report["status"] != "ok":
+                logger.error("failed %s: %s", report["inputs"], report["error"])
+    finally:
+        if report_file is not None:
+            report_file.close()
+    t2 = time.time()
+    n_failed = sum(x["status"] != "ok" for x in reports)
+    logger.info("%d of %d outputs written in %.1f seconds", len(reports) - n_failed, len(reports), t2 - t1)
+    return reports
+
+
+def cmdline_wrapper():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    reports = cmdline_main(sys.argv[1:])
+    if any(x["status"] != "ok" for x in reports):
+        sys.exit(1)
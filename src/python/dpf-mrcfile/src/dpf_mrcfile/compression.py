@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import bz2
+import gzip
+import importlib
+from pathlib import Path
+from typing import IO, Any
+
+import numpy as np
+
+COMPRESSION_SUFFIXES = {
+    ".gz": "gzip",
+    ".gzip": "gzip",
+    ".bz2": "bz2",
+    ".zst": "zstd",
+    ".zstd": "zstd",
+}
+"file extensions of the supported compressions, e.g. map.mrc.gz"
+
+
+def compression_for(filename: str | Path) -> str | None:
+    """Compression of filename chosen by its extension, None for raw files."""
+    return COMPRESSION_SUFFIXES.get(Path(filename).suffix.lower())
+
+
+def _zstandard() -> Any:
+    try:
+        return importlib.import_module("zstandard")
+    except ImportError as e:
+        msg = "zstd compressed MRC files need the zstandard package (pip install dpf-mrcfile[zstd])"
+        raise RuntimeError(msg) from e
+
+
+def open_file(filename: str | Path, mode: str, compresslevel: int | None = None, threads: int = -1) -> IO[bytes]:
+    """Open filename for binary reading ("rb") or writing ("wb"), (de)compressing by extension.
+
+    Inputs:
+        compresslevel: compression level when writing, the default of every
+            compression when None
+        threads: number of zstd compression threads when writing, -1 for
+            one per cpu
+    """
+    if mode not in ("rb", "wb"):
+        msg = f"Unsupported file mode {mode}"
+        raise RuntimeError(msg)
+    compression = compression_for(filename)
+    if compression == "gzip":
+        return gzip.open(filename, mode, compresslevel=9 if compresslevel is None else compresslevel)
+    if compression == "bz2":
+        return bz2.open(filename, mode, compresslevel=9 if compresslevel is None else compresslevel)
+    if compression == "zstd":
+        zstandard = _zstandard()
+        raw = Path(filename).open(mode)  # noqa: SIM115
+        if mode == "rb":
+            return zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        compressor = zstandard.ZstdCompressor(level=3 if compresslevel is None else compresslevel, threads=threads)
+        return compressor.stream_writer(raw, closefd=True)
+    return Path(filename).open(mode)
+
+
+def read_into(f: IO[bytes], array: np.ndarray | bytearray) -> None:
+    """Fill the contiguous array from f, block by block as the stream yields them, without an intermediate copy."""
+    buffer = memoryview(array).cast("B")
+    n_read = 0
+    while n_read < len(buffer):
+        n = f.readinto(buffer[n_read:])
+        if not n:
+            msg = f"MRC file is truncated, read {n_read} of {len(buffer)} bytes"
+            raise RuntimeError(msg)
+        n_read += n
@@ -1,65 +1,81 @@
 """standard map conversions."""
 
+import importlib
+import io
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any, TextIO
+
 import numpy as np
 
-from . import MRC
+from . import HEADER_NUMBER_FIELDS, MRC, MRCSStack
 
+SITUS_CHUNK_VALUES = 1024 * 1024
+"approximate number of values the situs reader and writer hold as text at a time"
 
-def mrc_to_situs(my_map: MRC) -> str:
-    """convert mrc object to situs string."""
-    situs_str = (
+SITUS_VALUES_PER_LINE = 10
+
+
+def write_situs(my_map: MRC, f: TextIO) -> None:
+    """Write my_map to the text file handle f in situs format.
+
+    Values are formatted SITUS_VALUES_PER_LINE to a line with one format call
+    per block of z sections, so only about SITUS_CHUNK_VALUES values are held
+    as text at a time.
+    """
+    f.write(
         f"{my_map.A_per_pixel:.6f} {my_map.originx:.6f} {my_map.originy:.6f}"
         f" {my_map.originz:.6f} {my_map.nx} {my_map.ny} {my_map.nz}\n\n"
     )
-    volume_data_to_write = my_map.volume_data.flatten("F")
-    f_string = [f"{val:11.6f}" for val in volume_data_to_write]
-    count = 0
-    for f in f_string:
-        situs_str += f
-        count += 1
-        if count == 10:
-            situs_str += " \n"
-            count = 0
-        else:
-            situs_str += " "
-    return situs_str
+    volume = my_map.volume_data
+    line_format = "%11.6f " * SITUS_VALUES_PER_LINE + "\n"
+    z_step = max(1, SITUS_CHUNK_VALUES // max(1, volume.shape[0] * volume.shape[1]))
+    # values of the last, incomplete line of a block are carried over to the next one
+    pending = np.empty(0)
+    for z in range(0, volume.shape[2], z_step):
+        values = np.concatenate((pending, volume[:, :, z : z + z_step].ravel("F")))
+        n_lines = len(values) // SITUS_VALUES_PER_LINE
+        n_full = n_lines * SITUS_VALUES_PER_LINE
+        f.write((line_format * n_lines) % tuple(values[:n_full].tolist()))
+        pending = values[n_full:]
+    f.write(("%11.6f " * len(pending)) % tuple(pending.tolist()))
 
 
-def situs_to_mrc(my_situs: str) -> MRC:
-    data = []
-    a_per_pix = None
-    originx = None
-    originy = None
-    originz = None
-    nx = None
-    ny = None
-    nz = None
-    for i, line in enumerate(my_situs.split("\n")):
-        line = line.strip()
-        split_line = line.split()
+def read_situs(f: TextIO) -> MRC:
+    """Read a situs map from the text file handle f.
+
+    The data is parsed a block of about SITUS_CHUNK_VALUES values at a time
+    with numpy straight into the (nx, ny, nz) volume.
+    """
+    header_line = ""
+    while not header_line:
+        line = f.readline()
         if not line:
-            continue
-        if i == 0:
-            a_per_pix = float(split_line[0])
-            originx = float(split_line[1])
-            originy = float(split_line[2])
-            originz = float(split_line[3])
-            nx = int(split_line[4])
-            ny = int(split_line[5])
-            nz = int(split_line[6])
-        else:
-            data.extend([float(x) for x in split_line])
-    error_text = f"Unable to obtain the following fields from situs file: {my_situs} --"
-    og_len = len(error_text)
-    for x in (a_per_pix, originx, originy, originz, nx, ny, nz):
-        if x is None:
-            error_text += f" {x=}"
-    if len(error_text) != og_len:
-        raise RuntimeError(error_text)
-
-    data = np.reshape(np.array(data), (nx, ny, nz), order="F")
+            break
+        header_line = line.strip()
+    split_line = header_line.split()
+    if len(split_line) < 7:
+        msg = f"Unable to obtain the situs header fields from: {header_line!r}"
+        raise RuntimeError(msg)
+    a_per_pix, originx, originy, originz = (float(x) for x in split_line[:4])
+    nx, ny, nz = (int(x) for x in split_line[4:7])
+
+    data = np.empty(nx * ny * nz)
+    n_read = 0
+    # a situs line is about 12 characters per value
+    while lines := f.readlines(SITUS_CHUNK_VALUES * 12):
+        values = np.fromstring("".join(lines), sep=" ")
+        if n_read + len(values) > len(data):
+            msg = f"Situs file has more than the {len(data)} values of its header"
+            raise RuntimeError(msg)
+        data[n_read : n_read + len(values)] = values
+        n_read += len(values)
+    if n_read != len(data):
+        msg = f"Situs file has {n_read} of the {len(data)} values of its header"
+        raise RuntimeError(msg)
+
     out_mrc = MRC()
-    out_mrc.volume_data = data
+    out_mrc.volume_data = np.reshape(data, (nx, ny, nz), order="F")
     out_mrc.header_from_data()
     out_mrc.A_per_pixel = a_per_pix
     out_mrc.originx = originx
@@ -68,6 +84,165 @@ def situs_to_mrc(my_situs: str) -> MRC:
     return out_mrc
 
 
+def mrc_to_situs(my_map: MRC) -> str:
+    """convert mrc object to situs string, see write_situs."""
+    f = io.StringIO()
+    write_situs(my_map, f)
+    return f.getvalue()
+
+
+def situs_to_mrc(my_situs: str) -> MRC:
+    """convert situs string to mrc object, see read_situs."""
+    return read_situs(io.StringIO(my_situs))
+
+
+ARRAY_STORE_DATASET = "data"
+"name of the array in the hdf5 files and zarr groups written by write_hdf5 and write_zarr"
+
+ARRAY_STORE_WRITE_BYTES = 64 * 1024 * 1024
+"approximate size of the blocks of sections write_hdf5 and write_zarr copy at a time"
+
+
+def _optional_module(name: str, extra: str) -> Any:
+    """The optional dependency name, installed with the dpf-mrcfile[extra] extra."""
+    try:
+        return importlib.import_module(name)
+    except ImportError as e:
+        msg = f"{name} is needed for this conversion (pip install dpf-mrcfile[{extra}])"
+        raise RuntimeError(msg) from e
+
+
+def _store_layout(my_map: MRC | MRCSStack) -> tuple[MRC, str, tuple[int, int, int], np.dtype]:
+    """(header, "volume" or "stack", stored (nz, ny, nx) shape, native dtype) of my_map."""
+    if isinstance(my_map, MRCSStack):
+        nz, nx, ny = my_map.shape
+        return my_map.header, "stack", (nz, ny, nx), my_map.dtype.newbyteorder("=")
+    if len(my_map.volume_data):
+        nx, ny, nz = my_map.volume_data.shape
+        return my_map, "volume", (nz, ny, nx), my_map.volume_data.dtype.newbyteorder("=")
+    if len(my_map.all_images):
+        nx, ny = np.shape(my_map.all_images[0])[:2]
+        dtype = np.asarray(my_map.all_images[0]).dtype.newbyteorder("=")
+        return my_map, "stack", (len(my_map.all_images), ny, nx), dtype
+    msg = "MRC has neither volume_data nor all_images to export"
+    raise RuntimeError(msg)
+
+
+def _store_blocks(
+    my_map: MRC | MRCSStack, shape: tuple[int, int, int], itemsize: int
+) -> Iterator[tuple[int, np.ndarray]]:
+    """(first section, (n, ny, nx) sections) blocks of the stored array of my_map."""
+    step = max(1, ARRAY_STORE_WRITE_BYTES // max(1, shape[1] * shape[2] * itemsize))
+    for start in range(0, shape[0], step):
+        if isinstance(my_map, MRCSStack):
+            block = my_map.images[start : start + step].transpose(0, 2, 1)
+        elif len(my_map.volume_data):
+            block = my_map.volume_data[:, :, start : start + step].T
+        else:
+            # images are (nx, ny) or, as read by read_mrcs, (nx, ny, 1)
+            images = my_map.all_images[start : start + step]
+            block = np.stack([np.asarray(x).reshape(shape[2], shape[1]).T for x in images])
+        yield start, block
+
+
+def _header_attrs(header: MRC, kind: str) -> dict[str, Any]:
+    attrs = {name: getattr(header, name) for name in HEADER_NUMBER_FIELDS}
+    attrs["A_per_pixel"] = header.A_per_pixel
+    attrs["mapstring"] = header.mapstring
+    attrs["kind"] = kind
+    return attrs
+
+
+def _mrc_from_store(data: Any, attrs: Any) -> MRC:
+    """MRC of the stored (nz, ny, nx) array data and its header attributes attrs."""
+    out_mrc = MRC()
+    for name in HEADER_NUMBER_FIELDS:
+        if name in attrs:
+            setattr(out_mrc, name, attrs[name].item() if hasattr(attrs[name], "item") else attrs[name])
+    out_mrc.A_per_pixel = float(attrs.get("A_per_pixel", 0))
+    out_mrc.mapstring = str(attrs.get("mapstring", "MAP "))
+    # (nz, ny, nx) in C order is (nx, ny, nz) in Fortran order
+    volume = np.asarray(data[...]).T
+    if attrs.get("kind") == "stack":
+        out_mrc.all_images = np.dsplit(volume, volume.shape[2])
+    else:
+        out_mrc.volume_data = volume
+    return out_mrc
+
+
+def write_hdf5(
+    my_map: MRC | MRCSStack,
+    filename: str | Path,
+    chunks: tuple[int, int, int] | None = None,
+    compression: str | None = "gzip",
+    compression_opts: Any = 4,
+) -> None:
+    """Write a volume, an image stack (all_images or an MRCSStack) to a chunked hdf5 file.
+
+    The data is stored as a (nz, ny, nx) dataset named ARRAY_STORE_DATASET,
+    the byte layout of the MRC data block, with the header fields as its
+    attributes. It is copied a block of sections at a time, so memory mapped
+    maps and stacks are never loaded whole.
+
+    Inputs:
+        chunks: (nz, ny, nx) chunk shape, by default one section or image per
+            chunk; e.g. (64, ny, nx) for particle batches or (nz, 64, 64) for
+            sub-volumes
+        compression, compression_opts: hdf5 filter, see h5py.Group.create_dataset
+    """
+    h5py = _optional_module("h5py", "hdf5")
+    header, kind, shape, dtype = _store_layout(my_map)
+    with h5py.File(filename, "w") as f:
+        dataset = f.create_dataset(
+            ARRAY_STORE_DATASET,
+            shape=shape,
+            dtype=dtype,
+            chunks=chunks or (1, shape[1], shape[2]),
+            compression=compression,
+            compression_opts=compression_opts if compression is not None else None,
+        )
+        dataset.attrs.update(_header_attrs(header, kind))
+        for start, block in _store_blocks(my_map, shape, dtype.itemsize):
+            dataset[start : start + len(block)] = block
+
+
+def read_hdf5(filename: str | Path) -> MRC:
+    """Read a volume or image stack written by write_hdf5."""
+    h5py = _optional_module("h5py", "hdf5")
+    with h5py.File(filename, "r") as f:
+        dataset = f[ARRAY_STORE_DATASET]
+        return _mrc_from_store(dataset, dict(dataset.attrs))
+
+
+def write_zarr(my_map: MRC | MRCSStack, store: str | Path, chunks: tuple[int, int, int] | None = None) -> None:
+    """Write a volume, an image stack (all_images or an MRCSStack) to a chunked zarr group.
+
+    Same layout as write_hdf5: a (nz, ny, nx) array named ARRAY_STORE_DATASET,
+    with the header fields as attributes, compressed with the default codec
+    of zarr. Every chunk is a separate object, so parallel jobs can read
+    their sections or particles independently.
+
+    Inputs:
+        chunks: (nz, ny, nx) chunk shape, by default one section or image per chunk
+    """
+    zarr = _optional_module("zarr", "zarr")
+    header, kind, shape, dtype = _store_layout(my_map)
+    group = zarr.open_group(str(store), mode="w")
+    # zarr 3 renamed create_dataset to create_array
+    create_array = getattr(group, "create_array", None) or group.create_dataset
+    array = create_array(ARRAY_STORE_DATASET, shape=shape, dtype=dtype, chunks=chunks or (1, shape[1], shape[2]))
+    array.attrs.update(_header_attrs(header, kind))
+    for start, block in _store_blocks(my_map, shape, dtype.itemsize):
+        array[start : start + len(block)] = block
+
+
+def read_zarr(store: str | Path) -> MRC:
+    """Read a volume or image stack written by write_zarr."""
+    zarr = _optional_module("zarr", "zarr")
+    array = zarr.open_group(str(store), mode="r")[ARRAY_STORE_DATASET]
+    return _mrc_from_store(array, dict(array.attrs))
+
+
 def convert_map_to_mrc(map_in):
     """MRC files use orgin(x,y,z) to set map origin coordinates in space MAP
     files use voxel indexes n(x,y,z)start to set map origin coordinates in
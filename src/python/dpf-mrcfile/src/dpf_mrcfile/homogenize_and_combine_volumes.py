@@ -1,53 +1,121 @@
+from collections.abc import Iterable
+from pathlib import Path
+
 import numpy as np
 
-from . import MRC
+from . import MRC, read_mrc
 
+HISTOGRAM_MATCH_BINS = 4096
+"number of histogram bins of the approximate match_histogram"
 
-def match_histogram(base: np.ndarray, to_change: np.ndarray) -> np.ndarray:
-    X, Y, Z = np.meshgrid(*map(np.arange, base.shape[::-1]))
-    base_table = np.vstack((base.ravel(), X.ravel(), Y.ravel(), Z.ravel())).T
-    base_table = base_table[base_table[:, 0].argsort()]
 
-    X, Y, Z = np.meshgrid(*map(np.arange, to_change.shape[::-1]))
-    to_change_table = np.vstack((to_change.ravel(), Z.ravel(), Y.ravel(), X.ravel())).T
-    to_change_table = to_change_table[to_change_table[:, 0].argsort()]
+def match_histogram(base: np.ndarray, to_change: np.ndarray, n_bins: int | None = None) -> np.ndarray:
+    """to_change with its intensities replaced so their distribution matches the one of base.
 
-    assert base_table.shape == to_change_table.shape
+    Every voxel of to_change gets the quantile of base at its own rank in
+    to_change, so the ordering of to_change is kept. base and to_change can
+    have different shapes; when their sizes differ the quantiles of base are
+    linearly interpolated.
 
-    to_change_table[:, 0] = base_table[:, 0]
-    tct = to_change_table
-    tct = tct[np.lexsort((tct[:, 1], tct[:, 2], tct[:, 3]))]
-    tct = tct[:, 0].reshape(base.shape).swapaxes(0, 1)
-    return tct
+    Inputs:
+        n_bins: None to rank every voxel exactly, which needs an argsort of
+            to_change (8 bytes per voxel) and a sorted copy of base. Otherwise
+            both maps are reduced to cumulative histograms of n_bins bins
+            (e.g. HISTOGRAM_MATCH_BINS) and voxels are mapped through them,
+            which only allocates the result but is approximate within a bin
+    """
+    if base.size == 0 or to_change.size == 0:
+        msg = "Can not match the histogram of an empty map"
+        raise RuntimeError(msg)
+    if n_bins is not None:
+        return _match_cdf(*_cdf(base, n_bins), to_change, n_bins, base.dtype)
+    return _match_sorted(np.sort(base, axis=None), to_change)
 
 
-def homogenize_and_combine_volumes(mrcs_in: list[MRC]) -> MRC:
-    SMALL_DIFF = 0.0000001
+def _match_sorted(base_sorted: np.ndarray, to_change: np.ndarray) -> np.ndarray:
+    if base_sorted.size != to_change.size:
+        base_sorted = np.interp(
+            np.linspace(0, base_sorted.size - 1, to_change.size), np.arange(base_sorted.size), base_sorted
+        ).astype(base_sorted.dtype, copy=False)
+    matched = np.empty(to_change.shape, dtype=base_sorted.dtype)
+    matched.reshape(-1)[np.argsort(to_change, axis=None)] = base_sorted
+    return matched
 
-    maps = []
-    for mrc in mrcs_in:
-        map_ = mrc.volume_data.copy()
-        map_[map_ == 0] = SMALL_DIFF
-        map_ /= np.max(map_)
-        maps.append(map_)
 
-    for i in range(len(maps)):
-        if i == 0:
-            continue
-        maps[i] = match_histogram(maps[0], maps[i])
+def _cdf(data: np.ndarray, n_bins: int) -> tuple[np.ndarray, np.ndarray]:
+    """(bin edges, fraction of data below every edge) of data."""
+    counts, edges = np.histogram(data, bins=n_bins)
+    cdf = np.zeros(len(edges))
+    np.cumsum(counts, out=cdf[1:])
+    cdf /= cdf[-1]
+    return edges, cdf
 
-    sum_map = np.sum(maps, axis=0)
 
-    sum_map[sum_map == 0] = SMALL_DIFF
-    sum_map = np.stack([sum_map] * len(maps), axis=3)
+def _match_cdf(
+    base_edges: np.ndarray, base_cdf: np.ndarray, to_change: np.ndarray, n_bins: int, dtype: np.dtype
+) -> np.ndarray:
+    change_edges, change_cdf = _cdf(to_change, n_bins)
+    # intensities of base at the quantiles of the bin edges of to_change
+    matched_edges = np.interp(change_cdf, base_cdf, base_edges)
+    matched = np.empty(to_change.shape, dtype=dtype)
+    matched[...] = np.interp(to_change, change_edges, matched_edges)
+    return matched
+
+
+def _normalized_volume(mrc: MRC | str | Path, small_diff: float) -> np.ndarray:
+    if not isinstance(mrc, MRC):
+        mrc = read_mrc(mrc, mmap=True)
+    map_ = np.array(mrc.volume_data, dtype=np.result_type(mrc.volume_data.dtype, np.float32))
+    map_[map_ == 0] = small_diff
+    map_ /= np.max(map_)
+    return map_
+
 
-    weights_map = np.stack(maps, axis=3)
-    weights_map /= sum_map
+def homogenize_and_combine_volumes(mrcs_in: Iterable[MRC | str | Path], n_bins: int | None = None) -> MRC:
+    """Combine maps after matching the histograms of all of them to the first one.
 
-    avgs = np.average(sum_map, weights=weights_map, axis=3)
-    avgs -= SMALL_DIFF
+    Maps are consumed one at a time from mrcs_in, which can be MRC objects or
+    file names (read memory mapped), so a generator combines any number of
+    them with a handful of volumes in memory: the running sum, the current
+    map and what matching it needs. Each map is normalized to a maximum of 1
+    before it is matched.
+
+    Every voxel of the result is the average of the summed maps weighted by
+    each map's share of that sum. Those weights always add up to 1, so the
+    average is the sum itself, accumulated in float64 as the maps arrive.
+
+    Inputs:
+        n_bins: histogram bins used by match_histogram, None for exact matching
+    """
+    SMALL_DIFF = 0.0000001
+
+    sum_map = None
+    for mrc in mrcs_in:
+        map_ = _normalized_volume(mrc, SMALL_DIFF)
+        if sum_map is None:
+            # only the distribution of the first map is needed to match the others
+            if n_bins is None:
+                base_sorted = np.sort(map_, axis=None)
+            else:
+                base_edges, base_cdf = _cdf(map_, n_bins)
+            sum_map = map_.astype(np.float64)
+            continue
+        if map_.shape != sum_map.shape:
+            msg = f"Can not combine a map of shape {map_.shape} with maps of shape {sum_map.shape}"
+            raise RuntimeError(msg)
+        if n_bins is None:
+            map_ = _match_sorted(base_sorted, map_)
+        else:
+            map_ = _match_cdf(base_edges, base_cdf, map_, n_bins, map_.dtype)
+        sum_map += map_
+    if sum_map is None:
+        msg = "No maps to combine"
+        raise RuntimeError(msg)
+
+    sum_map[sum_map == 0] = SMALL_DIFF
+    sum_map -= SMALL_DIFF
 
     dens_map = MRC()
-    dens_map.volume_data = avgs
+    dens_map.volume_data = sum_map.astype(np.float32)
     dens_map.header_from_data()
     return dens_map
@@ -1,30 +1,7 @@
 import numpy as np
 
 from . import MRC
-
-
-def _check_z_slice(dens_map, z, xlen, ylen):
-    for x in range(xlen):
-        for y in range(ylen):
-            if dens_map.volume_data[x, y, z] > 0:
-                return True
-    return False
-
-
-def _check_x_slice(dens_map, x, ylen, zlen):
-    for y in range(ylen):
-        for z in range(zlen):
-            if dens_map.volume_data[x, y, z] > 0:
-                return True
-    return False
-
-
-def _check_y_slice(dens_map, y, xlen, zlen):
-    for x in range(xlen):
-        for z in range(zlen):
-            if dens_map.volume_data[x, y, z] > 0:
-                return True
-    return False
+from .utils import density_bounding_box
 
 
 def pad_map(dens_map: MRC, padding: float) -> MRC:
@@ -38,30 +15,15 @@ def pad_map(dens_map: MRC, padding: float) -> MRC:
     ybackpad = 0
     zfwdpad = 0
     zbackpad = 0
-    for z in range(dens_map.volume_data.shape[2]):
-        if _check_z_slice(dens_map, z, dens_map.volume_data.shape[0], dens_map.volume_data.shape[1]):
-            zfwdpad = z
-            break
-    for z in range(dens_map.volume_data.shape[2] - 1, 0, -1):
-        if _check_z_slice(dens_map, z, dens_map.volume_data.shape[0], dens_map.volume_data.shape[1]):
-            zbackpad = dens_map.volume_data.shape[2] - 1 - z
-            break
-    for x in range(dens_map.volume_data.shape[0]):
-        if _check_x_slice(dens_map, x, dens_map.volume_data.shape[1], dens_map.volume_data.shape[2]):
-            xfwdpad = x
-            break
-    for x in range(dens_map.volume_data.shape[0] - 1, 0 - 1, -1):
-        if _check_x_slice(dens_map, x, dens_map.volume_data.shape[1], dens_map.volume_data.shape[2]):
-            xbackpad = dens_map.volume_data.shape[0] - 1 - x
-            break
-    for y in range(dens_map.volume_data.shape[1]):
-        if _check_y_slice(dens_map, y, dens_map.volume_data.shape[0], dens_map.volume_data.shape[2]):
-            yfwdpad = y
-            break
-    for y in range(dens_map.volume_data.shape[1] - 1, 0 - 1, -1):
-        if _check_y_slice(dens_map, y, dens_map.volume_data.shape[0], dens_map.volume_data.shape[2]):
-            ybackpad = dens_map.volume_data.shape[1] - 1 - y
-            break
+    bounding_box = density_bounding_box(dens_map.volume_data, 0)
+    if bounding_box is not None:
+        (x_min, x_max), (y_min, y_max), (z_min, z_max) = bounding_box
+        xfwdpad = x_min
+        xbackpad = dens_map.volume_data.shape[0] - 1 - x_max
+        yfwdpad = y_min
+        ybackpad = dens_map.volume_data.shape[1] - 1 - y_max
+        zfwdpad = z_min
+        zbackpad = dens_map.volume_data.shape[2] - 1 - z_max
     padding = int(round(1 / dens_map.A_per_pixel * padding))
     xfwdpad = max(0, padding - xfwdpad)
     xbackpad = max(0, padding - xbackpad)
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import math
+
+import numpy as np
+
+STATS_CHUNK_BYTES = 32 * 1024 * 1024
+"approximate size of the float64 temporaries of RunningStats.update_chunked"
+
+
+def real_values(data: np.ndarray) -> np.ndarray:
+    """Values statistics are computed on: the magnitude for complex data (modes 3 and 4)."""
+    if data.dtype.names is not None:
+        return np.hypot(data["real"].astype(np.float32), data["imag"].astype(np.float32))
+    if np.iscomplexobj(data):
+        return np.abs(data)
+    return data
+
+
+class RunningStats:
+    """Streaming min, max, mean and rms deviation of data seen in chunks.
+
+    Every chunk is reduced on its own with float64 accumulation and merged
+    into the totals with the parallel variant of Welford's algorithm (Chan et
+    al.), so the result matches a single pass over all the data without ever
+    holding it at once.
+    """
+
+    n: int
+    "number of values seen"
+    mean: float
+    m2: float
+    "sum of squared deviations from mean"
+    min: float
+    max: float
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, data: np.ndarray) -> None:
+        """Add all values of data."""
+        data = real_values(np.asarray(data))
+        if data.size == 0:
+            return
+        chunk = RunningStats()
+        chunk.n = data.size
+        chunk.mean = float(np.mean(data, dtype=np.float64))
+        deviations = np.asarray(data, dtype=np.float64) - chunk.mean
+        chunk.m2 = float(np.vdot(deviations, deviations))
+        chunk.min = float(np.min(data))
+        chunk.max = float(np.max(data))
+        self.merge(chunk)
+
+    def update_chunked(self, data: np.ndarray, chunk_bytes: int = STATS_CHUNK_BYTES) -> None:
+        """Add all values of data, reduced in blocks along the last axis.
+
+        For (nx, ny, nz) maps a block is a set of whole z sections, contiguous
+        in a Fortran ordered or memory mapped map, so every byte is read once
+        and the temporaries stay around chunk_bytes whatever the size of data.
+        """
+        data = np.asarray(data)
+        if data.ndim == 0:
+            self.update(data)
+            return
+        section_bytes = max(1, data[..., 0].size * np.dtype(np.float64).itemsize)
+        step = max(1, chunk_bytes // section_bytes)
+        for start in range(0, data.shape[-1], step):
+            self.update(data[..., start : start + step])
+
+    def merge(self, other: RunningStats) -> None:
+        """Add the values seen by other."""
+        if other.n == 0:
+            return
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta * delta * self.n * other.n / n
+        self.n = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def rms_dev(self) -> float:
+        "rms deviation from the mean, 0 when nothing was seen"
+        return math.sqrt(self.m2 / self.n) if self.n else 0.0
@@ -3,6 +3,7 @@ import math
 import numpy as np
 
 from . import MRC
+from .utils import density_bounding_box
 
 
 def new_max_and_min(mi, ma, cubesize):
@@ -14,16 +15,20 @@ def new_max_and_min(mi, ma, cubesize):
 
 
 def trim_map_to_density(map_in: MRC, lower_limit: float, padding: int, force_cube: bool = False) -> MRC:
-    xs, ys, zs = np.where(map_in.volume_data >= lower_limit)
+    bounding_box = density_bounding_box(map_in.volume_data, lower_limit, inclusive=True)
+    if bounding_box is None:
+        msg = f"No density >= {lower_limit} to trim the map to"
+        raise RuntimeError(msg)
+    (x_lo, x_hi), (y_lo, y_hi), (z_lo, z_hi) = bounding_box
 
-    x_min = min(xs) - padding
-    x_max = max(xs) + padding
+    x_min = x_lo - padding
+    x_max = x_hi + padding
 
-    y_min = min(ys) - padding
-    y_max = max(ys) + padding
+    y_min = y_lo - padding
+    y_max = y_hi + padding
 
-    z_min = min(zs) - padding
-    z_max = max(zs) + padding
+    z_min = z_lo - padding
+    z_max = z_hi + padding
 
     if force_cube:
         x_dist = abs(x_max - x_min)
@@ -31,12 +36,12 @@ def trim_map_to_density(map_in: MRC, lower_limit: float, padding: int, force_cub
         z_dist = abs(z_max - z_min)
         box_size = max(x_dist, y_dist, z_dist)
         new_map = np.zeros((box_size, box_size, box_size))
-        xyz_shape = map_in.volume_data[min(xs) : max(xs), min(ys) : max(ys), min(zs) : max(zs)].shape
+        xyz_shape = map_in.volume_data[x_lo:x_hi, y_lo:y_hi, z_lo:z_hi].shape
         xslice, yslice, zslice = [slice(int((box_size - x) / 2), int((box_size - x) / 2) + x) for x in xyz_shape]
-        new_map[xslice, yslice, zslice] = map_in.volume_data[min(xs) : max(xs), min(ys) : max(ys), min(zs) : max(zs)]
-        originx = map_in.originx - (xslice.start - min(xs)) * map_in.A_per_pixel
-        originy = map_in.originy - (yslice.start - min(ys)) * map_in.A_per_pixel
-        originz = map_in.originz - (zslice.start - min(zs)) * map_in.A_per_pixel
+        new_map[xslice, yslice, zslice] = map_in.volume_data[x_lo:x_hi, y_lo:y_hi, z_lo:z_hi]
+        originx = map_in.originx - (xslice.start - x_lo) * map_in.A_per_pixel
+        originy = map_in.originy - (yslice.start - y_lo) * map_in.A_per_pixel
+        originz = map_in.originz - (zslice.start - z_lo) * map_in.A_per_pixel
     else:
         new_map = np.zeros((x_max - x_min, y_max - y_min, z_max - z_min))
         print("left sides", x_min, y_min, z_min, new_map.shape)
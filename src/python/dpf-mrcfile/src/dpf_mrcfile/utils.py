@@ -1,20 +1,255 @@
-from copy import deepcopy
-from typing import Sequence
+import copy
+from collections.abc import Callable, Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
 
 import numpy as np
 
-from . import MRC
+from . import HEADER_SIZE, MRC, dtype_for_mode, mode_for_dtype, read_mrc
+from .compression import compression_for
+from .running_stats import RunningStats
+
+BOUNDING_BOX_CHUNK_BYTES = 32 * 1024 * 1024
+"approximate number of voxels (one byte of mask each) density_bounding_box looks at a time"
+
+VOLUME_CHUNK_BYTES = 64 * 1024 * 1024
+"approximate size of the blocks of z sections the chunked volume math works on"
 
 
 def add_MRCs(maps: Sequence[MRC]) -> MRC:
+    """Sum of maps with a copy of the header of the first one, its mode and statistics updated for the sum.
+
+    None of the maps is modified or copied whole.
+    """
     if not maps:
         raise RuntimeError("Cannot add_MRCs that don't exist!")
-    map_0 = deepcopy(maps[0])
-    for map_ in maps[1:]:
-        map_0.volume_data += map_.volume_data
-    return map_0
+    # deep copy the header, the data blocks of the first map are only referenced
+    data_blocks = (getattr(maps[0], name, None) for name in ("volume_data", "all_images", "alldata"))
+    summed = copy.deepcopy(maps[0], {id(x): x for x in data_blocks})
+    summed.volume_data = add_volumes(maps)
+    stats = volume_stats(summed.volume_data)
+    summed.imod = mode_for_dtype(summed.volume_data.dtype)
+    summed.amin, summed.amax, summed.amean = stats.min, stats.max, stats.mean
+    summed.rms_dev = stats.rms_dev
+    return summed
 
 
 def zero_volume_data(map_in: MRC) -> MRC:
-    map_in.volume_data = np.zeros(map_in.volume_data.shape)
+    map_in.volume_data = np.zeros(map_in.volume_data.shape, dtype=np.float32, order="F")
     return map_in
+
+
+def _as_volume(volume: np.ndarray | MRC | str | Path) -> np.ndarray:
+    """(nx, ny, nz) data of volume, mrc files are memory mapped."""
+    if isinstance(volume, np.ndarray):
+        return volume
+    if isinstance(volume, MRC):
+        return volume.volume_data
+    return read_mrc(volume, mmap=True).volume_data
+
+
+def _z_blocks(shape: tuple[int, ...], itemsize: int, chunk_bytes: int) -> list[slice]:
+    """Slices of consecutive z sections of about chunk_bytes each."""
+    section_bytes = max(1, shape[0] * shape[1] * itemsize)
+    step = max(1, chunk_bytes // section_bytes)
+    return [slice(z, z + step) for z in range(0, shape[2], step)]
+
+
+def map_volume_chunks(
+    func: Callable[..., np.ndarray],
+    volumes: Sequence[np.ndarray | MRC | str | Path],
+    out: np.ndarray | None = None,
+    chunk_bytes: int = VOLUME_CHUNK_BYTES,
+    n_workers: int | None = None,
+) -> np.ndarray:
+    """out[:, :, z] = func(*(volume[:, :, z] for volume in volumes)) for blocks z of whole z sections.
+
+    Blocks are computed by a pool of n_workers threads (numpy releases the GIL
+    in its loops). z sections are contiguous in the Fortran ordered maps of
+    this package and in memory mapped files, so with memory mapped volumes
+    and out (see open_volume and create_volume_file) only about n_workers
+    blocks per volume are resident at a time, whatever the size or number of
+    the maps.
+
+    Inputs:
+        volumes: (nx, ny, nz) arrays, MRC objects or mrc files, all of the same shape
+        out: array the result is written to, by default a new float32 (or
+            wider, if the data is) Fortran ordered array
+    """
+    volumes = [_as_volume(x) for x in volumes]
+    if not volumes:
+        msg = "No volumes to compute on"
+        raise RuntimeError(msg)
+    shape = volumes[0].shape
+    for volume in volumes:
+        if volume.shape != shape:
+            msg = f"Volume of shape {volume.shape} differs from {shape}"
+            raise RuntimeError(msg)
+    if out is None:
+        out = np.empty(shape, dtype=np.result_type(np.float32, *(x.dtype for x in volumes)), order="F")
+    elif out.shape != shape:
+        msg = f"Output of shape {out.shape} differs from the volumes {shape}"
+        raise RuntimeError(msg)
+    itemsize = max(out.dtype.itemsize, *(x.dtype.itemsize for x in volumes))
+
+    def _block(z: slice) -> None:
+        out[:, :, z] = func(*(x[:, :, z] for x in volumes))
+
+    with ThreadPoolExecutor(n_workers) as pool:
+        # list() re-raises the errors of the blocks
+        list(pool.map(_block, _z_blocks(shape, itemsize, chunk_bytes)))
+    return out
+
+
+def add_volumes(
+    volumes: Sequence[np.ndarray | MRC | str | Path],
+    out: np.ndarray | None = None,
+    chunk_bytes: int = VOLUME_CHUNK_BYTES,
+    n_workers: int | None = None,
+) -> np.ndarray:
+    """Voxel-wise sum of volumes, see map_volume_chunks."""
+
+    def _sum(*blocks: np.ndarray) -> np.ndarray:
+        total = blocks[0].astype(np.result_type(np.float32, blocks[0].dtype))
+        for block in blocks[1:]:
+            total += block
+        return total
+
+    return map_volume_chunks(_sum, volumes, out, chunk_bytes, n_workers)
+
+
+def scale_volume(
+    volume: np.ndarray | MRC | str | Path,
+    factor: float,
+    out: np.ndarray | None = None,
+    chunk_bytes: int = VOLUME_CHUNK_BYTES,
+    n_workers: int | None = None,
+) -> np.ndarray:
+    """volume * factor, see map_volume_chunks."""
+    return map_volume_chunks(lambda x: x * factor, [volume], out, chunk_bytes, n_workers)
+
+
+def threshold_volume(
+    volume: np.ndarray | MRC | str | Path,
+    threshold: float,
+    fill: float = 0,
+    out: np.ndarray | None = None,
+    chunk_bytes: int = VOLUME_CHUNK_BYTES,
+    n_workers: int | None = None,
+) -> np.ndarray:
+    """volume with every voxel below threshold set to fill, see map_volume_chunks."""
+    return map_volume_chunks(lambda x: np.where(x < threshold, fill, x), [volume], out, chunk_bytes, n_workers)
+
+
+def mask_volume(
+    volume: np.ndarray | MRC | str | Path,
+    mask: np.ndarray | MRC | str | Path,
+    out: np.ndarray | None = None,
+    chunk_bytes: int = VOLUME_CHUNK_BYTES,
+    n_workers: int | None = None,
+) -> np.ndarray:
+    """volume * mask (binary or soft), see map_volume_chunks."""
+    return map_volume_chunks(np.multiply, [volume, mask], out, chunk_bytes, n_workers)
+
+
+def volume_stats(
+    volume: np.ndarray | MRC | str | Path, chunk_bytes: int = VOLUME_CHUNK_BYTES, n_workers: int | None = None
+) -> RunningStats:
+    """Statistics of volume, blocks of z sections are reduced in parallel and merged."""
+    volume = _as_volume(volume)
+
+    def _block_stats(z: slice) -> RunningStats:
+        stats = RunningStats()
+        stats.update(volume[:, :, z])
+        return stats
+
+    stats = RunningStats()
+    with ThreadPoolExecutor(n_workers) as pool:
+        for block_stats in pool.map(_block_stats, _z_blocks(volume.shape, 8, chunk_bytes)):
+            stats.merge(block_stats)
+    return stats
+
+
+def normalize_volume(
+    volume: np.ndarray | MRC | str | Path,
+    out: np.ndarray | None = None,
+    chunk_bytes: int = VOLUME_CHUNK_BYTES,
+    n_workers: int | None = None,
+) -> np.ndarray:
+    """(volume - mean) / rms deviation, the statistics take one extra chunked pass (see volume_stats)."""
+    volume = _as_volume(volume)
+    stats = volume_stats(volume, chunk_bytes, n_workers)
+    mean = stats.mean
+    rms_dev = stats.rms_dev or 1.0
+    return map_volume_chunks(lambda x: (x - mean) / rms_dev, [volume], out, chunk_bytes, n_workers)
+
+
+def open_volume(filename: str | Path) -> np.ndarray:
+    """Memory mapped (copy-on-write) (nx, ny, nz) data of an mrc file."""
+    return read_mrc(filename, mmap=True).volume_data
+
+
+@contextmanager
+def create_volume_file(
+    filename: str | Path, shape: tuple[int, int, int], A_per_pixel: float = 0, mode: int = 2
+) -> Iterator[np.memmap]:
+    """Create an mrc file and yield its (nx, ny, nz) data block memory mapped for writing.
+
+    The header, with the statistics of the data, is written when the context
+    exits, so results larger than memory can be computed straight into the
+    file, e.g. with add_volumes(filenames, out=...). The file is deleted when
+    the block raises.
+    """
+    if compression_for(filename) is not None:
+        msg = f"Compressed MRC files can not be memory mapped {filename=}"
+        raise RuntimeError(msg)
+    dtype = dtype_for_mode(mode, "=")
+    with Path(filename).open("wb") as f:
+        f.truncate(HEADER_SIZE + int(np.prod(shape)) * dtype.itemsize)
+    data = np.memmap(filename, dtype=dtype, mode="r+", offset=HEADER_SIZE, shape=shape, order="F")
+    try:
+        yield data
+    except BaseException:
+        # never leave a file without its header behind
+        del data
+        Path(filename).unlink(missing_ok=True)
+        raise
+    data.flush()
+    header = MRC()
+    header.A_per_pixel = A_per_pixel
+    header.header_from_stats(shape, mode, volume_stats(data))
+    with Path(filename).open("r+b") as f:
+        header.export_header(f)
+
+
+def density_bounding_box(
+    volume: np.ndarray, threshold: float, inclusive: bool = False, chunk_bytes: int = BOUNDING_BOX_CHUNK_BYTES
+) -> tuple[tuple[int, int], tuple[int, int], tuple[int, int]] | None:
+    """Smallest box holding every voxel with density above threshold (>= when inclusive).
+
+    The thresholded mask is projected on every axis with np.any, a block of z
+    sections at a time, so each voxel is looked at once and memory mapped
+    volumes are never loaded as a whole.
+
+    Returns ((x_min, x_max), (y_min, y_max), (z_min, z_max)), maxima
+    included, or None when no voxel passes the threshold.
+    """
+    nx, ny, nz = volume.shape
+    x_any = np.zeros(nx, dtype=bool)
+    y_any = np.zeros(ny, dtype=bool)
+    z_any = np.zeros(nz, dtype=bool)
+    z_step = max(1, chunk_bytes // max(1, nx * ny))
+    for z in range(0, nz, z_step):
+        block = volume[:, :, z : z + z_step]
+        mask = block >= threshold if inclusive else block > threshold
+        x_any |= mask.any(axis=(1, 2))
+        y_any |= mask.any(axis=(0, 2))
+        z_any[z : z + z_step] = mask.any(axis=(0, 1))
+    if not z_any.any():
+        return None
+    bounds = []
+    for axis_any in (x_any, y_any, z_any):
+        occupied = np.flatnonzero(axis_any)
+        bounds.append((int(occupied[0]), int(occupied[-1])))
+    return bounds[0], bounds[1], bounds[2]
@@ -1,6 +1,50 @@
+import json
+import struct
 from pathlib import Path
 
-from dpf_mrcfile import MRC
+import numpy as np
+import pytest
+from dpf_mrcfile import (
+    MRC,
+    NATIVE_MACHINE_STAMP,
+    MRCSStack,
+    MRCSWriter,
+    converters,
+    dtype_for_mode,
+    fei_extended_header_dtype,
+    mode_for_dtype,
+    read_header,
+    read_mrc,
+)
+from dpf_mrcfile.bin_map import (
+    bin_map,
+    bin_stack,
+    bin_volume,
+    fourier_crop_map,
+    fourier_crop_stack,
+)
+from dpf_mrcfile.catalog import build_catalog, find_mrc_files, read_catalog
+from dpf_mrcfile.commandline_entrypoints import cmdline_main, expand_inputs
+from dpf_mrcfile.compression import compression_for
+from dpf_mrcfile.homogenize_and_combine_volumes import (
+    HISTOGRAM_MATCH_BINS,
+    homogenize_and_combine_volumes,
+    match_histogram,
+)
+from dpf_mrcfile.pad_map import pad_map
+from dpf_mrcfile.running_stats import RunningStats
+from dpf_mrcfile.trim_map_to_density import trim_map_to_density
+from dpf_mrcfile.utils import (
+    add_MRCs,
+    add_volumes,
+    create_volume_file,
+    density_bounding_box,
+    mask_volume,
+    normalize_volume,
+    open_volume,
+    scale_volume,
+    threshold_volume,
+)
 
 
 def test_load_mrc_01(test_data_dir: Path):
@@ -8,3 +52,613 @@ def test_load_mrc_01(test_data_dir: Path):
     m = MRC()
     m.read_mrc(test_mrc)
     assert len(m.volume_data) != 0
+
+
+def test_load_mrc_mmap(test_data_dir: Path):
+    test_mrc = test_data_dir / "EMD-3001.map"
+    m = read_mrc(test_mrc)
+    m_mmap = read_mrc(test_mrc, mmap=True)
+    assert isinstance(m_mmap.volume_data.base, np.memmap)
+    assert m_mmap.volume_data.shape == (m.nx, m.ny, m.nz)
+    np.testing.assert_array_equal(m_mmap.volume_data, m.volume_data)
+
+    # copy-on-write, the file is left untouched
+    m_mmap.volume_data[0, 0, 0] += 1
+    np.testing.assert_array_equal(read_mrc(test_mrc).volume_data, m.volume_data)
+
+
+def _write_raw_mrc(filename: Path, data: np.ndarray, imod: int, endian: str) -> None:
+    header = bytearray(1024)
+    struct.pack_into(f"{endian}4i", header, 0, *data.shape, imod)
+    header[208:212] = b"MAP "
+    with filename.open("wb") as f:
+        f.write(header)
+        f.write(data.tobytes(order="F"))
+
+
+@pytest.mark.parametrize("endian", ["<", ">"])
+@pytest.mark.parametrize("imod", [0, 1, 2, 3, 4, 6, 12])
+def test_load_mrc_modes(test_data_dir: Path, imod: int, endian: str):
+    dtype = dtype_for_mode(imod, endian)
+    data = np.zeros((4, 3, 2), dtype=dtype)
+    if imod == 3:
+        data["real"] = np.arange(24).reshape(4, 3, 2)
+        data["imag"] = -np.arange(24).reshape(4, 3, 2)
+    else:
+        data[...] = np.arange(24).reshape(4, 3, 2)
+    test_mrc = test_data_dir / f"mode_{imod}.mrc"
+    _write_raw_mrc(test_mrc, data, imod, endian)
+
+    for mmap in (False, True):
+        m = read_mrc(test_mrc, mmap=mmap)
+        assert m.imod == imod
+        assert m.endian == endian
+        assert m.volume_data.dtype == dtype
+        np.testing.assert_array_equal(m.volume_data, data)
+
+    # rewritten in native byte order, with a matching machine stamp
+    out_mrc = test_data_dir / f"mode_{imod}_native.mrc"
+    read_mrc(test_mrc).write_mrc_file(out_mrc)
+    assert tuple(Path(out_mrc).read_bytes()[212:216]) == NATIVE_MACHINE_STAMP
+    m_out = read_mrc(out_mrc)
+    assert m_out.machine_stamp == NATIVE_MACHINE_STAMP
+    np.testing.assert_array_equal(m_out.volume_data, data)
+
+
+@pytest.mark.parametrize("dtype", ["i1", "i2", "f4", "c8", "u2", "f2", ">f4"])
+def test_write_mrc_native_dtype(test_data_dir: Path, dtype: str):
+    data = np.arange(60).reshape(5, 4, 3).astype(dtype)
+    m = MRC()
+    m.set_mrc(data)
+    assert m.imod == mode_for_dtype(data.dtype)
+    test_mrc = test_data_dir / "out.mrc"
+    m.write_mrc_file(test_mrc)
+    assert test_mrc.size() == 1024 + data.size * data.dtype.itemsize
+
+    m_in = read_mrc(test_mrc)
+    assert m_in.volume_data.dtype == data.dtype.newbyteorder("<")
+    np.testing.assert_array_equal(m_in.volume_data, data)
+
+
+def test_write_mrc_roundtrip(test_data_dir: Path):
+    m = read_mrc(test_data_dir / "EMD-3001.map")
+    m.write_mrc_file(test_data_dir / "out.mrc")
+    m_in = read_mrc(test_data_dir / "out.mrc")
+    assert (m_in.nx, m_in.ny, m_in.nz) == (m.nx, m.ny, m.nz)
+    np.testing.assert_array_equal(m_in.volume_data, m.volume_data)
+
+    # data without a matching mode is written as 32-bit reals
+    m.volume_data = m.volume_data.astype(np.float64)
+    m.write_mrc_file(test_data_dir / "out.mrc")
+    m_in = read_mrc(test_data_dir / "out.mrc")
+    assert m_in.imod == 2
+    np.testing.assert_array_equal(m_in.volume_data, m.volume_data)
+
+
+def test_write_mrcs(test_data_dir: Path):
+    images = [np.full((6, 5), i, dtype=np.uint16) for i in range(4)]
+    m = MRC()
+    m.set_mrcs(images)
+    m.write_mrcs_file(test_data_dir / "out.mrcs")
+    m_in = MRC()
+    m_in.read_mrcs(test_data_dir / "out.mrcs")
+    assert m_in.imod == 6
+    assert len(m_in.all_images) == 4
+    for image, image_in in zip(images, m_in.all_images, strict=True):
+        np.testing.assert_array_equal(image_in[:, :, 0], image)
+
+
+def test_mrcs_stack(test_data_dir: Path):
+    images = [np.arange(30, dtype=np.float32).reshape(6, 5) + i for i in range(7)]
+    m = MRC()
+    m.set_mrcs(images)
+    m.write_mrcs_file(test_data_dir / "out.mrcs")
+
+    stack = MRCSStack(test_data_dir / "out.mrcs")
+    assert len(stack) == 7
+    assert stack.shape == (7, 6, 5)
+    assert stack.header.nz == 7
+    np.testing.assert_array_equal(stack[3], images[3])
+    assert np.shares_memory(stack[3], stack.images)
+    np.testing.assert_array_equal(stack[-1], images[-1])
+    np.testing.assert_array_equal(stack[1:3], np.stack(images[1:3]))
+    np.testing.assert_array_equal(stack[[5, 0, 5]], np.stack([images[5], images[0], images[5]]))
+    np.testing.assert_array_equal(list(stack), images)
+
+    batches = list(stack.iter_batches(3))
+    assert [len(b) for b in batches] == [3, 3, 1]
+    np.testing.assert_array_equal(np.concatenate(batches), np.stack(images))
+
+    with MRCSStack(test_data_dir / "out.mrcs") as stack:
+        assert stack[0].shape == (6, 5)
+        read_back = MRC()
+        read_back.read_mrcs(test_data_dir / "out.mrcs")
+        np.testing.assert_array_equal(stack[0], read_back.all_images[0][:, :, 0])
+        first = np.array(stack[0])
+    assert len(stack) == 0
+    assert stack.shape == (0, 6, 5)
+    np.testing.assert_array_equal(first, images[0])
+
+
+def test_mrcs_writer(test_data_dir: Path):
+    rng = np.random.default_rng(0)
+    images = rng.normal(size=(9, 6, 5)).astype(np.float32)
+    with MRCSWriter(test_data_dir / "out.mrcs", A_per_pixel=2.0) as writer:
+        writer.append(images[0])
+        writer.extend(images[1:4])
+        writer.extend(list(images[4:]))
+
+    stack = MRCSStack(test_data_dir / "out.mrcs")
+    np.testing.assert_array_equal(stack[:], images)
+    header = stack.header
+    assert (header.nx, header.ny, header.nz) == (6, 5, 9)
+    assert header.xlen == 12.0
+    assert header.amin == pytest.approx(images.min())
+    assert header.amax == pytest.approx(images.max())
+    assert header.amean == pytest.approx(images.mean(dtype=np.float64), abs=1e-6)
+    assert header.rms_dev == pytest.approx(images.std(dtype=np.float64), rel=1e-6)
+
+
+def test_mrcs_writer_error(test_data_dir: Path):
+    out_mrcs = Path(test_data_dir / "out.mrcs")
+    with pytest.raises(ValueError), MRCSWriter(out_mrcs) as writer:
+        writer.extend(np.ones((2, 6, 5), dtype=np.float32))
+        raise ValueError
+    assert out_mrcs.read_bytes()[:1024] == bytes(1024)
+
+
+def test_running_stats_merge():
+    data = np.random.default_rng(1).normal(loc=100, size=1000)
+    stats = RunningStats()
+    for chunk in np.array_split(data, 7):
+        stats.update(chunk)
+    assert stats.n == 1000
+    assert stats.mean == pytest.approx(data.mean())
+    assert stats.rms_dev == pytest.approx(data.std())
+    assert (stats.min, stats.max) == (data.min(), data.max())
+
+
+def test_header_from_data_stats(test_data_dir: Path):
+    m = read_mrc(test_data_dir / "EMD-3001.map", mmap=True)
+    m.header_from_data()
+    data = np.asarray(m.volume_data, dtype=np.float64)
+    assert (m.nx, m.ny, m.nz) == data.shape
+    assert m.amin == pytest.approx(data.min())
+    assert m.amax == pytest.approx(data.max())
+    assert m.amean == pytest.approx(data.mean())
+    assert m.rms_dev == pytest.approx(data.std())
+
+    stats = RunningStats()
+    stats.update_chunked(m.volume_data, chunk_bytes=1)
+    assert stats.rms_dev == pytest.approx(data.std())
+
+    images = [np.full((4, 3), i, dtype=np.int16) for i in range(5)]
+    m_stack = MRC()
+    m_stack.set_mrcs(images)
+    assert (m_stack.nx, m_stack.ny, m_stack.nz) == (4, 3, 5)
+    assert m_stack.imod == 1
+    assert (m_stack.amin, m_stack.amax, m_stack.amean) == (0, 4, 2)
+    assert m_stack.rms_dev == pytest.approx(np.std(np.arange(5)))
+
+
+def test_read_header(test_data_dir: Path):
+    test_mrc = test_data_dir / "EMD-3001.map"
+    header = read_header(test_mrc)
+    m = read_mrc(test_mrc)
+    assert len(header.volume_data) == 0
+    for name in ["nx", "ny", "nz", "imod", "xlen", "amean", "NSYMBT", "mapstring", "machine_stamp", "text_header"]:
+        assert getattr(header, name) == getattr(m, name)
+    assert header.mapstring == "MAP "
+    assert len(header.text_header) == 10
+    assert all(len(x) == 80 for x in header.text_header)
+
+
+def test_catalog(test_data_dir: Path):
+    test_data_dir = Path(test_data_dir)
+    m = MRC()
+    m.A_per_pixel = 1.5
+    m.set_mrc(np.zeros((4, 5, 6), dtype=np.float32))
+    (test_data_dir / "sub").mkdir()
+    m.write_mrc_file(test_data_dir / "sub" / "small.mrc")
+    m.write_mrc_file(test_data_dir / "sub" / "small.mrc.gz")
+    (test_data_dir / "broken.mrc").write_bytes(b"not an mrc")
+
+    filenames = find_mrc_files(test_data_dir)
+    assert [x.name for x in filenames] == ["EMD-3001.map", "broken.mrc", "small.mrc", "small.mrc.gz"]
+    failures = build_catalog(filenames, test_data_dir / "catalog.sqlite", n_workers=2)
+    assert [x[0].name for x in failures] == ["broken.mrc"]
+
+    rows = {Path(x["path"]).name: x for x in read_catalog(test_data_dir / "catalog.sqlite")}
+    assert set(rows) == {"EMD-3001.map", "small.mrc", "small.mrc.gz"}
+    assert (rows["small.mrc"]["nx"], rows["small.mrc"]["ny"], rows["small.mrc"]["nz"]) == (4, 5, 6)
+    assert rows["small.mrc"]["A_per_pixel"] == 1.5
+    assert rows["EMD-3001.map"]["imod"] == 2
+
+
+@pytest.mark.parametrize("suffix", [".gz", ".bz2", ".zst"])
+def test_compressed_mrc(test_data_dir: Path, suffix: str):
+    if suffix == ".zst":
+        pytest.importorskip("zstandard")
+    m = read_mrc(test_data_dir / "EMD-3001.map")
+    compressed = test_data_dir / f"out.mrc{suffix}"
+    m.write_mrc_file(compressed, compresslevel=1)
+    assert compression_for(compressed) is not None
+
+    m_in = read_mrc(compressed)
+    np.testing.assert_array_equal(m_in.volume_data, m.volume_data)
+    assert read_header(compressed).nx == m.nx
+    with pytest.raises(RuntimeError):
+        read_mrc(compressed, mmap=True)
+
+    images = [np.full((3, 2), i, dtype=np.int8) for i in range(4)]
+    stack = MRC()
+    stack.set_mrcs(images)
+    stack.write_mrcs_file(test_data_dir / f"out.mrcs{suffix}")
+    stack_in = MRC()
+    stack_in.read_mrcs(test_data_dir / f"out.mrcs{suffix}")
+    np.testing.assert_array_equal(np.dstack(stack_in.all_images), np.dstack(images))
+
+
+def test_extended_header_offset(test_data_dir: Path):
+    test_mrc = test_data_dir / "EMD-3001.map"
+    m = read_mrc(test_mrc)
+    assert m.NSYMBT == 160
+    expected = np.fromfile(test_mrc, dtype="<f4", offset=1024 + 160).reshape((m.nx, m.ny, m.nz), order="F")
+    np.testing.assert_array_equal(m.volume_data, expected)
+    np.testing.assert_array_equal(read_mrc(test_mrc, mmap=True).volume_data, expected)
+    assert m.extended_header.tobytes().startswith(b"X,  Y,  Z")
+
+    m.write_mrc_file(test_data_dir / "out.mrc")
+    m_in = read_mrc(test_data_dir / "out.mrc")
+    assert m_in.extended_header.tobytes() == m.extended_header.tobytes()
+    np.testing.assert_array_equal(m_in.volume_data, expected)
+
+
+def test_fei_extended_header(test_data_dir: Path):
+    n_frames = 3
+    record_dtype = fei_extended_header_dtype(768)
+    records = np.zeros(n_frames, dtype=record_dtype)
+    records["metadata_size"] = 768
+    records["dose"] = [1.5, 2.5, 3.5]
+    records["camera_name"] = b"Falcon"
+    data = np.arange(4 * 3 * n_frames, dtype=np.float32).reshape(4, 3, n_frames)
+
+    header = bytearray(1024)
+    struct.pack_into("<4i", header, 0, 4, 3, n_frames, 2)
+    struct.pack_into("<i", header, 92, records.nbytes)
+    header[104:108] = b"FEI1"
+    header[208:212] = b"MAP "
+    test_mrc = test_data_dir / "movie.mrcs"
+    with test_mrc.open("wb") as f:
+        f.write(header)
+        f.write(records.tobytes())
+        f.write(data.tobytes(order="F"))
+
+    header_only = read_header(test_mrc)
+    assert header_only.exttyp == "FEI1"
+    assert len(header_only.extended_header) == n_frames
+    np.testing.assert_array_equal(header_only.extended_header["dose"], [1.5, 2.5, 3.5])
+    assert header_only.extended_header["camera_name"][0] == b"Falcon"
+
+    stack = MRCSStack(test_mrc)
+    np.testing.assert_array_equal(stack[1], data[:, :, 1])
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_rewrite_same_file(test_data_dir: Path, mmap: bool):
+    filename = Path(test_data_dir) / "EMD-3001.map"
+    original = read_mrc(filename)
+    m = read_mrc(filename, mmap=mmap)
+    m.write_mrc_file(filename)
+    assert filename.stat().st_size == 1024 + original.NSYMBT + original.volume_data.nbytes
+    rewritten = read_mrc(filename)
+    assert np.array_equal(rewritten.volume_data, original.volume_data)
+    assert np.array_equal(rewritten.extended_header_bytes(), original.extended_header_bytes())
+    assert [x.name for x in filename.parent.iterdir() if x.name.startswith(".tmp-")] == []
+
+
+def test_density_bounding_box(test_data_dir: Path):
+    m = read_mrc(test_data_dir / "EMD-3001.map", mmap=True)
+    threshold = float(np.percentile(m.volume_data, 90))
+    xs, ys, zs = np.where(m.volume_data >= threshold)
+    expected = ((xs.min(), xs.max()), (ys.min(), ys.max()), (zs.min(), zs.max()))
+    assert density_bounding_box(m.volume_data, threshold, inclusive=True) == expected
+    assert density_bounding_box(m.volume_data, threshold, inclusive=True, chunk_bytes=1) == expected
+    assert density_bounding_box(m.volume_data, float(m.volume_data.max())) is None
+
+
+def test_pad_and_trim_map():
+    volume = np.zeros((10, 12, 14), dtype=np.float32)
+    volume[3:5, 4:9, 0:2] = 1
+    m = MRC()
+    m.A_per_pixel = 1.0
+    m.set_mrc(volume)
+    padded = pad_map(m, 4)
+    # x: 3 voxels in front, 5 behind, y: 4 and 3, z: 0 and 12
+    assert padded.volume_data.shape == (10 + 1, 12 + 1, 14 + 4)
+    assert padded.volume_data.sum() == volume.sum()
+
+    m = MRC()
+    m.A_per_pixel = 1.0
+    m.set_mrc(volume.copy())
+    trimmed = trim_map_to_density(m, 0.5, 0)
+    assert trimmed.volume_data.shape == (1, 4, 1)
+
+
+def test_match_histogram():
+    rng = np.random.default_rng(0)
+    base = rng.normal(size=(30, 30, 30)).astype(np.float32)
+    to_change = np.asfortranarray(rng.random((20, 25, 30), dtype=np.float32))
+
+    matched = match_histogram(base, base[::-1])
+    assert np.array_equal(matched, base[::-1])
+
+    matched = match_histogram(base, to_change)
+    assert matched.shape == to_change.shape
+    assert matched.dtype == base.dtype
+    # ordering of to_change is kept, intensities come from base
+    assert np.array_equal(np.argsort(matched, axis=None), np.argsort(to_change, axis=None))
+    assert np.allclose(np.quantile(matched, [0.1, 0.5, 0.9]), np.quantile(base, [0.1, 0.5, 0.9]), atol=1e-3)
+
+    binned = match_histogram(base, to_change, n_bins=1024)
+    assert np.median(np.abs(binned - matched)) < 0.01
+
+
+def test_homogenize_and_combine_volumes(tmp_path: Path):
+    rng = np.random.default_rng(0)
+    volumes = [np.asfortranarray(rng.random((6, 7, 8), dtype=np.float32)) for _ in range(4)]
+    filenames = []
+    for i, volume in enumerate(volumes):
+        m = MRC()
+        m.set_mrc(volume)
+        filenames.append(tmp_path / f"half_{i}.mrc")
+        m.write_mrc_file(filenames[-1])
+
+    combined = homogenize_and_combine_volumes(str(x) for x in filenames)
+    assert combined.volume_data.shape == (6, 7, 8)
+    base = np.sort(volumes[0] / volumes[0].max(), axis=None)
+    # every map is matched to the normalized first one, so the ranks of each map pick the sum
+    expected = volumes[0] / volumes[0].max()
+    for volume in volumes[1:]:
+        matched = np.empty(volume.size, dtype=np.float32)
+        matched[np.argsort(volume, axis=None)] = base
+        expected = expected + matched.reshape(volume.shape)
+    assert np.allclose(combined.volume_data, expected, atol=1e-5)
+
+    binned = homogenize_and_combine_volumes(iter(filenames), n_bins=HISTOGRAM_MATCH_BINS)
+    assert np.allclose(binned.volume_data, expected, atol=0.05)
+
+    with pytest.raises(RuntimeError):
+        homogenize_and_combine_volumes([])
+
+
+def test_chunked_volume_math(tmp_path: Path):
+    rng = np.random.default_rng(0)
+    volumes = [np.asfortranarray(rng.normal(size=(5, 6, 7)).astype(np.float32)) for _ in range(5)]
+    filenames = []
+    for i, volume in enumerate(volumes):
+        m = MRC()
+        m.A_per_pixel = 1.5
+        m.set_mrc(volume)
+        filenames.append(tmp_path / f"map_{i}.mrc")
+        m.write_mrc_file(filenames[-1])
+
+    # chunks of one z section, so every block goes through the thread pool
+    total = sum(volumes)
+    with create_volume_file(tmp_path / "sum.mrc", (5, 6, 7), A_per_pixel=1.5) as out:
+        add_volumes(filenames, out=out, chunk_bytes=1)
+    summed = read_mrc(tmp_path / "sum.mrc")
+    assert np.allclose(summed.volume_data, total, atol=1e-5)
+    assert np.isclose(summed.amean, total.mean(), atol=1e-5)
+    assert np.isclose(summed.A_per_pixel, 1.5)
+
+    maps = [read_mrc(x) for x in filenames]
+    summed = add_MRCs(maps)
+    assert np.allclose(summed.volume_data, total, atol=1e-5)
+    assert np.isclose(summed.amax, total.max(), atol=1e-5)
+    assert np.isclose(summed.rms_dev, total.std(), atol=1e-5)
+    assert summed.text_header is not maps[0].text_header
+    assert np.isclose(maps[0].amax, volumes[0].max(), atol=1e-5)
+
+    with pytest.raises(ValueError), create_volume_file(tmp_path / "failed.mrc", (5, 6, 7)):
+        raise ValueError
+    assert not (tmp_path / "failed.mrc").exists()
+    volume = open_volume(filenames[0])
+    assert np.allclose(scale_volume(volume, 2.5, chunk_bytes=1), volumes[0] * 2.5)
+    assert np.array_equal(threshold_volume(volume, 0.5, chunk_bytes=1), np.where(volumes[0] < 0.5, 0, volumes[0]))
+    mask = volumes[1] > 0
+    assert np.allclose(mask_volume(volume, mask, chunk_bytes=1), volumes[0] * mask)
+    normalized = normalize_volume(filenames[0], chunk_bytes=1)
+    assert np.allclose(normalized, (volumes[0] - volumes[0].mean()) / volumes[0].std(), atol=1e-5)
+
+    with pytest.raises(RuntimeError):
+        add_volumes([volumes[0], volumes[1][:, :, :3]])
+
+
+def test_situs_round_trip(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    rng = np.random.default_rng(0)
+    m = MRC()
+    m.A_per_pixel = 1.2
+    m.set_mrc(np.asfortranarray(rng.normal(size=(3, 4, 5)).astype(np.float32)))
+    m.set_origin(np.array([1.0, 2.0, 3.0]))
+
+    situs = converters.mrc_to_situs(m)
+    lines = situs.split("\n")
+    assert lines[0] == "1.200000 1.000000 2.000000 3.000000 3 4 5"
+    assert len(lines[2].split()) == 10
+    assert lines[2] == " ".join(f"{x:11.6f}" for x in m.volume_data.ravel("F")[:10]) + " "
+
+    # blocks smaller than a line, so values are carried between blocks
+    monkeypatch.setattr(converters, "SITUS_CHUNK_VALUES", 7)
+    assert converters.mrc_to_situs(m) == situs
+    with (tmp_path / "map.situs").open("w") as f:
+        converters.write_situs(m, f)
+    with (tmp_path / "map.situs").open() as f:
+        situs_mrc = converters.read_situs(f)
+    assert np.allclose(situs_mrc.volume_data, m.volume_data, atol=1e-6)
+    assert np.allclose(situs_mrc.get_origin(), [1, 2, 3])
+    assert situs_mrc.A_per_pixel == pytest.approx(1.2)
+
+    with pytest.raises(RuntimeError):
+        converters.situs_to_mrc(situs.rsplit("\n", 2)[0])
+
+
+@pytest.mark.parametrize("store", ["hdf5", "zarr"])
+def test_array_store_round_trip(test_data_dir: Path, tmp_path: Path, store: str):
+    pytest.importorskip("h5py" if store == "hdf5" else "zarr")
+    write = converters.write_hdf5 if store == "hdf5" else converters.write_zarr
+    read = converters.read_hdf5 if store == "hdf5" else converters.read_zarr
+
+    volume = read_mrc(test_data_dir / "EMD-3001.map")
+    write(volume, tmp_path / "volume", chunks=(4, 16, 16))
+    volume_copy = read(tmp_path / "volume")
+    assert np.array_equal(volume_copy.volume_data, volume.volume_data)
+    for name in ("nx", "ny", "nz", "imod", "originx", "originy", "originz", "amean", "A_per_pixel"):
+        assert getattr(volume_copy, name) == pytest.approx(getattr(volume, name))
+
+    rng = np.random.default_rng(0)
+    images = rng.normal(size=(5, 6, 7)).astype(np.float32)
+    with MRCSWriter(tmp_path / "stack.mrcs", A_per_pixel=1.5) as writer:
+        writer.extend(images)
+    stack = MRCSStack(tmp_path / "stack.mrcs")
+    write(stack, tmp_path / "stack")
+    stack_copy = read(tmp_path / "stack")
+    assert len(stack_copy.all_images) == 5
+    assert np.array_equal(np.stack([x[:, :, 0] for x in stack_copy.all_images]), images)
+    assert stack_copy.A_per_pixel == pytest.approx(1.5)
+
+    # images as set_mrcs leaves them
+    m = MRC()
+    m.set_mrcs(list(images))
+    write(m, tmp_path / "images")
+    assert np.array_equal(np.stack([x[:, :, 0] for x in read(tmp_path / "images").all_images]), images)
+
+
+def test_bin_map():
+    rng = np.random.default_rng(0)
+    volume = np.asfortranarray(rng.random((9, 8, 6), dtype=np.float32))
+    # chunks of one binned z section
+    binned = bin_volume(volume, 2, chunk_bytes=1)
+    assert binned.shape == (4, 4, 3)
+    assert np.isclose(binned[1, 2, 0], volume[2:4, 4:6, 0:2].mean())
+
+    m = MRC()
+    m.A_per_pixel = 1.5
+    m.set_mrc(volume)
+    m.set_origin(np.array([10.0, 20.0, 30.0]))
+    bin_map(m, 2)
+    assert np.allclose(m.volume_data, binned)
+    assert (m.nx, m.ny, m.nz) == (4, 4, 3)
+    assert m.A_per_pixel == pytest.approx(3)
+    assert (m.xlen, m.ylen, m.zlen) == pytest.approx((12, 12, 9))
+    assert m.get_origin() == pytest.approx([10.75, 20.75, 30.75])
+
+    with pytest.raises(RuntimeError):
+        bin_volume(volume, 1.5)
+
+
+def test_fourier_crop_map():
+    # a wave below the nyquist frequency of the cropped box is resampled exactly
+    x, _, z = np.meshgrid(np.arange(16), np.arange(16), np.arange(12), indexing="ij")
+    volume = 2 + np.cos(2 * np.pi * x / 16) + np.sin(2 * np.pi * 2 * z / 12)
+    m = MRC()
+    m.A_per_pixel = 1.0
+    m.set_mrc(np.asfortranarray(volume.astype(np.float32)))
+    m.set_origin(np.array([1.0, 2.0, 3.0]))
+    fourier_crop_map(m, (8, 8, 6))
+    x, _, z = np.meshgrid(np.arange(8), np.arange(8), np.arange(6), indexing="ij")
+    assert np.allclose(m.volume_data, 2 + np.cos(2 * np.pi * x / 8) + np.sin(2 * np.pi * 2 * z / 6), atol=1e-5)
+    assert m.A_per_pixel == pytest.approx(2)
+    assert (m.xlen, m.ylen, m.zlen) == pytest.approx((16, 16, 12))
+    assert m.get_origin() == pytest.approx([1, 2, 3])
+
+    with pytest.raises(RuntimeError):
+        fourier_crop_map(m, 10)
+
+
+def test_bin_and_fourier_crop_stack(tmp_path: Path):
+    rng = np.random.default_rng(0)
+    images = rng.random((5, 8, 8), dtype=np.float32)
+    with MRCSWriter(tmp_path / "stack.mrcs", A_per_pixel=1.5) as writer:
+        writer.extend(images)
+
+    bin_stack(tmp_path / "stack.mrcs", tmp_path / "binned.mrcs", 2, batch_size=2)
+    binned = MRCSStack(tmp_path / "binned.mrcs")
+    assert binned.shape == (5, 4, 4)
+    assert np.allclose(binned[3], images[3].reshape(4, 2, 4, 2).mean(axis=(1, 3)))
+    assert binned.header.A_per_pixel == pytest.approx(3)
+
+    fourier_crop_stack(tmp_path / "stack.mrcs", tmp_path / "cropped.mrcs", 4, batch_size=2)
+    cropped = MRCSStack(tmp_path / "cropped.mrcs")
+    assert cropped.shape == (5, 4, 4)
+    assert np.allclose(cropped[:].mean(axis=(1, 2)), images.mean(axis=(1, 2)), atol=1e-5)
+    assert cropped.header.A_per_pixel == pytest.approx(3)
+
+    m = MRC()
+    m.read_mrcs(tmp_path / "stack.mrcs")
+    bin_map(m, 2)
+    assert np.allclose(np.stack(m.all_images), binned[:])
+
+
+def test_cmdline(tmp_path: Path):
+    rng = np.random.default_rng(0)
+    for i in range(3):
+        volume = np.zeros((12, 12, 12), dtype=np.float32)
+        volume[4:8, 3:9, 5:7] = rng.random((4, 6, 2), dtype=np.float32) + 1
+        m = MRC()
+        m.A_per_pixel = 1.0
+        m.set_mrc(volume)
+        m.write_mrc_file(tmp_path / f"map_{i}.mrc")
+    (tmp_path / "list.txt").write_text(f"{tmp_path / 'map_2.mrc'}\n")
+    assert expand_inputs([str(tmp_path / "map_[01].mrc")], str(tmp_path / "list.txt")) == [
+        tmp_path / f"map_{i}.mrc" for i in range(3)
+    ]
+
+    reports = cmdline_main(
+        [
+            "pad",
+            str(tmp_path / "map_*.mrc"),
+            "--padding",
+            "6",
+            "-j",
+            "2",
+            "--report",
+            str(tmp_path / "pad.jsonl"),
+            "--trace-memory",
+        ]
+    )
+    assert [x["status"] for x in reports] == ["ok"] * 3
+    assert read_mrc(tmp_path / "map_1_pad.mrc").volume_data.shape == (16, 18, 14)
+    lines = (tmp_path / "pad.jsonl").read_text().splitlines()
+    assert len(lines) == 3
+    for line in lines:
+        report = json.loads(line)
+        assert report["seconds"] >= 0
+        assert report["peak_alloc_mb"] > 0
+        assert report["process_max_rss_mb"] > 0
+
+    cmdline_main(["trim", str(tmp_path / "map_0.mrc"), "--lower-limit", "1"])
+    assert read_mrc(tmp_path / "map_0_trim.mrc").volume_data.shape == (3, 5, 1)
+
+    cmdline_main(["bin", str(tmp_path / "map_0.mrc"), "--factor", "2", "--output-dir", str(tmp_path / "binned")])
+    assert read_mrc(tmp_path / "binned" / "map_0_bin.mrc").A_per_pixel == pytest.approx(2)
+
+    cmdline_main(["convert", str(tmp_path / "map_0.mrc"), "--to", "situs", "--suffix", ""])
+    with (tmp_path / "map_0.situs").open() as f:
+        assert np.allclose(converters.read_situs(f).volume_data, read_mrc(tmp_path / "map_0.mrc").volume_data)
+
+    reports = cmdline_main(["combine", str(tmp_path / "map_?.mrc"), "-o", str(tmp_path / "combined.mrc")])
+    assert reports[0]["status"] == "ok"
+    assert len(reports[0]["inputs"]) == 3
+    assert read_mrc(tmp_path / "combined.mrc").volume_data.shape == (12, 12, 12)
+
+    reports = cmdline_main(["pad", str(tmp_path / "missing.mrc"), "--padding", "1"])
+    assert reports[0]["status"] == "error"
+
+    # outputs that would overwrite their inputs are refused before anything is written
+    size = (tmp_path / "map_0.mrc").stat().st_size
+    with pytest.raises(RuntimeError, match="overwrite"):
+        cmdline_main(["convert", str(tmp_path / "map_0.mrc"), "--to", "mrc", "--suffix", ""])
+    with pytest.raises(RuntimeError, match="overwrite"):
+        cmdline_main(["combine", str(tmp_path / "map_?.mrc"), "-o", str(tmp_path / "map_1.mrc")])
+    assert (tmp_path / "map_0.mrc").stat().st_size == size
@@ -1 +1,2 @@
 from .aligning import Aligner as Aligner
+from .caching import AlignmentCache as AlignmentCache
@@ -1,5 +1,7 @@
 # from .dpf_ssw_aligner_rspy import PyCigar as PyCigar, PyAlign as PyAlign, py_ssw_align as py_ssw_align
 
+from collections.abc import Sequence
+
 class PyCigar:
     def get_seq(self) -> list[int]: ...
     def get_length(self) -> int: ...
@@ -15,9 +17,22 @@ class PyAlign:
     def get_cigar(self) -> PyCigar: ...
     def get_flag(self) -> int: ...
 
+class PyEditAlign:
+    def get_distance(self) -> int: ...
+    def get_ref_begin1(self) -> int: ...
+    def get_ref_end1(self) -> int: ...
+    def get_read_begin1(self) -> int: ...
+    def get_read_end1(self) -> int: ...
+    def get_cigar(self) -> PyCigar: ...
+
 class PyProfile:
     def __init__(
-        self, read: list[int], read_len: int, mat: list[int], n: int, score_size: int
+        self,
+        read: list[int],
+        read_len: int,
+        mat: Sequence[int],
+        n: int,
+        score_size: int,
     ) -> None: ...
 
 def py_ssw_align(
@@ -31,3 +46,20 @@ def py_ssw_align(
     filterd: int,
     mask_len: int,
 ) -> PyAlign | None: ...
+
+def py_ssw_align_multi(
+    prof: PyProfile,
+    ref_seq: list[int],
+    ref_len: int,
+    weight_gap_o: int,
+    weight_gap_e: int,
+    flag: int,
+    filters: int,
+    filterd: int,
+    mask_len: int,
+    max_hits: int,
+) -> list[PyAlign]: ...
+
+def py_myers_align(
+    read: list[int], ref_seq: list[int], n: int, max_distance: int
+) -> PyEditAlign | None: ...
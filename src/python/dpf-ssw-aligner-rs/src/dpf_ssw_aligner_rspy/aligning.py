@@ -1,16 +1,24 @@
 from __future__ import annotations
 
-from collections.abc import Iterator, Sequence
+import asyncio
+from collections.abc import AsyncIterator, Iterable, Iterator, Sequence
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass, field
 from pathlib import Path
 
 from ._rs_bind import (
+    PyAlign,
     PyProfile,
+    py_myers_align,
     py_ssw_align,
+    py_ssw_align_multi,
 )
-from .builtin_matrices import build_default_matrices
-from .file_io import read_fasta_and_fastq_files, read_matrix
+from .caching import AlignmentCache, alignment_cache_key, parameters_digest
+from .file_io import read_fasta_and_fastq_files
+from .masking import apply_mask, low_complexity_mask
+from .scoring_matrices import builtin_matrix, dna_matrix, matrix_from_file
 from .tracing import TraceResult
+from .trimming import trim_record
 
 
 @dataclass
@@ -24,6 +32,7 @@ class AlignResult:
     target_end2: int
     cigar_seq: list[int]
     is_rc: bool
+    edit_distance: int = -1
 
 
 @dataclass
@@ -50,10 +59,24 @@ class SSWSeq:
         elements: list[str],
         element_to_int: dict[str, int],
         reverse_complement_map: dict[str, str],
-        mat: list[int],
+        mat: Sequence[int],
+        mask_low_complexity: bool = False,
+        build_profiles: bool = True,
     ) -> SSWSeq:
+        """
+        build_profiles=False skips the striped profiles, for targets and for the
+        edit_distance engine which only use the int sequences
+        """
         int_seq = seq_to_int_representation(seq, elements, element_to_int)
-        profile = PyProfile(int_seq, len(int_seq), mat, len(elements), 2)
+        mask = None
+        if mask_low_complexity:
+            mask = low_complexity_mask(int_seq, is_protein)
+            int_seq = apply_mask(
+                int_seq, mask, masked_element_int(is_protein, elements, element_to_int)
+            )
+        profile = None
+        if build_profiles:
+            profile = PyProfile(int_seq, len(int_seq), mat, len(elements), 2)
 
         if is_protein:
             rc_seq = ""
@@ -64,14 +87,22 @@ class SSWSeq:
             rc_seq = "".join([reverse_complement_map[x] for x in seq[::-1]])
             rc_quality = quality[::-1]
             rc_int_seq = seq_to_int_representation(rc_seq, elements, element_to_int)
-            rc_profile = PyProfile(rc_int_seq, len(int_seq), mat, len(elements), 2)
+            if mask is not None:
+                rc_int_seq = apply_mask(
+                    rc_int_seq,
+                    mask[::-1],
+                    masked_element_int(is_protein, elements, element_to_int),
+                )
+            rc_profile = None
+            if build_profiles:
+                rc_profile = PyProfile(rc_int_seq, len(int_seq), mat, len(elements), 2)
 
         ret = cls(
             id_=id_,
             seq=seq,
             int_seq=int_seq,
             quality=quality,
-            profile=profile,
+            profile=profile,  # type: ignore[arg-type]
             is_protein=is_protein,
             rc_seq=rc_seq,
             rc_int_seq=rc_int_seq,
@@ -112,6 +143,18 @@ def seq_to_int_representation(
     return num
 
 
+def masked_element_int(
+    is_protein: bool, elements: list[str], element_to_int: dict[str, int]
+) -> int:
+    """
+    the element low-complexity residues are replaced with: the unknown element
+    used by seq_to_int_representation (N), or X for protein matrices that carry it
+    """
+    if is_protein and "X" in element_to_int:
+        return element_to_int["X"]
+    return element_to_int[elements[-1]]
+
+
 def align_one(
     query: SSWSeq,
     target: SSWSeq,
@@ -150,8 +193,11 @@ def align_one(
         )
     if res is None:
         raise RuntimeError("Problem in running ssw_align - bindings returned None")
+    return align_result_from_bindings(res, rc)
+
 
-    ret = AlignResult(
+def align_result_from_bindings(res: PyAlign, rc: bool) -> AlignResult:
+    return AlignResult(
         score1=res.get_score1(),
         score2=res.get_score2(),
         query_start=res.get_read_begin1(),
@@ -162,7 +208,71 @@ def align_one(
         cigar_seq=res.get_cigar().get_seq(),
         is_rc=rc,
     )
-    return ret
+
+
+def align_edit_distance_one(
+    query: SSWSeq,
+    target: SSWSeq,
+    n_elements: int,
+    max_distance: int,
+    rc: bool,
+) -> AlignResult | None:
+    """
+    bit-parallel (Myers) semi-global edit distance alignment of the whole query within target
+    for rc, the reverse complement of the query is searched in the target
+    returns None if the distance is larger than max_distance (no limit when negative)
+    """
+    res = py_myers_align(
+        query.rc_int_seq if rc else query.int_seq,
+        target.int_seq,
+        n_elements,
+        max_distance,
+    )
+    if res is None:
+        return None
+    return AlignResult(
+        score1=0,
+        score2=0,
+        query_start=res.get_read_begin1(),
+        query_end=res.get_read_end1(),
+        target_start=res.get_ref_begin1(),
+        target_end=res.get_ref_end1(),
+        target_end2=-1,
+        cigar_seq=res.get_cigar().get_seq(),
+        is_rc=rc,
+        edit_distance=res.get_distance(),
+    )
+
+
+def align_multi_one(
+    query: SSWSeq,
+    target: SSWSeq,
+    gap_open_penalty: int,
+    gap_extension_penalty: int,
+    flag: int,
+    mask_len: int,
+    max_hits: int,
+    min_score: int,
+    rc: bool,
+) -> list[AlignResult]:
+    """
+    up to max_hits non-overlapping local alignments of query within target, best first
+    the target is only scanned once, see ssw_align_multi
+    for rc, the reverse complement of the query is searched in the target
+    """
+    res = py_ssw_align_multi(
+        query.rc_profile if rc else query.profile,
+        target.int_seq,
+        len(target.int_seq),
+        gap_open_penalty,
+        gap_extension_penalty,
+        flag,
+        min_score,
+        0,
+        mask_len,
+        max_hits,
+    )
+    return [align_result_from_bindings(x, rc) for x in res]
 
 
 @dataclass
@@ -176,14 +286,25 @@ class Aligner:
     gap_extension_penalty: int
     try_rc_and_use_best: bool
     flag: int
-    mat: list[int]
+    # int8 scores, filled in from the (cached) matrix in __post_init__
+    mat: Sequence[int]
     reverse_complement_map: dict[str, str] = field(default_factory=dict)
     elements: list[str] = field(default_factory=list)
     element_to_int: dict[str, int] = field(default_factory=dict)
     int_to_element: dict[int, str] = field(default_factory=dict)
+    mask_low_complexity: bool = False
+    trim_error_limit: float | None = None
+    trim_min_length: int = 0
+    # "ssw" (striped Smith-Waterman) or "edit_distance" (bit-parallel semi-global, genome only)
+    engine: str = "ssw"
+    # edit_distance engine: pairs above this distance yield no result, no limit when negative
+    max_edit_distance: int = -1
+    # optional memo of _align_and_build_traceback results, see caching.AlignmentCache
+    cache: AlignmentCache | None = None
+    # digest of the matrix part of the cache keys, set in __post_init__
+    _matrix_key: str = field(init=False, repr=False, default="")
 
     def _set_dna_params(self):
-        self.elements = ["A", "C", "G", "T", "N"]
         self.reverse_complement_map = {
             "A": "T",
             "C": "G",
@@ -195,42 +316,29 @@ class Aligner:
             "t": "A",
         }
         if not self.matrix_file:
-            for i, ele in enumerate(self.elements):
-                self.element_to_int[ele] = i
-                self.element_to_int[ele.lower()] = i
-                self.int_to_element[i] = ele
-            self.mat = [0] * (len(self.elements) ** 2)
-            for i in range(len(self.elements) - 1):
-                for j in range(len(self.elements) - 1):
-                    if self.elements[i] == self.elements[j]:
-                        self.mat[i * len(self.elements) + j] = self.match_score
-                    else:
-                        self.mat[i * len(self.elements) + j] -= self.mismatch_score
+            matrix = dna_matrix(self.match_score, self.mismatch_score)
         else:
-            (
-                self.elements,
-                self.element_to_int,
-                self.int_to_element,
-                self.mat,
-            ) = read_matrix(Path(self.matrix_file))
+            matrix = matrix_from_file(Path(self.matrix_file))
+        (
+            self.elements,
+            self.element_to_int,
+            self.int_to_element,
+            self.mat,
+        ) = matrix.unpack()
 
     def _set_aa_params(self):
         # load AA score matrix
         if not self.matrix_file:
-            (
-                self.elements,
-                self.element_to_int,
-                self.int_to_element,
-                self.mat,
-            ) = build_default_matrices(self.matrix)
+            matrix = builtin_matrix(self.matrix)
         else:
             # assume the format of the input score matrix is the same as that of http://www.ncbi.nlm.nih.gov/Class/FieldGuide/BLOSUM62.txt
-            (
-                self.elements,
-                self.element_to_int,
-                self.int_to_element,
-                self.mat,
-            ) = read_matrix(Path(self.matrix_file))
+            matrix = matrix_from_file(Path(self.matrix_file))
+        (
+            self.elements,
+            self.element_to_int,
+            self.int_to_element,
+            self.mat,
+        ) = matrix.unpack()
 
     def _set_params_from_matrices(self):
         self.reverse_complement_map = {}
@@ -241,15 +349,92 @@ class Aligner:
 
     def __post_init__(self):
         self._set_params_from_matrices()
+        self._matrix_key = parameters_digest(
+            (self.is_protein, self.elements, list(self.mat))
+        )
         assert self.match_score >= 0
         assert self.mismatch_score >= 0
         if self.try_rc_and_use_best and self.is_protein:
             raise RuntimeError(
                 "Reverse complement alignment is not available for protein sequences."
             )
+        if self.engine not in ("ssw", "edit_distance"):
+            msg = f"Unrecognized alignment engine {self.engine}"
+            raise RuntimeError(msg)
+        if self.engine == "edit_distance" and self.is_protein:
+            msg = "The edit_distance engine is only available for genome sequences."
+            raise RuntimeError(msg)
+
+    def _edit_distance_align_and_build_traceback(
+        self, target: SSWSeq, query: SSWSeq
+    ) -> TraceResult | None:
+        best_res = align_edit_distance_one(
+            query, target, len(self.elements), self.max_edit_distance, False
+        )
+        if self.try_rc_and_use_best:
+            rc_res = align_edit_distance_one(
+                query, target, len(self.elements), self.max_edit_distance, True
+            )
+            if rc_res is not None and (
+                best_res is None or rc_res.edit_distance < best_res.edit_distance
+            ):
+                best_res = rc_res
+        if best_res is None:
+            return None
+
+        return TraceResult.from_align_result(
+            query.rc_seq if best_res.is_rc else query.seq,
+            target.seq,
+            best_res.query_start,
+            best_res.target_start,
+            best_res.cigar_seq,
+            best_res.edit_distance,
+        )
+
+    def _cache_key(self, target: SSWSeq, query: SSWSeq, mask_len: int) -> str:
+        return alignment_cache_key(
+            query.seq,
+            query.int_seq,
+            target.seq,
+            target.int_seq,
+            (
+                self._matrix_key,
+                self.gap_open_penalty,
+                self.gap_extension_penalty,
+                self.flag,
+                self.try_rc_and_use_best,
+                mask_len,
+                self.engine,
+                self.max_edit_distance,
+            ),
+        )
 
     def _align_and_build_traceback(
         self, target: SSWSeq, query: SSWSeq, mask_len: int
+    ) -> TraceResult | None:
+        """
+        the alignment of query to target, None when the edit_distance engine finds no
+        alignment within max_edit_distance
+        results are looked up in / stored to self.cache when one is set
+        """
+        key = None
+        if self.cache is not None:
+            key = self._cache_key(target, query, mask_len)
+            found, trace_result = self.cache.get(key)
+            if found:
+                return trace_result
+
+        if self.engine == "edit_distance":
+            trace_result = self._edit_distance_align_and_build_traceback(target, query)
+        else:
+            trace_result = self._ssw_align_and_build_traceback(target, query, mask_len)
+
+        if self.cache is not None and key is not None:
+            self.cache.put(key, trace_result)
+        return trace_result
+
+    def _ssw_align_and_build_traceback(
+        self, target: SSWSeq, query: SSWSeq, mask_len: int
     ) -> TraceResult:
         res = align_one(
             query,
@@ -286,9 +471,125 @@ class Aligner:
         )
         return trace_result
 
+    def _align_multiple_and_build_tracebacks(
+        self, target: SSWSeq, query: SSWSeq, mask_len: int, max_hits: int, min_score: int
+    ) -> list[tuple[AlignResult, TraceResult]]:
+        results = align_multi_one(
+            query,
+            target,
+            self.gap_open_penalty,
+            self.gap_extension_penalty,
+            self.flag,
+            mask_len,
+            max_hits,
+            min_score,
+            False,
+        )
+        if self.try_rc_and_use_best:
+            rc_results = align_multi_one(
+                query,
+                target,
+                self.gap_open_penalty,
+                self.gap_extension_penalty,
+                self.flag,
+                mask_len,
+                max_hits,
+                min_score,
+                True,
+            )
+            if rc_results and (not results or rc_results[0].score1 > results[0].score1):
+                results = rc_results
+
+        return [
+            (
+                res,
+                TraceResult.from_align_result(
+                    query.rc_seq if res.is_rc else query.seq,
+                    target.seq,
+                    res.query_start,
+                    res.target_start,
+                    res.cigar_seq,
+                ),
+            )
+            for res in results
+        ]
+
+    def _build_target_seqs(
+        self, target_records: Iterable[tuple[str, str, str]]
+    ) -> list[SSWSeq]:
+        """
+        build (and low-complexity mask) every target once so it can be reused across queries
+        """
+        return [
+            SSWSeq.build_seq(
+                self.is_protein,
+                id_=_target_id,
+                seq=_target_seq,
+                quality=_target_quality,
+                elements=self.elements,
+                element_to_int=self.element_to_int,
+                reverse_complement_map=self.reverse_complement_map,
+                mat=self.mat,
+                mask_low_complexity=self.mask_low_complexity,
+                build_profiles=False,
+            )
+            for _target_id, _target_seq, _target_quality in target_records
+        ]
+
+    def run_multiple_hits_from_sequences(
+        self,
+        query_seqs: Sequence[tuple[str, str]],
+        target_seqs: Sequence[tuple[str, str]],
+        max_hits: int,
+        min_score: int = 0,
+        mask_len: int | None = None,
+    ) -> Iterator[list[tuple[AlignResult, TraceResult]]]:
+        """
+        for every query/target pair, up to max_hits non-overlapping local alignments, best first
+        mask_len is the number of target positions after a hit that can not end another hit,
+        it defaults to half of the query length
+        """
+        target_sswseqs = self._build_target_seqs(
+            (_target_id, _target_seq, "") for _target_id, _target_seq in target_seqs
+        )
+        for _query_id, _query_seq in query_seqs:
+            query_sswseq = SSWSeq.build_seq(
+                self.is_protein,
+                id_=_query_id,
+                seq=_query_seq,
+                quality="",
+                elements=self.elements,
+                element_to_int=self.element_to_int,
+                reverse_complement_map=self.reverse_complement_map,
+                mat=self.mat,
+                mask_low_complexity=self.mask_low_complexity,
+                build_profiles=self.engine == "ssw",
+            )
+            query_mask_len = len(query_sswseq.seq) // 2 if mask_len is None else mask_len
+            for target_sswseq in target_sswseqs:
+                yield self._align_multiple_and_build_tracebacks(
+                    target_sswseq, query_sswseq, query_mask_len, max_hits, min_score
+                )
+
     def run_from_sequences(
         self, query_seqs: Sequence[tuple[str, str]], target_seqs: Sequence[tuple[str, str]]
     ) -> Iterator[TraceResult]:
+        for _query_id, _target_id, trace_result in self._align_pairs(
+            query_seqs, target_seqs
+        ):
+            if trace_result is not None:
+                yield trace_result
+
+    def _align_pairs(
+        self, query_seqs: Sequence[tuple[str, str]], target_seqs: Sequence[tuple[str, str]]
+    ) -> Iterator[tuple[str, str, TraceResult | None]]:
+        """
+        (query_id, target_id, result) of every query and target pair, the result is
+        None when the edit_distance engine finds no alignment within max_edit_distance
+        """
+        target_sswseqs = self._build_target_seqs(
+            (_target_id, _target_seq, "") for _target_id, _target_seq in target_seqs
+        )
         for _query_id, _query_seq in query_seqs:
             query_sswseq = SSWSeq.build_seq(
                 self.is_protein,
@@ -299,29 +600,47 @@ class Aligner:
                 element_to_int=self.element_to_int,
                 reverse_complement_map=self.reverse_complement_map,
                 mat=self.mat,
+                mask_low_complexity=self.mask_low_complexity,
+                build_profiles=self.engine == "ssw",
             )
             mask_len = len(query_sswseq.seq) // 2
-            for _target_id, _target_seq in target_seqs:
-                target_sswseq = SSWSeq.build_seq(
-                    self.is_protein,
-                    id_=_target_id,
-                    seq=_target_seq,
-                    quality="",
-                    elements=self.elements,
-                    element_to_int=self.element_to_int,
-                    reverse_complement_map=self.reverse_complement_map,
-                    mat=self.mat,
-                )
-                yield self._align_and_build_traceback(
+            for target_sswseq in target_sswseqs:
+                yield _query_id, target_sswseq.id_, self._align_and_build_traceback(
                     target_sswseq, query_sswseq, mask_len
                 )
 
     def run_from_files(
         self, query_file: str, target_file: str
     ) -> Iterator[TraceResult]:
-        for _query_id, _query_seq, _query_quality in read_fasta_and_fastq_files(
-            Path(query_file)
+        for _query_index, trace_results in self.run_queries_from_files(
+            query_file, target_file
         ):
+            yield from trace_results
+
+    def run_queries_from_files(
+        self, query_file: str, target_file: str, start_query: int = 0
+    ) -> Iterator[tuple[int, list[TraceResult]]]:
+        """
+        like run_from_files, but yields (query_index, results) once every query is done
+        query_index counts the records of query_file (including queries dropped by
+        quality trimming) so that a run can be resumed with start_query=query_index + 1
+        the targets are read once, on the first query that is aligned
+        """
+        target_sswseqs: list[SSWSeq] | None = None
+        for query_index, raw_query_record in enumerate(
+            read_fasta_and_fastq_files(Path(query_file))
+        ):
+            if query_index < start_query:
+                continue
+            query_record: tuple[str, str, str] | None = raw_query_record
+            if self.trim_error_limit is not None:
+                query_record = trim_record(
+                    raw_query_record, self.trim_error_limit, self.trim_min_length
+                )
+            if query_record is None:
+                yield query_index, []
+                continue
+            _query_id, _query_seq, _query_quality = query_record
             query_sswseq = SSWSeq.build_seq(
                 self.is_protein,
                 id_=_query_id,
@@ -331,21 +650,89 @@ class Aligner:
                 element_to_int=self.element_to_int,
                 reverse_complement_map=self.reverse_complement_map,
                 mat=self.mat,
+                mask_low_complexity=self.mask_low_complexity,
+                build_profiles=self.engine == "ssw",
             )
             mask_len = len(query_sswseq.seq) // 2
-            for _target_id, _target_seq, _target_quality in read_fasta_and_fastq_files(
-                Path(target_file)
-            ):
-                target_sswseq = SSWSeq.build_seq(
-                    self.is_protein,
-                    id_=_target_id,
-                    seq=_target_seq,
-                    quality=_target_quality,
-                    elements=self.elements,
-                    element_to_int=self.element_to_int,
-                    reverse_complement_map=self.reverse_complement_map,
-                    mat=self.mat,
+            if target_sswseqs is None:
+                target_sswseqs = self._build_target_seqs(
+                    read_fasta_and_fastq_files(Path(target_file))
                 )
-                yield self._align_and_build_traceback(
+            trace_results = []
+            for target_sswseq in target_sswseqs:
+                trace_result = self._align_and_build_traceback(
                     target_sswseq, query_sswseq, mask_len
                 )
+                if trace_result is not None:
+                    trace_results.append(trace_result)
+            yield query_index, trace_results
+
+    def _align_batch(
+        self,
+        query_seqs: Sequence[tuple[str, str]],
+        target_seqs: Sequence[tuple[str, str]],
+    ) -> list[tuple[str, str, TraceResult | None]]:
+        return list(self._align_pairs(query_seqs, target_seqs))
+
+    async def align_async(
+        self,
+        query_seqs: Sequence[tuple[str, str]],
+        target_seqs: Sequence[tuple[str, str]],
+        batch_size: int = 16,
+        max_in_flight: int = 4,
+        executor: Executor | None = None,
+    ) -> AsyncIterator[tuple[str, str, TraceResult | None]]:
+        """
+        asyncio version of run_from_sequences that does not block the event loop
+        queries are aligned in batches of batch_size on executor (a thread pool of
+        max_in_flight workers by default, the bindings release the gil), and the results
+        of each batch are yielded as soon as it completes, so batches can finish out of
+        query order
+        yields (query_id, target_id, result) for every pair, the result is None when the
+        edit_distance engine finds no alignment within max_edit_distance
+        at most max_in_flight batches are queued at a time, new batches are only
+        submitted while the consumer keeps pulling results
+        executor must run in this process (e.g. a ThreadPoolExecutor): the batches run
+        on this Aligner, whose cache holds an sqlite connection and a lock that can not
+        be sent to a ProcessPoolExecutor
+        """
+        if batch_size < 1 or max_in_flight < 1:
+            msg = "batch_size and max_in_flight must be at least 1"
+            raise RuntimeError(msg)
+        if isinstance(executor, ProcessPoolExecutor):
+            msg = "align_async can not run batches on a ProcessPoolExecutor"
+            raise TypeError(msg)
+        loop = asyncio.get_running_loop()
+        own_executor = executor is None
+        pool = ThreadPoolExecutor(max_in_flight) if executor is None else executor
+        batches = (
+            query_seqs[i : i + batch_size]
+            for i in range(0, len(query_seqs), batch_size)
+        )
+        in_flight: set[
+            asyncio.Future[list[tuple[str, str, TraceResult | None]]]
+        ] = set()
+        try:
+            for batch in batches:
+                if len(in_flight) >= max_in_flight:
+                    done, in_flight = await asyncio.wait(
+                        in_flight, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        for pair_result in future.result():
+                            yield pair_result
+                in_flight.add(
+                    loop.run_in_executor(pool, self._align_batch, batch, target_seqs)
+                )
+            while in_flight:
+                done, in_flight = await asyncio.wait(
+                    in_flight, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done:
+                    for pair_result in future.result():
+                        yield pair_result
+        finally:
+            for future in in_flight:
+                future.cancel()
+            if own_executor:
+                pool.shutdown(wait=False, cancel_futures=True)
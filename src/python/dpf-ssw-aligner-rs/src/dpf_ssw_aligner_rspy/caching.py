@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any
+
+from .tracing import TraceResult
+
+
+def parameters_digest(parameters: Sequence[Any]) -> str:
+    """
+    short digest of json serializable parameters, so large ones (a scoring matrix)
+    are serialized once instead of for every alignment_cache_key
+    """
+    return hashlib.blake2b(
+        json.dumps(list(parameters)).encode(), digest_size=20
+    ).hexdigest()
+
+
+def alignment_cache_key(
+    query_seq: str,
+    query_int_seq: Sequence[int],
+    target_seq: str,
+    target_int_seq: Sequence[int],
+    parameters: Sequence[Any],
+) -> str:
+    """
+    digest identifying one alignment
+    the encoded sequences are hashed as well as the text, so masking and matrix
+    element order are part of the key; parameters must be json serializable
+    """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(json.dumps(list(parameters)).encode())
+    for seq, int_seq in ((query_seq, query_int_seq), (target_seq, target_int_seq)):
+        h.update(f"|{len(seq)}|".encode())
+        h.update(seq.encode())
+        h.update(bytes(int_seq))
+    return h.hexdigest()
+
+
+class AlignmentCache:
+    """
+    LRU cache of alignment results, optionally backed by an sqlite file so
+    results are shared between runs
+    None results (no alignment found) are cached as well
+    the cached TraceResults are shared by every lookup, TraceResult is frozen for that
+    safe to share between the worker threads of Aligner.align_async
+    """
+
+    def __init__(self, max_entries: int = 100_000, path: str | Path | None = None):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, TraceResult | None] = OrderedDict()
+        self._db: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        if path is not None:
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS alignments (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            self._db.commit()
+
+    def _remember(self, key: str, value: TraceResult | None) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> tuple[bool, TraceResult | None]:
+        """
+        @return  (found, result)
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return True, self._entries[key]
+            if self._db is None:
+                return False, None
+            row = self._db.execute(
+                "SELECT value FROM alignments WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return False, None
+            fields = json.loads(row[0])
+            value = None if fields is None else TraceResult(**fields)
+            self._remember(key, value)
+            return True, value
+
+    def put(self, key: str, value: TraceResult | None) -> None:
+        with self._lock:
+            self._remember(key, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO alignments (key, value) VALUES (?, ?)",
+                    (key, json.dumps(None if value is None else asdict(value))),
+                )
+                self._db.commit()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
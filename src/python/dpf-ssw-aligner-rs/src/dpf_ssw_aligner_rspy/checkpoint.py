@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+
+@dataclass
+class Checkpoint:
+    """
+    progress of an ssw-align run
+    queries_done is the number of query records that are completely aligned and
+    output_offset the size of the output file once their results were written
+    """
+
+    query_file: str
+    target_file: str
+    output_file: str
+    queries_done: int = 0
+    output_offset: int = 0
+
+    def save(self, path: str | Path) -> None:
+        """
+        write the checkpoint atomically, a crash leaves either the old or the new one
+        """
+        tmp_path = Path(f"{path}.tmp")
+        with tmp_path.open("w") as f:
+            json.dump(asdict(self), f)
+            f.flush()
+            os.fsync(f.fileno())
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: str | Path) -> Checkpoint:
+        with Path(path).open() as f:
+            return cls(**json.load(f))
+
+    def check_matches(
+        self, query_file: str, target_file: str, output_file: str
+    ) -> None:
+        if (self.query_file, self.target_file, self.output_file) != (
+            query_file,
+            target_file,
+            output_file,
+        ):
+            msg = (
+                f"Checkpoint was written for {self.query_file=} {self.target_file=} "
+                f"{self.output_file=}, can not resume with {query_file=} "
+                f"{target_file=} {output_file=}"
+            )
+            raise RuntimeError(msg)
@@ -1,11 +1,17 @@
 from __future__ import annotations
 
 import argparse
+import os
 import sys
 import time
 from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO
 
 from .aligning import Aligner
+from .caching import AlignmentCache
+from .checkpoint import Checkpoint
 from .tracing import TraceResult
 
 
@@ -68,33 +74,183 @@ def parse_args(cmdline_args: list[str]):
         action="store_true",
         help="The best alignment will be picked between the original read alignment and the reverse complement read alignment. [default: False]",
     )
+    parser.add_argument(
+        "--mask-low-complexity",
+        action="store_true",
+        help="Mask low-complexity regions (DUST for genome, SEG for protein sequences) before alignment. [default: False]",
+    )
+    parser.add_argument(
+        "--trim-error-limit",
+        type=float,
+        default=None,
+        help="Quality trim fastq queries with the modified Mott algorithm using this error probability limit (e.g. 0.05). [default: no trimming]",
+    )
+    parser.add_argument(
+        "--trim-min-length",
+        type=int,
+        default=0,
+        help="Fastq queries shorter than this after quality trimming are skipped, fasta queries are not trimmed. [default: 0]",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=("ssw", "edit_distance"),
+        default="ssw",
+        help="ssw: striped Smith-Waterman. edit_distance: bit-parallel semi-global edit distance of the whole query within the target, genome only. [default: ssw]",
+    )
+    parser.add_argument(
+        "--max-edit-distance",
+        type=int,
+        default=-1,
+        help="edit_distance engine only: skip pairs whose edit distance is larger than this. [default: no limit]",
+    )
+    parser.add_argument(
+        "--cache-file",
+        default="",
+        help="sqlite file in which alignment results are cached between runs. [default: no cache]",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=100_000,
+        help="number of alignment results kept in memory when --cache-file is used. [default: 100000]",
+    )
+    parser.add_argument(
+        "--output",
+        default="",
+        help="file the alignments are streamed to. [default: stdout]",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default="",
+        help="file in which the progress of the run is recorded, requires --output. [default: no checkpoint]",
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=100,
+        help="record progress in --checkpoint every N queries. [default: 100]",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the run recorded in --checkpoint after its last completed query, the output written after that point is discarded. [default: False]",
+    )
     parser.add_argument("-t", "--target", help="target file", required=True)
     parser.add_argument("-q", "--query", help="query file", required=True)
     return parser.parse_args(cmdline_args)
 
 
+def format_trace_result(r: TraceResult) -> str:
+    return f"{r.target_aln}\n{r.visual_aln}\n{r.query_aln}\n{r.cigar_aln}\n"
+
+
+def save_checkpoint(checkpoint: Checkpoint, path: str, output: BinaryIO) -> None:
+    """
+    make the output durable before recording it as done
+    """
+    output.flush()
+    os.fsync(output.fileno())
+    checkpoint.output_offset = output.tell()
+    checkpoint.save(path)
+
+
+@contextmanager
+def open_output(
+    args: argparse.Namespace,
+) -> Iterator[tuple[BinaryIO | None, Checkpoint]]:
+    """
+    open --output, truncated to the end of the last checkpoint when resuming
+    a fresh run resets --checkpoint, so that a checkpoint of an earlier run is never
+    resumed against the new output
+    """
+    checkpoint = Checkpoint(args.query, args.target, args.output)
+    if not args.output:
+        yield None, checkpoint
+        return
+    if not args.resume:
+        with Path(args.output).open("wb") as output:
+            if args.checkpoint:
+                checkpoint.save(args.checkpoint)
+            yield output, checkpoint
+        return
+    if not Path(args.checkpoint).exists():
+        msg = f"{args.checkpoint} does not exist, can not resume"
+        raise RuntimeError(msg)
+    checkpoint = Checkpoint.load(args.checkpoint)
+    checkpoint.check_matches(args.query, args.target, args.output)
+    output_size = Path(args.output).stat().st_size if Path(args.output).exists() else 0
+    if output_size < checkpoint.output_offset:
+        msg = (
+            f"{args.output} has {output_size} bytes, less than the "
+            f"{checkpoint.output_offset} recorded in {args.checkpoint}, can not resume"
+        )
+        raise RuntimeError(msg)
+    with Path(args.output).open("r+b") as output:
+        output.truncate(checkpoint.output_offset)
+        output.seek(checkpoint.output_offset)
+        yield output, checkpoint
+
+
 def cmdline_main(cmdline_args: list[str]) -> Iterator[TraceResult]:
     args = parse_args(cmdline_args)
-    aligner = Aligner(
-        is_protein=args.protein,
-        matrix=args.matrix,
-        matrix_file=args.matrix_file,
-        match_score=args.match_score,
-        mismatch_score=args.mismatch_score,
-        gap_open_penalty=args.gap_open_penalty,
-        gap_extension_penalty=args.gap_extension_penalty,
-        try_rc_and_use_best=args.try_rc_and_use_best,
-        flag=2,
-        mat=[],
-    )
-    t1 = time.time()
-    for r in aligner.run_from_files(args.query, args.target):
-        print(r.target_aln)
-        print(r.visual_aln)
-        print(r.query_aln)
-        print(r.cigar_aln)
-        yield r
-    t2 = time.time()
+    if (args.checkpoint or args.resume) and not args.output:
+        msg = "--checkpoint and --resume require --output"
+        raise RuntimeError(msg)
+    if args.resume and not args.checkpoint:
+        msg = "--resume requires --checkpoint"
+        raise RuntimeError(msg)
+    if args.checkpoint_every < 1:
+        msg = "--checkpoint-every must be at least 1"
+        raise RuntimeError(msg)
+    cache = None
+    if args.cache_file:
+        cache = AlignmentCache(max_entries=args.cache_size, path=args.cache_file)
+    try:
+        aligner = Aligner(
+            is_protein=args.protein,
+            matrix=args.matrix,
+            matrix_file=args.matrix_file,
+            match_score=args.match_score,
+            mismatch_score=args.mismatch_score,
+            gap_open_penalty=args.gap_open_penalty,
+            gap_extension_penalty=args.gap_extension_penalty,
+            try_rc_and_use_best=args.try_rc_and_use_best,
+            flag=2,
+            mat=[],
+            mask_low_complexity=args.mask_low_complexity,
+            trim_error_limit=args.trim_error_limit,
+            trim_min_length=args.trim_min_length,
+            engine=args.engine,
+            max_edit_distance=args.max_edit_distance,
+            cache=cache,
+        )
+        with open_output(args) as (output, checkpoint):
+            t1 = time.time()
+            for query_index, trace_results in aligner.run_queries_from_files(
+                args.query, args.target, start_query=checkpoint.queries_done
+            ):
+                for r in trace_results:
+                    if output is None:
+                        print(r.target_aln)
+                        print(r.visual_aln)
+                        print(r.query_aln)
+                        print(r.cigar_aln)
+                    else:
+                        output.write(format_trace_result(r).encode())
+                    yield r
+                checkpoint.queries_done = query_index + 1
+                if (
+                    output is not None
+                    and args.checkpoint
+                    and checkpoint.queries_done % args.checkpoint_every == 0
+                ):
+                    save_checkpoint(checkpoint, args.checkpoint, output)
+            t2 = time.time()
+            if output is not None and args.checkpoint:
+                save_checkpoint(checkpoint, args.checkpoint, output)
+    finally:
+        if cache is not None:
+            cache.close()
     print(f"CPU time: {t2-t1} seconds")
 
 
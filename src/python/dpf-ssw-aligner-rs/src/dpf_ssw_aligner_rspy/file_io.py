@@ -25,7 +25,7 @@ def read_matrix(filename: Path) -> tuple[list[str], dict[str, int], dict[int, st
                     for j, ele in enumerate(lEle):
                         dEle2Int[ele] = j
                         dEle2Int[ele.lower()] = j
-                        dInt2Ele[i] = ele
+                        dInt2Ele[j] = ele
                 else:
                     lScore.extend([int(y) for y in x.strip().split()[1:]])
 
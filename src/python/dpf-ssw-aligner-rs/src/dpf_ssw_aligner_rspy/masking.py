@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import math
+from collections import defaultdict
+
+DUST_WINDOW = 64
+DUST_THRESHOLD = 20.0
+
+SEG_WINDOW = 12
+SEG_LOCUT = 2.2
+SEG_HICUT = 2.5
+
+
+def _find_perfect_intervals(
+    triplets: list[tuple[int, int, int]],
+    window_start: int,
+    end: int,
+    threshold: float,
+    best_at_start: dict[int, tuple[int, int]],
+) -> int | None:
+    """
+    find the perfect intervals of the window that end at triplet `end`
+
+    `best_at_start` maps the first triplet of the perfect intervals found so far
+    in the window to the (pair_sum, n_triplets) of the best scoring one. Suffixes
+    of the window are grown one triplet at a time, keeping the best score of the
+    perfect intervals inside the suffix; a suffix scoring above `threshold` is
+    perfect when it scores at least as high as that.
+    @return  first triplet of the longest new perfect interval, None when none is found
+    """
+    counts: dict[tuple[int, int, int], int] = {}
+    pair_sum = 0
+    best_sum, best_n = 0, 0
+    first_start = None
+    n = 0
+    for start in range(end, window_start - 1, -1):
+        triplet = triplets[start]
+        count = counts.get(triplet, 0)
+        pair_sum += count
+        counts[triplet] = count + 1
+        n += 1
+        inner = best_at_start.get(start)
+        if inner is not None and (
+            best_n == 0 or inner[0] * (best_n - 1) > best_sum * (inner[1] - 1)
+        ):
+            best_sum, best_n = inner
+        if pair_sum <= threshold * (n - 1):
+            continue
+        if best_n == 0 or pair_sum * (best_n - 1) >= best_sum * (n - 1):
+            best_sum, best_n = pair_sum, n
+            best_at_start[start] = (pair_sum, n)
+            first_start = start
+    return first_start
+
+
+def dust_mask(
+    int_seq: list[int],
+    window: int = DUST_WINDOW,
+    threshold: float = DUST_THRESHOLD,
+) -> list[bool]:
+    """
+    DUST low-complexity detection for nucleotide sequences (symmetric DUST).
+
+    An interval is scored by its triplet composition,
+    sum(c_t * (c_t - 1) / 2) / (l - 1) where l is the number of triplets in it.
+    An interval of at most `window` residues is perfect when it scores above
+    `threshold` and no interval inside it scores higher; only the residues of
+    perfect intervals are masked, so the flanks of a low-complexity run stay
+    unmasked.
+    Perfect intervals are only searched for in windows holding a triplet more
+    than 2 * threshold times, below that no interval can score above threshold.
+    """
+    n_residues = len(int_seq)
+    mask = [False] * n_residues
+    if n_residues < 3:
+        return mask
+    window = min(window, n_residues)
+    n_triplets = window - 2
+    if n_triplets < 2:
+        return mask
+
+    min_count = math.floor(2 * threshold) + 1
+    triplets = list(zip(int_seq, int_seq[1:], int_seq[2:], strict=False))
+    counts: dict[tuple[int, int, int], int] = defaultdict(int)
+    n_frequent = 0
+    best_at_start: dict[int, tuple[int, int]] = {}
+    masked_until = -1
+    for i, triplet in enumerate(triplets):
+        counts[triplet] += 1
+        if counts[triplet] == min_count:
+            n_frequent += 1
+        if i >= n_triplets:
+            old = triplets[i - n_triplets]
+            if counts[old] == min_count:
+                n_frequent -= 1
+            counts[old] -= 1
+        window_start = max(0, i - n_triplets + 1)
+        # perfect intervals are only compared within a window
+        best_at_start.pop(window_start - 1, None)
+        if not n_frequent:
+            continue
+        first_start = _find_perfect_intervals(
+            triplets, window_start, i, threshold, best_at_start
+        )
+        if first_start is not None:
+            # the new perfect intervals all end at the last residue of triplet i
+            for j in range(max(first_start, masked_until + 1), i + 3):
+                mask[j] = True
+            masked_until = i + 2
+    return mask
+
+
+def _entropy(counts: dict[int, int], window: int) -> float:
+    return -sum(c / window * math.log2(c / window) for c in counts.values() if c)
+
+
+def seg_mask(
+    int_seq: list[int],
+    window: int = SEG_WINDOW,
+    locut: float = SEG_LOCUT,
+    hicut: float = SEG_HICUT,
+) -> list[bool]:
+    """
+    SEG low-complexity detection for protein sequences.
+
+    Windows whose compositional (Shannon) entropy is <= `locut` bits trigger a
+    low-complexity segment. Segments are then extended over neighbouring
+    windows while their entropy stays <= `hicut`, and every residue covered by
+    a segment window is masked.
+    """
+    n_residues = len(int_seq)
+    mask = [False] * n_residues
+    if n_residues < window:
+        return mask
+
+    counts: dict[int, int] = defaultdict(int)
+    for x in int_seq[:window]:
+        counts[x] += 1
+    entropies = [_entropy(counts, window)]
+    for i in range(window, n_residues):
+        counts[int_seq[i - window]] -= 1
+        counts[int_seq[i]] += 1
+        entropies.append(_entropy(counts, window))
+
+    in_segment = [False] * len(entropies)
+    for start, entropy in enumerate(entropies):
+        if entropy > locut or in_segment[start]:
+            continue
+        left = start
+        while left > 0 and entropies[left - 1] <= hicut:
+            left -= 1
+        right = start
+        while right < len(entropies) - 1 and entropies[right + 1] <= hicut:
+            right += 1
+        for k in range(left, right + 1):
+            in_segment[k] = True
+
+    for start, masked in enumerate(in_segment):
+        if masked:
+            for j in range(start, start + window):
+                mask[j] = True
+    return mask
+
+
+def low_complexity_mask(int_seq: list[int], is_protein: bool) -> list[bool]:
+    if is_protein:
+        return seg_mask(int_seq)
+    return dust_mask(int_seq)
+
+
+def apply_mask(int_seq: list[int], mask: list[bool], mask_int: int) -> list[int]:
+    return [mask_int if m else x for x, m in zip(int_seq, mask, strict=True)]
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+from array import array
+from dataclasses import dataclass
+from functools import cache, lru_cache
+from pathlib import Path
+
+from .builtin_matrices import build_default_matrices
+from .file_io import read_matrix
+
+DNA_ELEMENTS = ("A", "C", "G", "T", "N")
+
+
+@dataclass(frozen=True)
+class ScoringMatrix:
+    """
+    a parsed score matrix, shared between aligners through the caches below
+    mat is stored as int8, the type PyProfile expects, so it is never re-parsed
+    """
+
+    elements: tuple[str, ...]
+    element_to_int: dict[str, int]
+    int_to_element: dict[int, str]
+    mat: array
+
+    @classmethod
+    def from_parsed(
+        cls,
+        elements: list[str],
+        element_to_int: dict[str, int],
+        int_to_element: dict[int, str],
+        mat: list[int],
+    ) -> ScoringMatrix:
+        if len(mat) != len(elements) ** 2:
+            msg = f"Score matrix has {len(mat)} scores for {len(elements)} elements"
+            raise RuntimeError(msg)
+        return cls(tuple(elements), element_to_int, int_to_element, array("b", mat))
+
+    def unpack(self) -> tuple[list[str], dict[str, int], dict[int, str], array]:
+        """
+        copies of (elements, element_to_int, int_to_element, mat) an Aligner can own
+        """
+        return (
+            list(self.elements),
+            dict(self.element_to_int),
+            dict(self.int_to_element),
+            array("b", self.mat),
+        )
+
+
+@cache
+def builtin_matrix(matrix_name: str) -> ScoringMatrix:
+    return ScoringMatrix.from_parsed(*build_default_matrices(matrix_name))
+
+
+@lru_cache(maxsize=256)
+def dna_matrix(match_score: int, mismatch_score: int) -> ScoringMatrix:
+    """
+    match_score on the diagonal, -mismatch_score elsewhere and 0 for N
+    """
+    n_elements = len(DNA_ELEMENTS)
+    element_to_int = {}
+    int_to_element = {}
+    for i, ele in enumerate(DNA_ELEMENTS):
+        element_to_int[ele] = i
+        element_to_int[ele.lower()] = i
+        int_to_element[i] = ele
+    mat = [0] * (n_elements**2)
+    for i in range(n_elements - 1):
+        for j in range(n_elements - 1):
+            mat[i * n_elements + j] = match_score if i == j else -mismatch_score
+    return ScoringMatrix.from_parsed(
+        list(DNA_ELEMENTS), element_to_int, int_to_element, mat
+    )
+
+
+@lru_cache(maxsize=64)
+def _matrix_file(path: Path, _mtime_ns: int, _size: int) -> ScoringMatrix:
+    return ScoringMatrix.from_parsed(*read_matrix(path))
+
+
+def matrix_from_file(path: Path) -> ScoringMatrix:
+    """
+    parsed matrix file, only re-read when the file was modified since it was cached
+    """
+    path = path.resolve()
+    stat = path.stat()
+    return _matrix_file(path, stat.st_mtime_ns, stat.st_size)
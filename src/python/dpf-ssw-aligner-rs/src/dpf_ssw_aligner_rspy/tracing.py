@@ -1,16 +1,24 @@
 from dataclasses import dataclass
 
 
-@dataclass
+@dataclass(frozen=True)
 class TraceResult:
     target_aln: str
     query_aln: str
     cigar_aln: str
     visual_aln: str
+    # edit_distance engine only, -1 for the ssw engine
+    edit_distance: int = -1
 
     @classmethod
     def from_align_result(
-        cls, query_seq: str, target_seq: str, query_start: int, target_start: int, cigar_seq: list[int]
+        cls,
+        query_seq: str,
+        target_seq: str,
+        query_start: int,
+        target_start: int,
+        cigar_seq: list[int],
+        edit_distance: int = -1,
     ) -> "TraceResult":
         sCigarInfo = "MIDNSHP=X"
         cigar_aln = ""
@@ -54,4 +62,5 @@ class TraceResult:
             query_aln=query_aln,
             cigar_aln=cigar_aln,
             visual_aln=visual_aln,
+            edit_distance=edit_distance,
         )
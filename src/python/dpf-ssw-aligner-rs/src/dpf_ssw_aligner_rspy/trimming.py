@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+from collections.abc import Iterator
+
+PHRED_OFFSET = 33
+
+# error probability of every phred score we can encounter in a quality string
+_PHRED_ERROR_PROBABILITY = [10 ** (-q / 10) for q in range(256)]
+
+
+def mott_trim(quality: str, error_limit: float, phred_offset: int = PHRED_OFFSET) -> tuple[int, int]:
+    """
+    modified Mott trimming algorithm (as used by phred/CLC for Sanger traces)
+
+    Every base scores `error_limit - P(error)`; the kept region is the
+    maximum-sum run of bases, so low-quality tails on both ends are removed in
+    a single pass.
+    @return  (start, end) of the region to keep, end exclusive, (0, 0) when nothing should be kept
+    """
+    best_sum = 0.0
+    best_start = 0
+    best_end = 0
+    running_sum = 0.0
+    running_start = 0
+    for i, q in enumerate(quality.encode("ascii")):
+        running_sum += error_limit - _PHRED_ERROR_PROBABILITY[max(q - phred_offset, 0)]
+        if running_sum <= 0:
+            running_sum = 0.0
+            running_start = i + 1
+        elif running_sum > best_sum:
+            best_sum = running_sum
+            best_start = running_start
+            best_end = i + 1
+    return best_start, best_end
+
+
+def trim_record(
+    record: tuple[str, str, str], error_limit: float, min_length: int
+) -> tuple[str, str, str] | None:
+    """
+    quality trim one (id, seq, quality) record
+    records without quality (fasta) pass through untouched, whatever their length
+    @return  the trimmed record, None when it is empty or shorter than `min_length`
+    """
+    id_, seq, quality = record
+    if not quality:
+        return record
+    start, end = mott_trim(quality, error_limit)
+    seq = seq[start:end]
+    quality = quality[start:end]
+    if seq and len(seq) >= min_length:
+        return id_, seq, quality
+    return None
+
+
+def trim_records(
+    records: Iterator[tuple[str, str, str]], error_limit: float, min_length: int
+) -> Iterator[tuple[str, str, str]]:
+    """
+    quality trim (id, seq, quality) records, see trim_record
+    fastq records that are empty or too short after trimming are dropped
+    """
+    for record in records:
+        trimmed = trim_record(record, error_limit, min_length)
+        if trimmed is not None:
+            yield trimmed
@@ -58,6 +58,36 @@ impl PyAlign {
     }
 }
 
+#[pyclass]
+#[derive(Clone, Debug)]
+pub struct PyEditAlign {
+    inner: dpf_ssw_aligner::EditAlign,
+}
+
+#[pymethods]
+impl PyEditAlign {
+    pub fn get_distance(&self) -> PyResult<i32> {
+        Ok(self.inner.distance)
+    }
+    pub fn get_ref_begin1(&self) -> PyResult<i32> {
+        Ok(self.inner.ref_begin1)
+    }
+    pub fn get_ref_end1(&self) -> PyResult<i32> {
+        Ok(self.inner.ref_end1)
+    }
+    pub fn get_read_begin1(&self) -> PyResult<i32> {
+        Ok(self.inner.read_begin1)
+    }
+    pub fn get_read_end1(&self) -> PyResult<i32> {
+        Ok(self.inner.read_end1)
+    }
+    pub fn get_cigar(&self) -> PyResult<PyCigar> {
+        Ok(PyCigar {
+            inner: self.inner.cigar.clone(),
+        })
+    }
+}
+
 #[pyclass]
 #[derive(Clone)]
 pub struct PyProfile {
@@ -76,6 +106,7 @@ impl PyProfile {
 
 #[pyfunction]
 pub fn py_ssw_align(
+    py: Python<'_>,
     prof: PyProfile,
     ref_seq: Vec<i8>,
     ref_len: i32,
@@ -87,7 +118,9 @@ pub fn py_ssw_align(
     mask_len: i32,
 ) -> PyResult<Option<PyAlign>> {
     // does this need to be pyresult?
-    let ret = dpf_ssw_aligner::ssw_align(
+    // the gil is released while aligning so python threads can run alongside
+    let ret = py.allow_threads(|| {
+        dpf_ssw_aligner::ssw_align(
             prof.inner,
             ref_seq,
             ref_len,
@@ -97,7 +130,8 @@ pub fn py_ssw_align(
             filters,
             filterd,
             mask_len,
-    );
+        )
+    });
     if ret.is_some() {
         return Ok(Some( PyAlign { inner: ret.unwrap() } ))
     } else {
@@ -105,6 +139,49 @@ pub fn py_ssw_align(
     }
 }
 
+#[pyfunction]
+pub fn py_ssw_align_multi(
+    py: Python<'_>,
+    prof: PyProfile,
+    ref_seq: Vec<i8>,
+    ref_len: i32,
+    weight_gap_o: u8,
+    weight_gap_e: u8,
+    flag: u8,
+    filters: u16,
+    filterd: i32,
+    mask_len: i32,
+    max_hits: usize,
+) -> PyResult<Vec<PyAlign>> {
+    let ret = py.allow_threads(|| {
+        dpf_ssw_aligner::ssw_align_multi(
+            prof.inner,
+            ref_seq,
+            ref_len,
+            weight_gap_o,
+            weight_gap_e,
+            flag,
+            filters,
+            filterd,
+            mask_len,
+            max_hits,
+        )
+    });
+    Ok(ret.into_iter().map(|inner| PyAlign { inner }).collect())
+}
+
+#[pyfunction]
+pub fn py_myers_align(
+    py: Python<'_>,
+    read: Vec<i8>,
+    ref_seq: Vec<i8>,
+    n: i32,
+    max_distance: i32,
+) -> PyResult<Option<PyEditAlign>> {
+    let ret = py.allow_threads(|| dpf_ssw_aligner::myers_align(&read, &ref_seq, n, max_distance));
+    Ok(ret.map(|inner| PyEditAlign { inner }))
+}
+
 /// This module is implemented in Rust.
 #[pymodule]
 #[pyo3(name="_rs_bind")]
@@ -112,6 +189,9 @@ fn dpf_ssw_aligner_rspy(_py: Python, m: &PyModule) -> PyResult<()> {
     m.add_class::<PyCigar>()?;
     m.add_class::<PyAlign>()?;
     m.add_class::<PyProfile>()?;
+    m.add_class::<PyEditAlign>()?;
     m.add_function(wrap_pyfunction!(py_ssw_align, m)?)?;
+    m.add_function(wrap_pyfunction!(py_ssw_align_multi, m)?)?;
+    m.add_function(wrap_pyfunction!(py_myers_align, m)?)?;
     Ok(())
 }
@@ -1,13 +1,27 @@
 #!/usr/bin/env python
 from __future__ import annotations
 
+import asyncio
+import os
 import tempfile
 import unittest
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import FrozenInstanceError
 from pathlib import Path
 from shutil import copytree
 
 from dpf_ssw_aligner_rspy.aligning import Aligner
+from dpf_ssw_aligner_rspy.caching import AlignmentCache, alignment_cache_key
+from dpf_ssw_aligner_rspy.checkpoint import Checkpoint
 from dpf_ssw_aligner_rspy.commandline_entrypoints import cmdline_main
+from dpf_ssw_aligner_rspy.masking import dust_mask, seg_mask
+from dpf_ssw_aligner_rspy.scoring_matrices import (
+    builtin_matrix,
+    dna_matrix,
+    matrix_from_file,
+)
+from dpf_ssw_aligner_rspy.tracing import TraceResult
+from dpf_ssw_aligner_rspy.trimming import mott_trim, trim_records
 
 SSW_TEST_DIR = Path(__file__).parent
 
@@ -74,6 +88,300 @@ class TestPyPulchra(unittest.TestCase):
             == "MVLSPA-DKTNVKAAWGKVGAHAG-EYGAEALERMFLSFPTTKTYFPHFDLSHGSAQVKGHGKKVADALTNAVA-HVDDMPNALSALSDLHAHKLRVDPVNFKLLSHCLLVTLAAHL-PAEFTPAVHASLDKFLASVSTVLTSKYR"
         )
 
+    def test_low_complexity_masking(self):
+        rng_seq = [0, 2, 1, 3, 3, 0, 1, 2, 2, 3, 0, 0, 1, 3, 2, 1] * 2
+        # only the run of A is masked, the second flank starts with one more A
+        dna = rng_seq + [0] * 80 + rng_seq
+        mask = dust_mask(dna)
+        assert mask == [False] * 32 + [True] * 81 + [False] * 31
+        # runs longer than the window are masked end to end
+        dna = rng_seq[:-1] + [3] * 200 + rng_seq[1:]
+        mask = dust_mask(dna)
+        assert mask == [False] * 31 + [True] * 200 + [False] * 31
+
+        protein = list(range(20)) + [5] * 30 + list(range(20))
+        mask = seg_mask(protein)
+        assert not any(mask[:5])
+        assert all(mask[20:50])
+        assert not any(mask[-5:])
+
+    def test_quality_trimming(self):
+        quality = "#####" + "I" * 20 + "##+##"
+        assert mott_trim(quality, 0.05) == (5, 25)
+        assert mott_trim("#" * 10, 0.05) == (0, 0)
+
+        records = [
+            ("r1", "A" * 5 + "C" * 20 + "G" * 5, quality),
+            ("r2", "ACGT" * 3, "#" * 12),
+            ("r3", "ACGT", ""),
+            ("r4", "AC", ""),
+        ]
+        trimmed = list(trim_records(iter(records), 0.05, 4))
+        assert trimmed == [
+            ("r1", "C" * 20, "I" * 20),
+            ("r3", "ACGT", ""),
+            ("r4", "AC", ""),
+        ]
+
+    def test_multiple_hits_via_api(self):
+        query = "GATTACAGGCTTACGATCGATCGGACT"
+        mutated = "GATTACAGGCTTACCATCGATCGGACT"
+        filler = "T" * 100
+        target = filler + query + filler + mutated + filler + query
+        aligner = Aligner(
+            is_protein=False,
+            matrix="BLOSUM50",
+            matrix_file="",
+            match_score=2,
+            mismatch_score=2,
+            gap_open_penalty=3,
+            gap_extension_penalty=1,
+            try_rc_and_use_best=False,
+            flag=2,
+            mat=[],
+        )
+        ret_l = list(
+            aligner.run_multiple_hits_from_sequences(
+                [("q", query)], [("t", target)], max_hits=3, min_score=20
+            )
+        )
+        assert len(ret_l) == 1
+        hits = ret_l[0]
+        assert [h.target_start for h, _ in hits] == [100, 354, 227]
+        assert [h.score1 for h, _ in hits] == [54, 54, 50]
+        assert hits[2][1].visual_aln == "||||||||||||||*||||||||||||"
+
+    def test_multiple_hits_reverse_strand_via_api(self):
+        query = "GATTACAGGCTTACGATCGATCGGACT"
+        rc_query = "AGTCCGATCGATCGTAAGCCTGTAATC"
+        filler = "T" * 100
+        target = filler + rc_query + filler + rc_query + filler
+        aligner = Aligner(
+            is_protein=False,
+            matrix="BLOSUM50",
+            matrix_file="",
+            match_score=2,
+            mismatch_score=2,
+            gap_open_penalty=3,
+            gap_extension_penalty=1,
+            try_rc_and_use_best=True,
+            flag=2,
+            mat=[],
+        )
+        ret_l = list(
+            aligner.run_multiple_hits_from_sequences(
+                [("q", query)], [("t", target)], max_hits=3, min_score=20
+            )
+        )
+        hits = ret_l[0]
+        assert [h.target_start for h, _ in hits] == [100, 227]
+        assert all(h.is_rc and h.score1 == 54 for h, _ in hits)
+        assert hits[0][1].target_aln == rc_query
+        assert hits[0][1].query_aln == rc_query
+
+    def test_edit_distance_engine_via_api(self):
+        aligner = Aligner(
+            is_protein=False,
+            matrix="BLOSUM50",
+            matrix_file="",
+            match_score=2,
+            mismatch_score=2,
+            gap_open_penalty=3,
+            gap_extension_penalty=1,
+            try_rc_and_use_best=False,
+            flag=2,
+            mat=[],
+            engine="edit_distance",
+            max_edit_distance=1,
+        )
+        query = [("barcode", "ACGTTCAG")]
+        targets = [("hit", "TTGACGTCAGCACC"), ("miss", "GGGGGGGGGGGG")]
+        ret_l = list(aligner.run_from_sequences(query, targets))
+        assert len(ret_l) == 1
+        assert ret_l[0].target_aln == "ACG-TCAG"
+        assert ret_l[0].query_aln == "ACGTTCAG"
+        assert ret_l[0].cigar_aln == "3M1I4M"
+        assert ret_l[0].edit_distance == 1
+
+    def test_alignment_cache(self):
+        key_a = alignment_cache_key("ACGT", [0, 1, 2, 3], "ACGA", [0, 1, 2, 0], (2, 1))
+        key_b = alignment_cache_key("ACGT", [0, 1, 2, 3], "ACGA", [0, 1, 2, 0], (3, 1))
+        assert key_a != key_b
+        trace = TraceResult(
+            target_aln="ACG", query_aln="ACG", cigar_aln="3M", visual_aln="|||"
+        )
+
+        cache_file = Path(self.temp_dir.name) / "cache.sqlite"
+        cache = AlignmentCache(max_entries=1, path=cache_file)
+        cache.put(key_a, trace)
+        cache.put(key_b, None)
+        assert len(cache) == 1
+        assert cache.get(key_a) == (True, trace)
+        assert cache.get(key_b) == (True, None)
+        with self.assertRaises(FrozenInstanceError):
+            cache.get(key_a)[1].target_aln = "AAA"  # type: ignore[misc, union-attr]
+        cache.close()
+
+        cache = AlignmentCache(path=cache_file)
+        assert cache.get(key_a) == (True, trace)
+        assert cache.get("missing") == (False, None)
+        cache.close()
+
+        query_seq_file = self.test_data_dir / "r1_query.fq"
+        target_seq_file = self.test_data_dir / "r1.fa"
+        cmdline = [
+            "-t",
+            str(target_seq_file),
+            "-q",
+            str(query_seq_file),
+            "--cache-file",
+            str(cache_file),
+        ]
+        first = list(cmdline_main(cmdline))
+        second = list(cmdline_main(cmdline))
+        assert first == second
+
+    def test_align_async_via_api(self):
+        target = [("target", "GGGGGGACGTTCAGTTTTTTCCCAAAGGGTTTAAA")]
+        queries = [
+            ("q0", "ACGTTCAG"),
+            ("q1", "CCCAAAGGG"),
+            ("q2", "GGGTTTAAA"),
+            ("q3", "TTTTTTCCC"),
+            ("q4", "ACGTTCAGTT"),
+        ]
+        aligner = Aligner(
+            is_protein=False,
+            matrix="",
+            matrix_file="",
+            match_score=2,
+            mismatch_score=2,
+            gap_open_penalty=3,
+            gap_extension_penalty=1,
+            try_rc_and_use_best=False,
+            flag=2,
+            mat=[],
+        )
+        expected = list(aligner.run_from_sequences(queries, target))
+
+        async def collect(**kwargs):
+            return [
+                x
+                async for x in aligner.align_async(
+                    queries, target, batch_size=2, max_in_flight=2, **kwargs
+                )
+            ]
+
+        ret = asyncio.run(collect())
+        assert sorted((query_id, target_id) for query_id, target_id, _ in ret) == [
+            (query_id, "target") for query_id, _ in queries
+        ]
+        ret_by_query = {query_id: x for query_id, _, x in ret}
+        assert [ret_by_query[query_id] for query_id, _ in queries] == expected
+
+        with ProcessPoolExecutor(1) as executor, self.assertRaises(TypeError):
+            asyncio.run(collect(executor=executor))
+
+    def test_checkpoint_and_resume_via_cmdline(self):
+        target_seq_file = self.test_data_dir / "r1.fa"
+        target_seq = "".join(target_seq_file.read_text().split("\n")[1:])
+        query_seq_file = self.test_data_dir / "queries.fa"
+        query_seq_file.write_text(
+            "".join(f">q{i}\n{target_seq[i * 20 : i * 20 + 40]}\n" for i in range(4))
+        )
+        output_file = self.test_data_dir / "out.txt"
+        checkpoint_file = self.test_data_dir / "out.ckpt"
+        cmdline = [
+            "-t",
+            str(target_seq_file),
+            "-q",
+            str(query_seq_file),
+            "--output",
+            str(output_file),
+            "--checkpoint",
+            str(checkpoint_file),
+            "--checkpoint-every",
+            "1",
+        ]
+        full = list(cmdline_main(cmdline))
+        assert len(full) == 4
+        full_output = output_file.read_bytes()
+        assert Checkpoint.load(checkpoint_file).queries_done == 4
+
+        # die while the third query is written: two queries are checkpointed
+        interrupted = cmdline_main(cmdline)
+        for _ in range(3):
+            next(interrupted)
+        interrupted.close()
+        with output_file.open("ab") as f:
+            f.write(b"partial")
+        assert Checkpoint.load(checkpoint_file).queries_done == 2
+
+        resumed = list(cmdline_main([*cmdline, "--resume"]))
+        assert resumed == full[2:]
+        assert output_file.read_bytes() == full_output
+
+        # a fresh run resets the checkpoint before its first query is done
+        fresh = cmdline_main(cmdline)
+        next(fresh)
+        fresh.close()
+        assert Checkpoint.load(checkpoint_file).queries_done == 0
+        assert list(cmdline_main([*cmdline, "--resume"])) == full
+        assert output_file.read_bytes() == full_output
+
+        # an output shorter than the checkpoint records can not be resumed
+        output_file.write_bytes(full_output[:10])
+        with self.assertRaises(RuntimeError):
+            list(cmdline_main([*cmdline, "--resume"]))
+
+        # resuming without a checkpoint leaves the output alone
+        checkpoint_file.unlink()
+        with self.assertRaises(RuntimeError):
+            list(cmdline_main([*cmdline, "--resume"]))
+        assert output_file.read_bytes() == full_output[:10]
+
+    def test_scoring_matrix_cache(self):
+        assert builtin_matrix("BLOSUM62") is builtin_matrix("BLOSUM62")
+        dna = dna_matrix(2, 3)
+        assert dna is dna_matrix(2, 3)
+        assert list(dna.mat[:5]) == [2, -3, -3, -3, 0]
+        assert list(dna.mat[20:]) == [0, 0, 0, 0, 0]
+
+        matrix_file = self.test_data_dir / "dna.mat"
+        matrix_file.write_text(
+            "# test matrix\n"
+            "   A  C  G  T  N\n"
+            "A  1 -1 -1 -1  0\n"
+            "C -1  1 -1 -1  0\n"
+            "G -1 -1  1 -1  0\n"
+            "T -1 -1 -1  1  0\n"
+            "N  0  0  0  0  0\n"
+        )
+        parsed = matrix_from_file(matrix_file)
+        assert parsed is matrix_from_file(matrix_file)
+        assert parsed.int_to_element == {0: "A", 1: "C", 2: "G", 3: "T", 4: "N"}
+        assert list(parsed.mat[:5]) == [1, -1, -1, -1, 0]
+
+        matrix_file.write_text(matrix_file.read_text().replace("A  1", "A  5"))
+        stat = matrix_file.stat()
+        os.utime(matrix_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        assert list(matrix_from_file(matrix_file).mat[:5]) == [5, -1, -1, -1, 0]
+
+        aligner = Aligner(
+            is_protein=False,
+            matrix="",
+            matrix_file=str(matrix_file),
+            match_score=2,
+            mismatch_score=2,
+            gap_open_penalty=3,
+            gap_extension_penalty=1,
+            try_rc_and_use_best=False,
+            flag=2,
+            mat=[],
+        )
+        aligner.mat[0] = 7
+        assert matrix_from_file(matrix_file).mat[0] == 5
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -34,6 +34,16 @@ pub struct Align {
     pub flag: u16,
 }
 
+#[derive(Clone, Debug)]
+pub struct EditAlign {
+    pub distance: i32,
+    pub ref_begin1: i32,
+    pub ref_end1: i32,
+    pub read_begin1: i32,
+    pub read_end1: i32,
+    pub cigar: Cigar,
+}
+
 #[derive(Clone, Debug)]
 pub struct AlignmentEnd {
     score: u16,
@@ -157,6 +167,7 @@ pub fn ssw_align(
             u8::MAX,
             prof.bias,
             mask_len,
+            None,
         );
         if let Some(profile_word) = &prof.profile_word {
             if bests[0].score == 255 {
@@ -170,6 +181,7 @@ pub fn ssw_align(
                     &profile_word,
                     u16::MAX,
                     mask_len,
+                    None,
                 );
                 word = 1;
             } else if bests[0].score == 255 {
@@ -189,6 +201,7 @@ pub fn ssw_align(
             &profile_word,
             u16::MAX,
             mask_len,
+            None,
         );
         word = 1;
     } else {
@@ -230,6 +243,7 @@ pub fn ssw_align(
                 r.score1 as u8,
                 prof.bias,
                 mask_len,
+                None,
             );
         } else {
             eprintln!("Error: ssw_align given prof.profile_byte that was None.");
@@ -253,6 +267,7 @@ pub fn ssw_align(
                 &v_p16,
                 r.score1,
                 mask_len,
+                None,
             );
         } else {
             eprintln!("Error: ssw_align given prof.profile_word that was None.");
@@ -302,6 +317,160 @@ pub fn ssw_align(
     Some(r)
 }
 
+/// Find up to `max_hits` non-overlapping local alignments of the read within ref_seq.
+///
+/// The whole reference is scanned by the striped kernel only once, recording the best score of
+/// every reference column. Hits are then picked from those column scores best first, the same way
+/// ssw_align picks the 2nd best alignment: every aligned candidate masks its reference range, an
+/// accepted hit also masks the following `mask_len` columns (the decaying tail of its scores), and
+/// masked candidates are skipped before anything is aligned. Beginning positions and cigars are only
+/// computed for the unmasked candidates, against a window of at most 2 * read_len reference columns
+/// that ends at the candidate and never reaches back into an accepted hit.
+/// Like score2/ref_end2 this is heuristic: a hit next to a stronger one may be absorbed by it.
+pub fn ssw_align_multi(
+    prof: Profile,
+    ref_seq: Vec<i8>,
+    ref_len: i32,
+    weight_gap_o: u8,
+    weight_gap_e: u8,
+    flag: u8,
+    filters: u16,
+    filterd: i32,
+    mask_len: i32,
+    max_hits: usize,
+) -> Vec<Align> {
+    let read_len = prof.read_len;
+    let mut max_column: Vec<u16> = Vec::new();
+
+    // One pass over the whole reference for the per column best scores.
+    if let Some(profile_byte) = &prof.profile_byte {
+        let bests = sw_sse2_byte(
+            &ref_seq,
+            0,
+            ref_len,
+            read_len,
+            weight_gap_o,
+            weight_gap_e,
+            &profile_byte,
+            u8::MAX,
+            prof.bias,
+            mask_len,
+            Some(&mut max_column),
+        );
+        if bests[0].score == 255 {
+            if let Some(profile_word) = &prof.profile_word {
+                sw_sse2_word(
+                    &ref_seq,
+                    0,
+                    ref_len,
+                    read_len,
+                    weight_gap_o,
+                    weight_gap_e,
+                    &profile_word,
+                    u16::MAX,
+                    mask_len,
+                    Some(&mut max_column),
+                );
+            } else {
+                eprintln!("Please set 2 to the score_size parameter of the function ssw_init, otherwise the alignment results will be incorrect.");
+                return Vec::new();
+            }
+        }
+    } else if let Some(profile_word) = &prof.profile_word {
+        sw_sse2_word(
+            &ref_seq,
+            0,
+            ref_len,
+            read_len,
+            weight_gap_o,
+            weight_gap_e,
+            &profile_word,
+            u16::MAX,
+            mask_len,
+            Some(&mut max_column),
+        );
+    } else {
+        eprintln!("Please call the function ssw_init before ssw_align.");
+        return Vec::new();
+    }
+
+    let mut candidates: Vec<usize> = (0..ref_len as usize)
+        .filter(|&i| max_column[i] > 0 && max_column[i] >= filters)
+        .collect();
+    candidates.sort_by(|&a, &b| max_column[b].cmp(&max_column[a]).then(a.cmp(&b)));
+
+    let mut masked = vec![false; ref_len as usize];
+    let mut hits: Vec<Align> = Vec::new();
+    let mut spans: Vec<(i32, i32)> = Vec::new(); // reference range of every accepted hit
+    for end in candidates {
+        if hits.len() >= max_hits {
+            break;
+        }
+        if masked[end] {
+            continue;
+        }
+
+        let end = end as i32;
+        let mut window_begin = max(0, end - 2 * read_len + 1);
+        for &(_, span_end) in spans.iter() {
+            if span_end < end {
+                window_begin = max(window_begin, span_end + 1);
+            }
+        }
+        // score2/ref_end2 of the window alignment are not used, a mask_len >= 15 only keeps
+        // ssw_align from warning about them for every hit.
+        let hit = ssw_align(
+            prof.clone(),
+            ref_seq[window_begin as usize..=end as usize].to_vec(),
+            end - window_begin + 1,
+            weight_gap_o,
+            weight_gap_e,
+            flag,
+            filters,
+            filterd,
+            max(mask_len, 15),
+        );
+        let mut hit = match hit {
+            Some(hit) if hit.score1 > 0 && hit.ref_end1 >= 0 => hit,
+            _ => {
+                masked[end as usize] = true;
+                continue;
+            }
+        };
+        hit.ref_end1 += window_begin;
+        if hit.ref_begin1 >= 0 {
+            hit.ref_begin1 += window_begin;
+        }
+        hit.score2 = 0;
+        hit.ref_end2 = -1;
+
+        let hit_begin = if hit.ref_begin1 >= 0 {
+            hit.ref_begin1
+        } else {
+            max(window_begin, hit.ref_end1 - mask_len)
+        };
+        // every candidate ending in hit_begin..=end aligns to (part of) this hit, so none of them
+        // is aligned again. Inside the window, a candidate from the decaying tail of an accepted
+        // hit only keeps the few columns after it and scores below filters.
+        if hit.score1 < filters
+            || spans
+                .iter()
+                .any(|&(begin, end)| hit_begin <= end && begin <= hit.ref_end1)
+        {
+            for i in hit_begin..=end {
+                masked[i as usize] = true;
+            }
+            continue;
+        }
+        for i in hit_begin..=min(ref_len - 1, max(end, hit.ref_end1 + mask_len)) {
+            masked[i as usize] = true;
+        }
+        spans.push((hit_begin, hit.ref_end1));
+        hits.push(hit);
+    }
+    hits
+}
+
 impl Align {
     pub fn mark_mismatch(
         &mut self,
@@ -683,6 +852,7 @@ pub fn sw_sse2_byte(
     // is set to 0, it will not be used
     bias: u8, // Shift 0 point to a positive value.
     mask_len: i32,
+    max_column_out: Option<&mut Vec<u16>>, // if given, receives the best score of every reference column
 ) -> [AlignmentEnd; 2] {
     // Some helper macros to be used later
 
@@ -879,6 +1049,9 @@ pub fn sw_sse2_byte(
             bests[1].ref_position = i;
         }
     }
+    if let Some(out) = max_column_out {
+        *out = max_column.iter().map(|x| *x as u16).collect();
+    }
     bests
 }
 
@@ -915,6 +1088,7 @@ pub fn sw_sse2_word(
     v_profile: &[i16x8],
     terminate: u16,
     mask_len: i32,
+    max_column_out: Option<&mut Vec<u16>>, // if given, receives the best score of every reference column
 ) -> [AlignmentEnd; 2] {
     let mut _max: u16 = 0;
     let mut end_ref = 0;
@@ -1089,6 +1263,9 @@ pub fn sw_sse2_word(
             bests[1].ref_position = i;
         }
     }
+    if let Some(out) = max_column_out {
+        *out = max_column;
+    }
     bests
 }
 
@@ -1351,6 +1528,187 @@ pub fn banded_sw(
     Some(result)
 }
 
+const MYERS_WORD_BITS: usize = 64;
+
+/// Pattern match bit vectors for the Myers algorithm.
+/// Bit i of block b of element c is set when read[b * 64 + i] == c.
+fn myers_peq(read: &[i8], n: usize) -> Vec<u64> {
+    let n_blocks = (read.len() + MYERS_WORD_BITS - 1) / MYERS_WORD_BITS;
+    let mut peq = vec![0u64; n * n_blocks];
+    for (i, &c) in read.iter().enumerate() {
+        if c >= 0 && (c as usize) < n {
+            peq[c as usize * n_blocks + i / MYERS_WORD_BITS] |= 1u64 << (i % MYERS_WORD_BITS);
+        }
+    }
+    peq
+}
+
+/// Advance one 64 row block of the edit distance matrix by one reference column
+/// (Myers 1999 with the block carry of Hyyrö 2003).
+/// h_in is the horizontal delta entering the top row of the block, the returned delta is the one
+/// leaving the row selected by out_bit.
+fn myers_advance_block(pv: &mut u64, mv: &mut u64, mut eq: u64, h_in: i32, out_bit: u64) -> i32 {
+    let xv = eq | *mv;
+    if h_in < 0 {
+        eq |= 1;
+    }
+    let xh = ((eq & *pv).wrapping_add(*pv) ^ *pv) | eq;
+    let mut ph = *mv | !(xh | *pv);
+    let mut mh = *pv & xh;
+    let h_out = if ph & out_bit != 0 {
+        1
+    } else if mh & out_bit != 0 {
+        -1
+    } else {
+        0
+    };
+    ph <<= 1;
+    mh <<= 1;
+    if h_in < 0 {
+        mh |= 1;
+    } else if h_in > 0 {
+        ph |= 1;
+    }
+    *pv = mh | !(xv | ph);
+    *mv = ph & xv;
+    h_out
+}
+
+/// Edit distance of the whole read against reference prefixes, for every reference column.
+/// top_row_delta 0 lets the alignment start anywhere in the reference (semi-global),
+/// 1 anchors it at the first reference position.
+fn myers_last_row(read: &[i8], ref_seq: &[i8], n: usize, top_row_delta: i32) -> Vec<i32> {
+    let read_len = read.len();
+    let n_blocks = (read_len + MYERS_WORD_BITS - 1) / MYERS_WORD_BITS;
+    let peq = myers_peq(read, n);
+    let last_bit = 1u64 << ((read_len - 1) % MYERS_WORD_BITS);
+
+    let mut pv = vec![u64::MAX; n_blocks];
+    let mut mv = vec![0u64; n_blocks];
+    let mut score = read_len as i32;
+    let mut scores = Vec::with_capacity(ref_seq.len());
+    for &c in ref_seq {
+        let mut h = top_row_delta;
+        for b in 0..n_blocks {
+            let eq = if c >= 0 && (c as usize) < n {
+                peq[c as usize * n_blocks + b]
+            } else {
+                0
+            };
+            let out_bit = if b == n_blocks - 1 {
+                last_bit
+            } else {
+                1u64 << (MYERS_WORD_BITS - 1)
+            };
+            h = myers_advance_block(&mut pv[b], &mut mv[b], eq, h, out_bit);
+        }
+        score += h;
+        scores.push(score);
+    }
+    scores
+}
+
+/// Unit cost global alignment of read against ref_seq, only used to build the cigar of the short
+/// window located by the bit-parallel pass.
+fn edit_distance_cigar(read: &[i8], ref_seq: &[i8]) -> Cigar {
+    let (m, l) = (read.len(), ref_seq.len());
+    let mut d = vec![0i32; (m + 1) * (l + 1)];
+    for i in 0..=m {
+        d[i * (l + 1)] = i as i32;
+    }
+    for j in 0..=l {
+        d[j] = j as i32;
+    }
+    for i in 1..=m {
+        for j in 1..=l {
+            let diag = d[(i - 1) * (l + 1) + j - 1] + (read[i - 1] != ref_seq[j - 1]) as i32;
+            let up = d[(i - 1) * (l + 1) + j] + 1;
+            let left = d[i * (l + 1) + j - 1] + 1;
+            d[i * (l + 1) + j] = min(diag, min(up, left));
+        }
+    }
+
+    let mut ops: Vec<char> = Vec::with_capacity(m + l);
+    let (mut i, mut j) = (m, l);
+    while i > 0 || j > 0 {
+        let here = d[i * (l + 1) + j];
+        if i > 0
+            && j > 0
+            && here == d[(i - 1) * (l + 1) + j - 1] + (read[i - 1] != ref_seq[j - 1]) as i32
+        {
+            ops.push('M');
+            i -= 1;
+            j -= 1;
+        } else if i > 0 && here == d[(i - 1) * (l + 1) + j] + 1 {
+            ops.push('I');
+            i -= 1;
+        } else {
+            ops.push('D');
+            j -= 1;
+        }
+    }
+
+    let mut seq: Vec<u32> = Vec::new();
+    let mut run = 0;
+    for (k, &op) in ops.iter().rev().enumerate() {
+        run += 1;
+        if k + 1 == ops.len() || ops[ops.len() - k - 2] != op {
+            seq.push(to_cigar_int(run, op));
+            run = 0;
+        }
+    }
+    Cigar {
+        length: seq.len(),
+        seq,
+    }
+}
+
+/// Semi-global edit distance alignment: the whole read against any substring of the reference.
+///
+/// The distances are computed with the bit-parallel algorithm of Myers, 64 read positions per
+/// machine word, so a read of up to 64 elements costs one word operation per reference element.
+/// The reference end is the first position with the smallest distance; its beginning is found by
+/// running the same algorithm backwards from that end, and the cigar by a unit cost alignment of
+/// the read against the located window only.
+/// Returns None when the smallest distance is larger than max_distance (ignored when negative).
+pub fn myers_align(read: &[i8], ref_seq: &[i8], n: i32, max_distance: i32) -> Option<EditAlign> {
+    if read.is_empty() || ref_seq.is_empty() {
+        return None;
+    }
+    let n = n as usize;
+
+    let scores = myers_last_row(read, ref_seq, n, 0);
+    let mut ref_end = 0;
+    for (j, &score) in scores.iter().enumerate() {
+        if score < scores[ref_end] {
+            ref_end = j;
+        }
+    }
+    let distance = scores[ref_end];
+    if max_distance >= 0 && distance > max_distance {
+        return None;
+    }
+
+    let read_reverse: Vec<i8> = read.iter().rev().cloned().collect();
+    let ref_reverse: Vec<i8> = ref_seq[..=ref_end].iter().rev().cloned().collect();
+    let reverse_scores = myers_last_row(&read_reverse, &ref_reverse, n, 1);
+    let window_len = reverse_scores
+        .iter()
+        .position(|&score| score == distance)
+        .unwrap_or(ref_end)
+        + 1;
+    let ref_begin = ref_end + 1 - window_len;
+
+    Some(EditAlign {
+        distance,
+        ref_begin1: ref_begin as i32,
+        ref_end1: ref_end as i32,
+        read_begin1: 0,
+        read_end1: read.len() as i32 - 1,
+        cigar: edit_distance_cigar(read, &ref_seq[ref_begin..=ref_end]),
+    })
+}
+
 #[cfg(test)]
 mod tests {
     use std::simd::SimdPartialOrd;
@@ -1362,6 +1720,79 @@ mod tests {
     // static USAGE_EXAMPLE_CIF_TEXT: &str  = include_str!("../tests/data/usage-example.cif");
     // static USAGE_EXAMPLE_CIF_JSON_TEXT: &[u8] = include_bytes!("../tests/data/usage-example.cif.json");
 
+    #[test]
+    fn ssw_align_multi_01() {
+        let encode = |s: &str| -> Vec<i8> {
+            s.chars()
+                .map(|c| match c {
+                    'A' => 0,
+                    'C' => 1,
+                    'G' => 2,
+                    'T' => 3,
+                    _ => 4,
+                })
+                .collect()
+        };
+        let mut mat = vec![0i8; 25];
+        for i in 0..4 {
+            for j in 0..4 {
+                mat[i * 5 + j] = if i == j { 2 } else { -2 };
+            }
+        }
+        let read = encode("GATTACAGGCTTACGATCGATCGGACT");
+        let filler = "T".repeat(100);
+        let reference = encode(&format!(
+            "{filler}GATTACAGGCTTACGATCGATCGGACT{filler}GATTACAGGCTTACCATCGATCGGACT{filler}GATTACAGGCTTACGATCGATCGGACT"
+        ));
+        let prof = Profile::ssw_init(read.clone(), read.len() as i32, mat, 5, 2);
+        let hits = ssw_align_multi(
+            prof,
+            reference.clone(),
+            reference.len() as i32,
+            3,
+            1,
+            2,
+            20,
+            0,
+            13,
+            5,
+        );
+        let found: Vec<(u16, i32, i32)> = hits
+            .iter()
+            .map(|h| (h.score1, h.ref_begin1, h.ref_end1))
+            .collect();
+        assert_eq!(found, vec![(54, 100, 126), (54, 354, 380), (50, 227, 253)]);
+    }
+
+    #[test]
+    fn myers_align_01() {
+        // A C G T -> 0 1 2 3
+        let read = vec![0, 1, 2, 3, 3, 1, 0, 2];
+        let reference = vec![3, 3, 2, 0, 1, 2, 3, 1, 0, 2, 1, 1];
+        let aln = myers_align(&read, &reference, 5, -1).unwrap();
+        assert_eq!(aln.distance, 1);
+        assert_eq!((aln.ref_begin1, aln.ref_end1), (3, 9));
+        assert_eq!(
+            aln.cigar.seq,
+            vec![
+                to_cigar_int(3, 'M'),
+                to_cigar_int(1, 'I'),
+                to_cigar_int(4, 'M')
+            ]
+        );
+        assert!(myers_align(&read, &reference, 5, 0).is_none());
+
+        // more than one 64 bit block
+        let long_read: Vec<i8> = (0..150).map(|i| ((i * 7 + i / 3) % 4) as i8).collect();
+        let mut long_reference: Vec<i8> = vec![3; 40];
+        long_reference.extend(long_read.iter());
+        long_reference[40 + 100] = (long_reference[40 + 100] + 1) % 4;
+        long_reference.extend(vec![2; 40]);
+        let aln = myers_align(&long_read, &long_reference, 5, 3).unwrap();
+        assert_eq!(aln.distance, 1);
+        assert_eq!((aln.ref_begin1, aln.ref_end1), (40, 189));
+    }
+
     #[test]
     fn simple_01() {
         let vec_u8x16: Vec<u8x16> = vec![